@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""Helpers shared by the benchmark scripts"""
+import math
+import time
+from typing import Callable, List, Sequence
+
+
+QUERIES = ("Bre", "Wro", "Par", "Lon", "New", "San", "Kyi", "Ber", "Mos", "Tok")
+
+
+def measure(call: Callable[[int], object], iterations: int) -> List[float]:
+    """Calls the function with the iteration numbers and gets the duration of every call in milliseconds"""
+    timings = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        call(i)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def percentile(timings: Sequence[float], percent: float) -> float:
+    """Gets the percentile of the timings by the nearest rank in the sorted timings"""
+    if not timings:
+        raise ValueError("Percentile of no timings is undefined")
+    ordered = sorted(timings)
+    rank = math.ceil(percent / 100 * len(ordered))
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
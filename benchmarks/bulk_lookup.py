@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Compares hydrating a page of stored city ids with CityDatabase.get_cities
+against calling CityDatabase.get_city in a loop.
+
+    python benchmarks/bulk_lookup.py --datasource pycities/data/data.db --page-sizes 10 100 500
+"""
+import argparse
+import random
+import time
+
+from pycities import CityDatabase, CityInfo, config
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--datasource", default=str(config.DEFAULT_DATA_SOURCE))
+    parser.add_argument("--page-sizes", type=int, nargs="+", default=[10, 100, 500, 2000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    db = CityDatabase[CityInfo](fetch_fields=config.CITY_MIN_FIELDS).connect(args.datasource)
+    city_ids = [row[0] for row in db.conn.execute(f"SELECT geonames_id FROM {config.CITY_TABLE_NAME}")]
+    rnd = random.Random(0)
+
+    print(f"{'page size':>10} {'get_city loop ms':>17} {'get_cities ms':>14} {'speedup':>8}")
+    for page_size in args.page_sizes:
+        pages = [rnd.sample(city_ids, page_size) for _ in range(args.repeat)]
+
+        start = time.perf_counter()
+        for page in pages:
+            [db.get_city(city_id, lang="en") for city_id in page]
+        loop_ms = (time.perf_counter() - start) * 1000 / args.repeat
+
+        start = time.perf_counter()
+        for page in pages:
+            db.get_cities(page, lang="en")
+        bulk_ms = (time.perf_counter() - start) * 1000 / args.repeat
+
+        print(f"{page_size:>10} {loop_ms:>17.2f} {bulk_ms:>14.2f} {loop_ms / bulk_ms:>7.1f}x")
+
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Compares latency of CityDatabase lookups with and without the per-language lookup tables.
+Both databases are temporary copies of the datasource, the lookup tables are built into one of them.
+
+    python benchmarks/lookup_tables.py --datasource pycities/data/data.db --languages en
+"""
+import argparse
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict
+
+from pycities import CityDatabase, CityInfo, config, datadump
+
+from _common import QUERIES, measure, percentile
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--datasource", default=str(config.DEFAULT_DATA_SOURCE))
+    parser.add_argument("--languages", nargs="*", default=["en"])
+    parser.add_argument("--iterations", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        joined, lookup = Path(tmp) / "joined.db", Path(tmp) / "lookup.db"
+        shutil.copyfile(args.datasource, joined)
+        shutil.copyfile(args.datasource, lookup)
+        conn = sqlite3.connect(lookup)
+        start = time.perf_counter()
+        datadump.create_city_lookup_tables(conn, args.languages)
+        conn.commit()
+        conn.close()
+        print(f"lookup tables built in {time.perf_counter() - start:.1f} s")
+
+        print(f"{'tables':>8} {'lang':>5} {'method':>12} {'mean ms':>9} {'p50 ms':>8} {'p99 ms':>8}")
+        for tables, path in (("joined", joined), ("lookup", lookup)):
+            db = CityDatabase[CityInfo](fetch_fields=config.CITY_MIN_FIELDS).connect(path)
+            city_ids = [row[0] for row in db.conn.execute(f"SELECT geonames_id FROM {config.CITY_TABLE_NAME}")]
+            rnd = random.Random(0)
+            ids = [rnd.choice(city_ids) for _ in range(args.iterations)]
+            for lang in ["", *args.languages]:
+                methods: Dict[str, Callable[[int], object]] = {
+                    "search": lambda i: db.search(QUERIES[i % len(QUERIES)], lang=lang, limit=20),
+                    "get_city": lambda i: db.get_city(ids[i], lang=lang),
+                    "get_cities": lambda i: db.get_cities(ids[i:i + 50], lang=lang),
+                }
+                for method, call in methods.items():
+                    timings = measure(call, args.iterations)
+                    print(
+                        f"{tables:>8} {lang or '-':>5} {method:>12} {statistics.mean(timings):>9.3f} "
+                        f"{percentile(timings, 50):>8.3f} {percentile(timings, 99):>8.3f}"
+                    )
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
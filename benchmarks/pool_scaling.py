@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Measures throughput of CityDatabase lookups made from several threads, with
+the single locked connection and with a pool of read-only connections.
+
+    python benchmarks/pool_scaling.py --datasource pycities/data/data.db --threads 1 2 4 8
+"""
+import argparse
+import random
+import threading
+import time
+
+from pycities import CityDatabase, CityInfo, config
+
+from _common import QUERIES
+
+
+def run_workload(db: CityDatabase, operations: int, seed: int) -> None:
+    rnd = random.Random(seed)
+    for i in range(operations):
+        if i % 2:
+            db.search(rnd.choice(QUERIES), limit=20)
+        else:
+            db.get_nearest(rnd.uniform(-60, 70), rnd.uniform(-180, 180), limit=5)
+
+
+def measure(db: CityDatabase, threads: int, operations: int) -> float:
+    workers = [threading.Thread(target=run_workload, args=(db, operations, seed)) for seed in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return threads * operations / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--datasource", default=str(config.DEFAULT_DATA_SOURCE))
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--operations", type=int, default=500, help="Lookups per thread")
+    args = parser.parse_args()
+
+    print(f"{'threads':>8} {'locked ops/s':>14} {'pooled ops/s':>14}")
+    for threads in args.threads:
+        locked_db = CityDatabase[CityInfo](fetch_fields=config.CITY_MIN_FIELDS).connect(args.datasource)
+        pooled_db = CityDatabase[CityInfo](fetch_fields=config.CITY_MIN_FIELDS).connect(
+            args.datasource, pool_size=threads
+        )
+        locked = measure(locked_db, threads, args.operations)
+        pooled = measure(pooled_db, threads, args.operations)
+        print(f"{threads:>8} {locked:>14.0f} {pooled:>14.0f}")
+        locked_db.close()
+        pooled_db.close()
+
+
+if __name__ == "__main__":
+    main()
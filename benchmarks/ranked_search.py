@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Measures search latency for 1-4 character prefixes with the FTS table built
+without prefix indexes and with them, for plain and ranked search.
+The datasource is copied to a temporary directory and isn't modified.
+
+    python benchmarks/ranked_search.py --datasource pycities/data/data.db
+"""
+import argparse
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from pycities import CityDatabase, CityInfo, config, datadump
+
+
+PREFIXES = ("P", "B", "S", "K", "Pa", "Be", "Sa", "Ky", "Par", "Ber", "San", "Kyi", "Pari", "Berl", "Sant", "Kyiv")
+
+
+def measure(db: CityDatabase, prefix: str, ranked: bool, iterations: int) -> float:
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        db.search(prefix, limit=10, ranked=ranked)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--datasource", default=str(config.DEFAULT_DATA_SOURCE))
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        datasource = Path(temp_dir) / "data.db"
+        shutil.copy(args.datasource, datasource)
+        results = {}
+        for indexes, prefix_lengths in (("no prefix", ()), ("prefix", config.FTS_PREFIX_LENGTHS)):
+            with sqlite3.connect(datasource) as conn:
+                datadump.create_city_names_fts(conn, prefix_lengths=prefix_lengths)
+
+            db = CityDatabase[CityInfo](fetch_fields=config.CITY_MIN_FIELDS).connect(datasource)
+            for prefix in PREFIXES:
+                for ranked in (False, True):
+                    results[(indexes, prefix, ranked)] = measure(db, prefix, ranked, args.iterations)
+            db.close()
+
+    print(f"{'prefix':>7} {'plain ms':>9} {'+indexes':>9} {'ranked ms':>10} {'+indexes':>9}")
+    for prefix in PREFIXES:
+        timings = [
+            results[(indexes, prefix, ranked)] for ranked in (False, True) for indexes in ("no prefix", "prefix")
+        ]
+        print(f"{prefix:>7} " + " ".join(f"{timing:>9.3f}" for timing in timings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Compares row factories: rows per second and memory per row of the created models.
+The rows are fetched once, so only the factories are measured.
+
+    python benchmarks/row_factories.py --datasource pycities/data/data.db --rows 100000
+"""
+import argparse
+import sqlite3
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from pycities import City, config, dict_factory, compile_row_factory
+
+
+FIELDS = ("id", "name", "administrative_name", "country_name", "longitude", "latitude", "population")
+
+
+@dataclass(frozen=True)
+class CityDataclass:
+    id: int
+    name: str
+    administrative_name: str
+    country_name: str
+    longitude: float
+    latitude: float
+    population: int
+
+
+class CityTuple(NamedTuple):
+    id: int
+    name: str
+    administrative_name: str
+    country_name: str
+    longitude: float
+    latitude: float
+    population: int
+
+
+class CitySlots:
+    __slots__ = FIELDS
+
+    def __init__(
+            self, id: int, name: str, administrative_name: str, country_name: str, longitude: float,
+            latitude: float, population: Optional[int] = None,
+    ) -> None:
+        self.id = id
+        self.name = name
+        self.administrative_name = administrative_name
+        self.country_name = country_name
+        self.longitude = longitude
+        self.latitude = latitude
+        self.population = population
+
+
+def make_factories() -> Dict[str, Callable]:
+    return {
+        "tuple": lambda _cursor, row: row,
+        "dict_factory": dict_factory,
+        "dict compiled": compile_row_factory(dict, FIELDS),
+        "dataclass via dict_factory": lambda cursor, row: CityDataclass(**dict_factory(cursor, row)),
+        "dataclass compiled": compile_row_factory(CityDataclass, FIELDS),
+        "NamedTuple compiled": compile_row_factory(CityTuple, FIELDS),
+        "__slots__ compiled": compile_row_factory(CitySlots, FIELDS),
+        "City compiled": compile_row_factory(City, FIELDS),
+    }
+
+
+def measure(factory: Callable, cursor: sqlite3.Cursor, rows: List[tuple], repeat: int) -> dict:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        [factory(cursor, row) for row in rows]
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    models = [factory(cursor, row) for row in rows]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del models
+    return {"rows_per_second": len(rows) / best, "bytes_per_row": used / len(rows)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--datasource", default=str(config.DEFAULT_DATA_SOURCE))
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.datasource)
+    fields = ",".join(config.CITY_SELECT_FIELDS[field] for field in FIELDS)
+    cursor = conn.execute(config.CITY_SELECT_TEMPLATE.format(fields).format("") + " LIMIT ?", (args.rows,))
+    rows = cursor.fetchall()
+    # Repeats the rows up to the requested number, the row tuples are shared so they don't count in memory
+    rows = (rows * (args.rows // len(rows) + 1))[:args.rows]
+
+    print(f"{'factory':<28} {'rows/s':>12} {'bytes/row':>10}")
+    for name, factory in make_factories().items():
+        result = measure(factory, cursor, rows, args.repeat)
+        print(f"{name:<28} {result['rows_per_second']:>12.0f} {result['bytes_per_row']:>10.0f}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Compares connect time and latency of lookups of CityDatabase and of SnapshotCityDatabase
+over a snapshot written from the same database into a temporary file.
+
+    python benchmarks/snapshot.py --datasource pycities/data/data.db
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict
+
+from pycities import CityDatabase, CityInfo, SnapshotCityDatabase, config
+from pycities.snapshot import write_snapshot
+
+from _common import QUERIES, measure, percentile
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--datasource", default=str(config.DEFAULT_DATA_SOURCE))
+    parser.add_argument("--iterations", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot_path = Path(tmp) / f"data.db{config.SNAPSHOT_FILE_SUFFIX}"
+        conn = sqlite3.connect(args.datasource)
+        start = time.perf_counter()
+        write_snapshot(conn, snapshot_path)
+        conn.close()
+        print(
+            f"snapshot written in {time.perf_counter() - start:.1f} s, "
+            f"{os.path.getsize(snapshot_path) / 2 ** 20:.1f} MiB, "
+            f"database {os.path.getsize(args.datasource) / 2 ** 20:.1f} MiB"
+        )
+
+        backends = {
+            "sqlite": lambda: CityDatabase[CityInfo](fetch_fields=config.CITY_MIN_FIELDS).connect(
+                args.datasource, mmap_size=1 << 30
+            ),
+            "kdtree": lambda: CityDatabase[CityInfo](fetch_fields=config.CITY_MIN_FIELDS).connect(
+                args.datasource, mmap_size=1 << 30, load_kdtree=True
+            ),
+            "snapshot": lambda: SnapshotCityDatabase[CityInfo](fetch_fields=config.CITY_MIN_FIELDS).connect(
+                snapshot_path
+            ),
+        }
+        print(f"{'backend':>8} {'method':>18} {'connect ms':>11} {'mean ms':>9} {'p50 ms':>8} {'p99 ms':>8}")
+        for backend, connect in backends.items():
+            start = time.perf_counter()
+            db = connect()
+            connect_ms = (time.perf_counter() - start) * 1000
+            city_ids = [city.id for city in db.get_in_bbox(-90, -180, 90, 180)]
+            rnd = random.Random(0)
+            points = [(rnd.uniform(-60, 70), rnd.uniform(-180, 180)) for _ in range(args.iterations)]
+            ids = [rnd.choice(city_ids) for _ in range(args.iterations)]
+
+            methods: Dict[str, Callable[[int], object]] = {
+                "search": lambda i: db.search(QUERIES[i % len(QUERIES)], limit=20),
+                "search ranked": lambda i: db.search(QUERIES[i % len(QUERIES)], limit=20, ranked=True),
+                "get_city": lambda i: db.get_city(ids[i], lang="en"),
+                "get_nearest": lambda i: db.get_nearest(*points[i], limit=5),
+                "get_within_radius": lambda i: db.get_within_radius(*points[i], 100),
+            }
+            for method, call in methods.items():
+                timings = measure(call, args.iterations)
+                print(
+                    f"{backend:>8} {method:>18} {connect_ms:>11.1f} {statistics.mean(timings):>9.3f} "
+                    f"{percentile(timings, 50):>8.3f} {percentile(timings, 99):>8.3f}"
+                )
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
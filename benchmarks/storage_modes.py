@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Compares latency of CityDatabase lookups with the database read from disk,
+through memory-mapped I/O and copied into memory.
+
+    python benchmarks/storage_modes.py --datasource pycities/data/data.db
+"""
+import argparse
+import random
+import statistics
+import time
+from typing import Callable, Dict
+
+from pycities import CityDatabase, CityInfo, config
+
+from _common import QUERIES, measure, percentile
+
+
+MODES: Dict[str, dict] = {
+    "disk": {},
+    "mmap": {"mmap_size": 1 << 30},
+    "memory": {"in_memory": True},
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--datasource", default=str(config.DEFAULT_DATA_SOURCE))
+    parser.add_argument("--iterations", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'mode':>8} {'method':>12} {'connect ms':>11} {'mean ms':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode, params in MODES.items():
+        start = time.perf_counter()
+        db = CityDatabase[CityInfo](fetch_fields=config.CITY_MIN_FIELDS).connect(args.datasource, **params)
+        connect_ms = (time.perf_counter() - start) * 1000
+        city_ids = [row[0] for row in db.conn.execute(f"SELECT geonames_id FROM {config.CITY_TABLE_NAME}")]
+        rnd = random.Random(0)
+        points = [(rnd.uniform(-60, 70), rnd.uniform(-180, 180)) for _ in range(args.iterations)]
+        ids = [rnd.choice(city_ids) for _ in range(args.iterations)]
+
+        methods: Dict[str, Callable[[int], object]] = {
+            "search": lambda i: db.search(QUERIES[i % len(QUERIES)], limit=20),
+            "get_city": lambda i: db.get_city(ids[i]),
+            "get_nearest": lambda i: db.get_nearest(*points[i], limit=5),
+        }
+        for method, call in methods.items():
+            timings = measure(call, args.iterations)
+            print(
+                f"{mode:>8} {method:>12} {connect_ms:>11.1f} {statistics.mean(timings):>9.3f} "
+                f"{percentile(timings, 50):>8.3f} {percentile(timings, 99):>8.3f}"
+            )
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
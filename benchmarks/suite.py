@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Runs the benchmark suite on synthetic GeoNames data and writes the results as JSON.
+The database is built with `pycities.build` from generated files, the throughput of every build stage is measured,
+then latency percentiles of the main lookups are measured from 1..N threads sharing a connection pool.
+Results of different runs can be compared key by key.
+
+    python benchmarks/suite.py --cities 100000 --alternate-names 8 --threads 1 2 4 --output results.json
+"""
+import argparse
+import datetime
+import json
+import platform
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from pycities import CityDatabase, CityInfo, build, config
+from _common import percentile
+from synthetic import SYLLABLES, generate_geonames
+
+
+# Rows loaded by every build stage, the throughput of the other stages is measured in cities per second
+STAGE_TABLES = {
+    "load countries": config.COUNTRY_TABLE_NAME,
+    "load administrative units": config.ADMINISTRATIVE_TABLE_NAME,
+    "load cities": config.CITY_TABLE_NAME,
+    "load alternate names": config.ALTERNATE_NAME_TABLE_NAME,
+}
+
+Operation = Callable[[CityDatabase, random.Random], object]
+
+
+def make_operations(city_ids: List[int]) -> Dict[str, Operation]:
+    return {
+        "search": lambda db, rnd: db.search(rnd.choice(SYLLABLES).capitalize(), limit=10),
+        "search_ranked": lambda db, rnd: db.search(rnd.choice(SYLLABLES).capitalize(), limit=10, ranked=True),
+        "search_fuzzy": lambda db, rnd: db.search("".join(rnd.sample(SYLLABLES, 3)), limit=10, fuzzy=True),
+        "get_city": lambda db, rnd: db.get_city(rnd.choice(city_ids)),
+        "get_nearest": lambda db, rnd: db.get_nearest(rnd.uniform(-80, 80), rnd.uniform(-180, 180), limit=5),
+        "get_within_radius": lambda db, rnd: db.get_within_radius(
+            rnd.uniform(-80, 80), rnd.uniform(-180, 180), 100.0, limit=20
+        ),
+    }
+
+
+def measure_build(directory: Path, datasource: Path, languages: List[str]) -> Dict[str, dict]:
+    timings = build.build_database(datasource, directory, languages=languages, download=False, fuzzy=True)
+    with sqlite3.connect(datasource) as conn:
+        counts = {
+            stage: conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+            for stage, table_name in STAGE_TABLES.items()
+        }
+
+    result = {}
+    for stage, seconds in timings.items():
+        rows = counts.get(stage, counts["load cities"])
+        result[stage] = {"seconds": seconds, "rows": rows, "rows_per_second": rows / seconds if seconds else None}
+    return result
+
+
+def measure_latency(db: CityDatabase, operation: Operation, threads: int, operations: int) -> dict:
+    def run(seed: int) -> List[float]:
+        rnd = random.Random(seed)
+        timings = []
+        for _ in range(operations):
+            start = time.perf_counter()
+            operation(db, rnd)
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
+
+    latencies: List[float] = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        # The result re-raises the error of a failed worker
+        for future in [executor.submit(run, seed) for seed in range(threads)]:
+            latencies.extend(future.result())
+    duration = time.perf_counter() - start
+    if not latencies:
+        raise ValueError("No latencies were measured, the number of threads and operations must be positive")
+
+    return {
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": statistics.mean(latencies),
+        "ops_per_second": len(latencies) / duration,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cities", type=int, default=10000)
+    parser.add_argument("--alternate-names", type=int, default=8, help="Alternate names per place")
+    parser.add_argument("--languages", nargs="+", default=list(config.DEFAULT_LANGUAGES))
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--operations", type=int, default=200, help="Lookups per thread")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark-results.json")
+    args = parser.parse_args()
+
+    results: dict = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "arguments": vars(args),
+        },
+    }
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        directory, datasource = Path(temp_dir) / "geonames", Path(temp_dir) / "data.db"
+        start = time.perf_counter()
+        counts = generate_geonames(directory, args.cities, args.alternate_names, seed=args.seed)
+        results["data"] = {**counts._asdict(), "generation_seconds": time.perf_counter() - start}
+        results["build"] = measure_build(directory, datasource, args.languages)
+
+        with sqlite3.connect(datasource) as conn:
+            city_ids = [row[0] for row in conn.execute(f"SELECT geonames_id FROM {config.CITY_TABLE_NAME}")]
+
+        results["queries"] = {}
+        for name, operation in make_operations(city_ids).items():
+            results["queries"][name] = {}
+            for threads in args.threads:
+                db = CityDatabase[CityInfo](fetch_fields=config.CITY_MIN_FIELDS).connect(datasource, pool_size=threads)
+                results["queries"][name][str(threads)] = measure_latency(db, operation, threads, args.operations)
+                db.close()
+
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+
+    for stage, stage_result in results["build"].items():
+        print(f"{stage:<26} {stage_result['seconds']:8.2f}s {stage_result['rows_per_second'] or 0:12.0f} rows/s")
+    print(f"{'query':<18} {'threads':>7} {'p50 ms':>8} {'p99 ms':>8} {'ops/s':>10}")
+    for name, by_threads in results["queries"].items():
+        for threads, latency in by_threads.items():
+            print(
+                f"{name:<18} {threads:>7} {latency['p50_ms']:>8.3f} {latency['p99_ms']:>8.3f} "
+                f"{latency['ops_per_second']:>10.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Generates synthetic GeoNames files: countries, administrative units, a cities archive and
+an alternate names archive in the formats of the GeoNames dump, at a configurable scale.
+The output is deterministic for the same arguments and seed.
+
+    python benchmarks/synthetic.py --directory /tmp/geonames --cities 100000 --alternate-names 8
+"""
+import argparse
+import io
+import math
+import os
+import random
+import string
+import zipfile
+from itertools import product
+from typing import List, NamedTuple, Sequence, Tuple, Union
+
+from pycities import config
+
+
+SYLLABLES = (
+    "ka", "ly", "bor", "lin", "ber", "wro", "par", "san", "to", "mi", "gra", "do", "vi", "nov", "ost", "ham",
+    "ri", "ze", "lo", "ma", "sk", "burg", "ville", "pol", "grad", "ton", "ford", "stadt", "ia", "en",
+)
+LANGUAGES = ("en", "uk", "pl", "ru", "de", "fr", "es", "it", "pt", "ja", "zh", "ar", None)
+COUNTRY_ID_START, ADMINISTRATIVE_ID_START, CITY_ID_START = 1_000_000, 2_000_000, 10_000_000
+ADMINISTRATIVE_UNITS_PER_COUNTRY = 20
+
+
+class GeneratedCounts(NamedTuple):
+    countries: int
+    administrative_units: int
+    cities: int
+    alternate_names: int
+
+
+def _name(rnd: random.Random) -> str:
+    return "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4))).capitalize()
+
+
+def _country_codes(count: int) -> List[str]:
+    return ["".join(letters) for letters in product(string.ascii_uppercase, repeat=2)][:count]
+
+
+def _write_lines(path: Union[str, os.PathLike], lines: Sequence[str]) -> None:
+    with open(path, "w", encoding="utf-8") as file:
+        file.writelines(lines)
+
+
+def _alternate_name_rows(
+        rnd: random.Random, geonames_id: int, name: str, per_place: int, next_id: int
+) -> Tuple[List[str], int]:
+    lines = []
+    for lang in rnd.sample(LANGUAGES, min(per_place, len(LANGUAGES))):
+        is_preferred = "1" if rnd.random() < 0.3 else ""
+        is_historic = "1" if rnd.random() < 0.05 else ""
+        lines.append(
+            f"{next_id}\t{geonames_id}\t{lang or ''}\t{name}-{lang or 'x'}\t{is_preferred}\t\t\t{is_historic}\t\t\n"
+        )
+        next_id += 1
+    return lines, next_id
+
+
+def generate_geonames(
+        directory: Union[str, os.PathLike],
+        cities: int,
+        alternate_names_per_place: int = 8,
+        countries: int = 100,
+        seed: int = 0,
+) -> GeneratedCounts:
+    """
+    Writes the country, administrative and cities files and the alternate names archive into the directory.
+    The cities archive is named by the default population threshold.
+
+    :param directory: Destination directory
+    :param cities: Number of cities
+    :param alternate_names_per_place: Number of alternate names of every country, administrative unit and city
+    :param countries: Number of countries, at most 676
+    :param seed: Seed of the random generator
+    :return: Numbers of generated rows
+    """
+
+    rnd = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    codes = _country_codes(countries)
+    places: List[Tuple[int, str]] = []
+
+    country_lines = []
+    for index, code in enumerate(codes):
+        geonames_id, name = COUNTRY_ID_START + index, f"{_name(rnd)} {code}"
+        places.append((geonames_id, name))
+        country_lines.append(
+            f"{code}\t{code}X\t{index:03d}\t{code}\t{name}\t{_name(rnd)}\t{rnd.randint(1000, 10 ** 7)}\t"
+            f"{rnd.randint(10 ** 4, 10 ** 8)}\tEU\t.{code.lower()}\tEUR\tEuro\t{index}\t\t\t{code.lower()}\t"
+            f"{geonames_id}\t\t\n"
+        )
+    _write_lines(os.path.join(directory, config.COUNTRIES_FILENAME), country_lines)
+
+    administrative_lines = []
+    for country_index, code in enumerate(codes):
+        for admin_index in range(1, ADMINISTRATIVE_UNITS_PER_COUNTRY + 1):
+            key = f"{code}.{admin_index:02d}"
+            geonames_id = ADMINISTRATIVE_ID_START + country_index * ADMINISTRATIVE_UNITS_PER_COUNTRY + admin_index
+            name = _name(rnd)
+            places.append((geonames_id, name))
+            administrative_lines.append(f"{key}\t{name}\t{name}\t{geonames_id}\n")
+    _write_lines(os.path.join(directory, config.ADMINISTRATIVE_FILENAME), administrative_lines)
+
+    cities_archive = os.path.join(directory, config.CITIES_ARCHIVE_FILENAME)
+    with zipfile.ZipFile(cities_archive, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        with zip_file.open(config.CITIES_FILENAME, "w") as member, io.TextIOWrapper(member, "utf-8") as file:
+            for index in range(cities):
+                geonames_id, name = CITY_ID_START + index, _name(rnd)
+                places.append((geonames_id, name))
+                code = rnd.choice(codes)
+                # Uniform on the sphere, so the density of cities is the same everywhere
+                latitude = math.degrees(math.asin(rnd.uniform(-1, 1)))
+                longitude = rnd.uniform(-180, 180)
+                population = int(15000 * math.exp(rnd.expovariate(1.0)))
+                alternate_names = ",".join(dict.fromkeys((name, name.upper(), f"{name} {rnd.choice(SYLLABLES)}")))
+                file.write(
+                    f"{geonames_id}\t{name}\t{name}\t{alternate_names}\t{latitude:.5f}\t{longitude:.5f}\tP\tPPL\t"
+                    f"{code}\t\t{rnd.randint(1, ADMINISTRATIVE_UNITS_PER_COUNTRY):02d}\t\t\t\t{population}\t\t"
+                    f"{rnd.randint(0, 3000)}\tUTC\t2024-01-01\n"
+                )
+
+    alternate_name_count, next_id = 0, 1
+    alternate_names_archive = os.path.join(directory, config.ALTERNATE_NAMES_ARCHIVE_FILENAME)
+    with zipfile.ZipFile(alternate_names_archive, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        with zip_file.open(config.ALTERNATE_NAMES_FILENAME, "w") as member, io.TextIOWrapper(member, "utf-8") as file:
+            for geonames_id, name in places:
+                lines, next_id = _alternate_name_rows(rnd, geonames_id, name, alternate_names_per_place, next_id)
+                file.writelines(lines)
+                alternate_name_count += len(lines)
+
+    return GeneratedCounts(len(codes), len(administrative_lines), cities, alternate_name_count)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--directory", required=True)
+    parser.add_argument("--cities", type=int, default=10000)
+    parser.add_argument("--alternate-names", type=int, default=8, help="Alternate names per place")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(generate_geonames(args.directory, args.cities, args.alternate_names, seed=args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,16 @@
 from . import config
+from .cache import ResultCache
+from .aio import AsyncCityDatabase
 from .database import CityDatabase
+from .snapshot import SnapshotCityDatabase
+from .stats import QueryStats
 from .model import (
     dict_factory,
     tuple_factory,
     list_factory,
     CityInfo,
+    City,
+    compile_row_factory,
     RowFactoryModelConfig
 )
 
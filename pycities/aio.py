@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from os import PathLike
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple, Union
+
+from . import config
+from .base import BaseCityDatabase
+from .cache import ResultCache, copy_row
+from .database import CityDatabase
+from .model import TCityModel
+from .spatial import Point
+from .stats import QueryStats
+
+
+def _freeze(value: Any) -> Hashable:
+    """Makes a hashable key of lookup arguments, lists of ids and points become tuples"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+
+def _copy_result(result: Any) -> Any:
+    if isinstance(result, list):
+        return [_copy_result(item) if isinstance(item, list) else copy_row(item) for item in result]
+    return copy_row(result)
+
+
+class _InFlight:
+    """A running lookup shared by concurrent identical requests"""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task) -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncCityDatabase(BaseCityDatabase[TCityModel]):
+    """
+    asyncio facade of `CityDatabase`. Lookups run on a bounded pool of worker threads,
+    every query takes its own read-only connection from a pool of the same size, so the event loop isn't blocked
+    and queries of different workers don't wait for one shared connection.
+
+    At most `max_pending` lookups are queued or running at once, further callers wait for a free slot.
+    A cancelled lookup is dropped if it hasn't started yet, a running query finishes and its result is discarded.
+    With `coalesce`, concurrent identical requests share one query and every caller gets its own copy of the result.
+    """
+
+    def __init__(
+            self,
+            fetch_fields: Optional[Tuple[str, ...]] = None,
+            *,
+            workers: int = config.ASYNC_WORKERS,
+            max_pending: int = config.ASYNC_MAX_PENDING,
+            coalesce: bool = True,
+            use_kdtree: bool = False,
+            result_cache: Optional[ResultCache] = None,
+            query_stats: Optional[QueryStats] = None,
+    ) -> None:
+        if workers < 1 or max_pending < 1:
+            raise ValueError("Number of workers and pending lookups must be positive")
+
+        super().__init__(fetch_fields, query_stats)
+        self.workers = workers
+        self.max_pending = max_pending
+        self.coalesce = coalesce
+        self.use_kdtree = use_kdtree
+        self.result_cache = result_cache
+        self._db: Optional[CityDatabase[TCityModel]] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._in_flight: Dict[Hashable, _InFlight] = {}
+        self._pending = 0
+
+    @property
+    def db(self) -> CityDatabase[TCityModel]:
+        """Gets the underlying synchronous database"""
+        if self._db is None:
+            raise RuntimeError("There is no connection to the datasource")
+        return self._db
+
+    @property
+    def pending(self) -> int:
+        """Gets the number of queued and running lookups"""
+        return self._pending
+
+    async def connect(
+            self, datasource: Union[str, PathLike] = config.DEFAULT_DATA_SOURCE, **params
+    ) -> 'AsyncCityDatabase':
+        """
+        Connects to the datasource with a pool of `workers` read-only connections
+
+        :param datasource: Path to the database file
+        :param params: Other parameters of `CityDatabase.connect` except `pool_size`
+        """
+
+        db = CityDatabase[self._row_cls](
+            fetch_fields=self.fetch_fields,
+            use_kdtree=self.use_kdtree,
+            result_cache=self.result_cache,
+            query_stats=self.query_stats,
+        )
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pycities")
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                executor, partial(db.connect, datasource, pool_size=self.workers, **params)
+            )
+        except BaseException:
+            executor.shutdown(wait=False)
+            raise
+
+        self._db, self._executor = db, executor
+        self._slots = asyncio.Semaphore(self.max_pending)
+        return self
+
+    async def close(self) -> None:
+        if self._executor is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+            self._executor = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def __aenter__(self) -> 'AsyncCityDatabase':
+        return self
+
+    async def __aexit__(self, *_exc_info) -> None:
+        await self.close()
+
+    async def _submit(self, method: str, args: tuple, kwargs: dict) -> Any:
+        """Runs the lookup on a worker when a slot is free"""
+
+        if self._executor is None or self._slots is None:
+            raise RuntimeError("There is no connection to the datasource")
+
+        await self._slots.acquire()
+        loop = asyncio.get_running_loop()
+        self._pending += 1
+
+        def release(_future) -> None:
+            self._pending -= 1
+            self._slots.release()
+
+        try:
+            future = self._executor.submit(getattr(self.db, method), *args, **kwargs)
+        except BaseException:
+            release(None)
+            raise
+        # The slot is freed when the lookup is done or cancelled before it started, not when its caller is cancelled
+        future.add_done_callback(lambda done: loop.call_soon_threadsafe(release, done))
+        return await asyncio.wrap_future(future)
+
+    async def _call(self, method: str, *args, **kwargs) -> Any:
+        if not self.coalesce:
+            return await self._submit(method, args, kwargs)
+
+        key = (method, _freeze(args), _freeze(kwargs))
+        in_flight = self._in_flight.get(key)
+        if in_flight is None:
+            in_flight = _InFlight(asyncio.ensure_future(self._submit(method, args, kwargs)))
+            self._in_flight[key] = in_flight
+            in_flight.task.add_done_callback(partial(self._forget, key, in_flight))
+
+        in_flight.waiters += 1
+        try:
+            result = await asyncio.shield(in_flight.task)
+        finally:
+            in_flight.waiters -= 1
+            # The shared lookup is cancelled only when all of its callers are
+            if in_flight.waiters == 0 and not in_flight.task.done():
+                in_flight.task.cancel()
+                self._forget(key, in_flight)
+        return _copy_result(result)
+
+    def _forget(self, key: Hashable, in_flight: _InFlight, *_args) -> None:
+        # A newer lookup with the same key may be running already
+        if self._in_flight.get(key) is in_flight:
+            del self._in_flight[key]
+
+    async def search(
+            self, query: str, *, lang: str = "", limit: int = -1, ranked: bool = False, fuzzy: bool = False
+    ) -> List[TCityModel]:
+        """See `CityDatabase.search`"""
+        return await self._call("search", query, lang=lang, limit=limit, ranked=ranked, fuzzy=fuzzy)
+
+    async def get_city(self, geonames_id: int, *, lang: str = "") -> Optional[TCityModel]:
+        """See `CityDatabase.get_city`"""
+        return await self._call("get_city", geonames_id, lang=lang)
+
+    async def get_cities(self, geonames_ids: Iterable[int], *, lang: str = "") -> List[Optional[TCityModel]]:
+        """See `CityDatabase.get_cities`"""
+        return await self._call("get_cities", list(geonames_ids), lang=lang)
+
+    async def get_nearest(
+            self, latitude: float, longitude: float, *, lang: str = "", limit: int = 1
+    ) -> List[TCityModel]:
+        """See `CityDatabase.get_nearest`"""
+        return await self._call("get_nearest", latitude, longitude, lang=lang, limit=limit)
+
+    async def get_nearest_many(
+            self, points: Iterable[Point], *, lang: str = "", limit: int = 1
+    ) -> List[List[TCityModel]]:
+        """See `CityDatabase.get_nearest_many`"""
+        return await self._call("get_nearest_many", list(points), lang=lang, limit=limit)
+
+    async def get_within_radius(
+            self, latitude: float, longitude: float, distance_km: float, **kwargs
+    ) -> List[TCityModel]:
+        """See `CityDatabase.get_within_radius`"""
+        return await self._call("get_within_radius", latitude, longitude, distance_km, **kwargs)
+
+    async def get_in_bbox(
+            self, min_latitude: float, min_longitude: float, max_latitude: float, max_longitude: float, **kwargs
+    ) -> List[TCityModel]:
+        """See `CityDatabase.get_in_bbox`"""
+        return await self._call("get_in_bbox", min_latitude, min_longitude, max_latitude, max_longitude, **kwargs)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import logging
+from typing import Dict, FrozenSet, Generic, Iterable, Optional, Tuple, Type
+
+from .model import TCityModel, RowFactory, RowFactoryModelConfig
+from .stats import QueryStats, MethodStats
+
+
+class BaseCityDatabase(Generic[TCityModel]):
+    """
+    Base of the city database backends: the model of cities and its row factory, the fetched fields,
+    checks of the lookup arguments and the lookup statistics
+    """
+
+    def __init__(
+            self,
+            fetch_fields: Optional[Tuple[str, ...]] = None,
+            query_stats: Optional[QueryStats] = None,
+    ) -> None:
+        self.fetch_fields = fetch_fields or ("*", )
+        self.query_stats = query_stats
+        self._log = logging.getLogger(self.__class__.__name__)
+        # Languages of the localized names, they are read from the datasource when it's connected
+        self._languages: FrozenSet[str] = frozenset()
+
+    @property
+    def _row_cls(self) -> Type[TCityModel]:
+        orig_class = self.__dict__.get("__orig_class__")
+        if not orig_class:
+            raise ValueError(
+                "Generic wasn't provided or an attempt was made to access from __init__ which is not allowed"
+            )
+        return orig_class.__args__[0]
+
+    def _get_row_factory(self, fetch_fields: Optional[Tuple[str, ...]] = None) -> RowFactory:
+        """Gets the factory of the model for rows of the fields, the fetched fields by default"""
+        return RowFactoryModelConfig.get(self._row_cls, fetch_fields or self.fetch_fields)
+
+    def _check_fields(self, fields: Tuple[str, ...], available: Iterable[str]) -> RowFactory:
+        """
+        Checks that the fields can be fetched into the model and gets its row factory
+
+        :param fields: Fetched fields
+        :param available: Fields the backend can fetch
+        :raises ValueError: If a field isn't available or the model can't be created from the fields
+        """
+
+        available = frozenset(available)
+        unknown = [field for field in fields if field not in available]
+        if unknown:
+            raise ValueError(f"Fields {unknown} can't be fetched by {self.__class__.__name__}")
+        return self._get_row_factory(fields)
+
+    def _check_lang(self, lang: str) -> None:
+        """
+        Checks that the datasource has names in the language, the empty string stands for the default names
+
+        :raises ValueError: If the language isn't supported
+        """
+
+        if lang and lang not in self._languages:
+            raise ValueError(f"Language {lang} is not supported by the datasource")
+
+    def stats(self) -> Dict[str, MethodStats]:
+        """Gets a snapshot of the lookup statistics per method, it's empty unless `query_stats` is set"""
+        return self.query_stats.snapshot() if self.query_stats is not None else {}
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Builds the city database from GeoNames files.
+
+    python -m pycities.build --output data.db --directory geonames --languages en de --population 5000
+
+Downloads run in parallel and every table is loaded as soon as its files are downloaded,
+so the countries, administrative units and cities are loaded while the large alternate names archive is downloading.
+The database is built next to the output file and replaces it only when the build succeeds.
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Sequence, Union
+
+from . import config
+from . import datadownload
+from . import datadump
+from .snapshot import write_snapshot
+
+
+_log = logging.getLogger(__name__)
+
+
+@contextmanager
+def _stage(timings: Dict[str, float], name: str) -> Iterator[None]:
+    start_time = time.perf_counter()
+    yield
+    timings[name] = time.perf_counter() - start_time
+    _log.info("%s finished in %.2fs", name, timings[name])
+
+
+def _download(
+        timings: Dict[str, float],
+        filename: str,
+        directory: Union[os.PathLike, str],
+        url: str,
+        progress: Optional[datadownload.ProgressCallback],
+) -> str:
+    with _stage(timings, f"download {filename}"):
+        return datadownload.download_file(filename, directory, url, progress=progress)[0]
+
+
+def _load_tables(
+        conn: sqlite3.Connection,
+        timings: Dict[str, float],
+        files: Dict[str, Future],
+        cities_filename: str,
+        languages: Sequence[str],
+) -> None:
+    """Loads every table as soon as its file is downloaded, the stages don't include the waiting for downloads"""
+    path = files[config.COUNTRIES_FILENAME].result()
+    with _stage(timings, "load countries"):
+        datadump.init_country_table(conn)
+        datadump.load_country_data(conn, path)
+    path = files[config.ADMINISTRATIVE_FILENAME].result()
+    with _stage(timings, "load administrative units"):
+        datadump.init_administrative_table(conn)
+        datadump.load_administrative_data(conn, path)
+    path = files[cities_filename].result()
+    with _stage(timings, "load cities"):
+        datadump.init_city_table(conn)
+        datadump.load_city_data(conn, path)
+    path = files[config.ALTERNATE_NAMES_ARCHIVE_FILENAME].result()
+    with _stage(timings, "load alternate names"):
+        datadump.init_alternate_name_table(conn)
+        datadump.load_alternate_names(conn, path, languages=languages)
+
+
+def build_database(
+        output: Union[os.PathLike, str],
+        directory: Union[os.PathLike, str],
+        *,
+        languages: Sequence[str] = config.DEFAULT_LANGUAGES,
+        min_population: int = config.CITY_MIN_POPULATION,
+        download: bool = True,
+        url: str = config.GEONAMES_URL,
+        progress: Optional[datadownload.ProgressCallback] = None,
+        lookup_tables: bool = False,
+        snapshot: bool = False,
+        fuzzy: bool = False,
+) -> Dict[str, float]:
+    """
+    Builds the database from GeoNames files
+
+    :param output: Path of the database file
+    :param directory: Directory of the GeoNames files
+    :param languages: Languages of localized names
+    :param min_population: Population threshold of the cities file, one of `config.CITY_POPULATION_THRESHOLDS`
+    :param download: Downloads new versions of the files if it's True, otherwise the files must be in the directory
+    :param url: Base URL of the GeoNames files
+    :param progress: Download progress callback, see `datadownload.download_file`
+    :param lookup_tables: Creates per-language lookup tables of cities with resolved names,
+        they make lookups faster at the cost of a larger database
+    :param snapshot: Writes the binary snapshot of cities next to the database, see `snapshot.SnapshotCityDatabase`
+    :param fuzzy: Creates the trigram index of fuzzy search, see `database.CityDatabase.search`
+    :return: Durations of the stages in seconds
+    """
+
+    if min_population not in config.CITY_POPULATION_THRESHOLDS:
+        raise ValueError(f"Population threshold must be one of {config.CITY_POPULATION_THRESHOLDS}")
+
+    os.makedirs(directory, exist_ok=True)
+    cities_filename = config.CITIES_ARCHIVE_FILENAME_TEMPLATE.format(population=min_population)
+    filenames = (
+        config.COUNTRIES_FILENAME,
+        config.ADMINISTRATIVE_FILENAME,
+        cities_filename,
+        config.ALTERNATE_NAMES_ARCHIVE_FILENAME,
+    )
+    build_path = f"{output}.build"
+    if os.path.exists(build_path):
+        os.remove(build_path)
+
+    timings: Dict[str, float] = {}
+    start_time = time.perf_counter()
+    conn = sqlite3.connect(build_path)
+    try:
+        with ThreadPoolExecutor(max_workers=config.DOWNLOAD_WORKERS) as executor:
+            files: Dict[str, Future] = {}
+            for filename in filenames:
+                if download:
+                    files[filename] = executor.submit(_download, timings, filename, directory, url, progress)
+                else:
+                    files[filename] = Future()
+                    files[filename].set_result(os.path.join(directory, filename))
+
+            try:
+                _load_tables(conn, timings, files, cities_filename, languages)
+            except BaseException:
+                # Downloads which haven't started are useless when the build fails
+                for future in files.values():
+                    future.cancel()
+                raise
+
+        datadump.write_build_info(conn, min_population=min_population)
+        with _stage(timings, "localize"):
+            for table_name in (config.COUNTRY_TABLE_NAME, config.ADMINISTRATIVE_TABLE_NAME, config.CITY_TABLE_NAME):
+                datadump.create_alternate_name_columns(conn, table_name, languages)
+        with _stage(timings, "index"):
+            datadump.create_city_names_fts(conn, fuzzy=fuzzy)
+            datadump.create_city_indexes(conn)
+            datadump.create_city_spatial_index(conn)
+        if lookup_tables:
+            with _stage(timings, "lookup tables"):
+                datadump.create_city_lookup_tables(conn, languages)
+        if snapshot:
+            with _stage(timings, "snapshot"):
+                write_snapshot(conn, f"{output}{config.SNAPSHOT_FILE_SUFFIX}", languages)
+    except BaseException:
+        conn.close()
+        # The partly built database is of no use, nothing is left behind by a failed build
+        os.remove(build_path)
+        raise
+    conn.close()
+
+    os.replace(build_path, output)
+    timings["total"] = time.perf_counter() - start_time
+    return timings
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m pycities.build", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--output", default=str(config.DEFAULT_DATA_SOURCE), help="Path of the database file")
+    parser.add_argument("--directory", default="geonames", help="Directory of the downloaded GeoNames files")
+    parser.add_argument("--languages", nargs="+", default=list(config.DEFAULT_LANGUAGES), help="Languages of names")
+    parser.add_argument(
+        "--population", type=int, choices=config.CITY_POPULATION_THRESHOLDS, default=config.CITY_MIN_POPULATION,
+        help="Population threshold of the cities file",
+    )
+    parser.add_argument("--no-download", action="store_true", help="Use the files in the directory as they are")
+    parser.add_argument("--url", default=config.GEONAMES_URL, help="Base URL of the GeoNames files")
+    parser.add_argument(
+        "--lookup-tables", action="store_true", help="Create per-language lookup tables for faster lookups"
+    )
+    parser.add_argument(
+        "--snapshot", action="store_true", help="Write the binary snapshot of cities next to the database"
+    )
+    parser.add_argument("--fuzzy", action="store_true", help="Create the trigram index of fuzzy search")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    timings = build_database(
+        args.output,
+        args.directory,
+        languages=args.languages,
+        min_population=args.population,
+        download=not args.no_download,
+        url=args.url,
+        lookup_tables=args.lookup_tables,
+        snapshot=args.snapshot,
+        fuzzy=args.fuzzy,
+    )
+    width = max(len(name) for name in timings)
+    for name, duration in timings.items():
+        print(f"{name:<{width}}  {duration:8.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import copy
+import dataclasses
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, NamedTuple, Optional, Tuple
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+def copy_row(row: Any) -> Any:
+    """
+    Copies a mutable row of a result, tuples, `sqlite3.Row` objects and frozen dataclasses
+    are returned as they are
+    """
+
+    if isinstance(row, (tuple, sqlite3.Row)):
+        return row
+    if dataclasses.is_dataclass(row) and row.__dataclass_params__.frozen:
+        return row
+    return copy.copy(row)
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache of query results with an optional time to live.
+    Results are stored as tuples and every hit returns a new list with copies of mutable rows,
+    so callers can't change the cached results.
+    One cache can be shared by several databases, their keys include the datasource.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None) -> None:
+        """
+        :param maxsize: Maximum number of cached results
+        :param ttl: Time to live of a result in seconds, results don't expire if it's None
+        """
+
+        if maxsize < 1:
+            raise ValueError("Cache size must be positive")
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._results: "OrderedDict[Hashable, Tuple[float, tuple]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get_or_fetch(self, key: Hashable, fetch: Callable[[], List[Any]]) -> List[Any]:
+        """Gets the cached result for the key or fetches and caches it"""
+
+        now = time.monotonic()
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and (self.ttl is None or cached[0] > now):
+                self._results.move_to_end(key)
+                self._hits += 1
+                return [copy_row(row) for row in cached[1]]
+            self._misses += 1
+
+        rows = tuple(fetch())
+        expires_at = now + self.ttl if self.ttl is not None else 0.0
+        with self._lock:
+            self._results[key] = (expires_at, rows)
+            self._results.move_to_end(key)
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+
+        return [copy_row(row) for row in rows]
+
+    def invalidate(self, predicate: Optional[Callable[[Hashable], bool]] = None) -> None:
+        """
+        Removes cached results
+
+        :param predicate: Removes only results whose keys match it, all results are removed if it's None
+        """
+
+        with self._lock:
+            if predicate is None:
+                self._results.clear()
+                return
+
+            for key in [key for key in self._results if predicate(key)]:
+                del self._results[key]
+
+    def info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(self._hits, self._misses, self.maxsize, len(self._results))
@@ -5,16 +5,54 @@ from pathlib import Path
 GEONAMES_URL = "https://download.geonames.org/export/dump/"
 DATA_DIR = Path(__file__).parent / "data"
 DEFAULT_DATA_SOURCE = DATA_DIR / "data.db"
+KDTREE_FILE_SUFFIX = ".kdtree"
+SNAPSHOT_FILE_SUFFIX = ".snapshot"
+# A snapshot or a KD-tree is written into a temporary file which replaces it when it's complete
+SNAPSHOT_PART_SUFFIX = KDTREE_PART_SUFFIX = ".tmp"
+DEFAULT_SNAPSHOT = Path(f"{DEFAULT_DATA_SOURCE}{SNAPSHOT_FILE_SUFFIX}")
+READ_ONLY_PRAGMAS = {
+    "cache_size": -65536,
+    "temp_store": "MEMORY",
+    "query_only": "ON",
+}
 
 COUNTRIES_FILENAME = "countryInfo.txt"
 ADMINISTRATIVE_FILENAME = "admin1CodesASCII.txt"
 CITIES_FILENAME, CITIES_ARCHIVE_FILENAME = "cities15000.txt", "cities15000.zip"
 ALTERNATE_NAMES_FILENAME, ALTERNATE_NAMES_ARCHIVE_FILENAME = "alternateNamesV2.txt", "alternateNamesV2.zip"
+CITIES_ARCHIVE_FILENAME_TEMPLATE = "cities{population}.zip"
+CITY_POPULATION_THRESHOLDS = (500, 1000, 5000, 15000)
+DEFAULT_LANGUAGES = ("uk", "pl", "en", "ru")
+MODIFICATIONS_FILENAME = "modifications-{date}.txt"
+DELETES_FILENAME = "deletes-{date}.txt"
+ALTERNATE_NAMES_MODIFICATIONS_FILENAME = "alternateNamesModifications-{date}.txt"
+ALTERNATE_NAMES_DELETES_FILENAME = "alternateNamesDeletes-{date}.txt"
+GEONAMES_DOWNLOAD_FILENAMES = (
+    COUNTRIES_FILENAME, ADMINISTRATIVE_FILENAME, CITIES_ARCHIVE_FILENAME, ALTERNATE_NAMES_ARCHIVE_FILENAME
+)
+
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+DOWNLOAD_TIMEOUT = 60.0
+DOWNLOAD_PART_SUFFIX = ".part"
+DOWNLOAD_METADATA_SUFFIX = ".meta"
 
 CITY_TABLE_NAME, CITY_FTS_TABLE_NAME = "city", "city_fts"
+CITY_RTREE_TABLE_NAME = "city_rtree"
+CITY_NAME_TABLE_NAME, CITY_TRIGRAM_TABLE_NAME = "city_name", "city_trigram"
+CITY_LOOKUP_TABLE_NAME = "city_lookup"
+CITY_TRIGRAM_VOCAB_TABLE_NAME = "city_trigram_vocab"
 ADMINISTRATIVE_TABLE_NAME = "administrative_unit"
 COUNTRY_TABLE_NAME = "country"
 ALTERNATE_NAME_TABLE_NAME = "alternate_name"
+LOCALIZED_NAME_TABLE_NAME = "localized_name"
+UPDATED_ID_TABLE_NAME = "updated_id"
+BUILD_INFO_TABLE_NAME = "build_info"
+
+# The cities file includes populated places above the population threshold and capitals of any size
+CITY_FEATURE_CLASS = "P"
+CITY_MIN_POPULATION = 15000
+CITY_CAPITAL_FEATURE_CODES = frozenset({"PPLC", "PPLG"})
 
 
 ADMINISTRATIVE_COLUMN_TYPES = {
@@ -80,6 +118,25 @@ ALTERNATE_NAME_COLUMN_TYPES = {
     "'from'": "TEXT",
     "'to'": "TEXT",
 }
+ALTERNATE_NAME_INDEXES = {
+    "geonames_ids_idx": ("geonames_id",),
+}
+CITY_INDEXES = {
+    "city_coordinates_idx": ("latitude", "longitude"),
+    "city_country_code_idx": ("country_code",),
+    "city_population_idx": ("population",),
+}
+CITY_RTREE_COLUMNS = ("id", "min_latitude", "max_latitude", "min_longitude", "max_longitude")
+
+# Pragmas of bulk loads which favour speed over durability. The rollback journal is kept in memory,
+# so a failed load is rolled back, but a crash during a load can corrupt the database and the build is started again.
+BUILD_PRAGMAS = {
+    "journal_mode": "MEMORY",
+    "synchronous": "OFF",
+    "cache_size": -262144,
+}
+LOAD_BATCH_SIZE = 10000
+ARCHIVE_READ_BUFFER_SIZE = 1 << 20
 
 
 CITY_SELECT_FIELDS = {
@@ -119,11 +176,109 @@ FTS_CITY_SEARCH_SELECT = CITY_SELECT_TEMPLATE + f"""
 INNER JOIN {CITY_FTS_TABLE_NAME} ON {CITY_TABLE_NAME}.geonames_id = {CITY_FTS_TABLE_NAME}.geonames_id
 WHERE {CITY_FTS_TABLE_NAME}.name MATCH ? || '*' LIMIT ?;
 """
+# Ranks matches by bm25, which is negative and lower for better matches, and raises more populated cities
+SEARCH_POPULATION_WEIGHT = 0.5
+FTS_CITY_SEARCH_RANKED_SELECT = CITY_SELECT_TEMPLATE + f"""
+INNER JOIN {CITY_FTS_TABLE_NAME} ON {CITY_TABLE_NAME}.geonames_id = {CITY_FTS_TABLE_NAME}.geonames_id
+WHERE {CITY_FTS_TABLE_NAME}.name MATCH ? || '*'
+ORDER BY bm25({CITY_FTS_TABLE_NAME}) - {SEARCH_POPULATION_WEIGHT} * LN({CITY_TABLE_NAME}.population + 1),
+{CITY_TABLE_NAME}.geonames_id
+LIMIT ?;
+"""
+FTS_PREFIX_LENGTHS = (2, 3, 4)
+# Fuzzy search takes candidates sharing the rarest trigrams of the query from the trigram index,
+# the trigrams are added while their names fit into the postings budget, then the candidates are ranked
+# by edit distance and population
+FUZZY_CANDIDATES = 200
+FUZZY_MAX_POSTINGS = 2000
+FUZZY_MIN_TRIGRAMS = 3
+FUZZY_CHARACTERS_PER_EDIT = 3
+CITY_TRIGRAM_DOC_COUNTS = f"SELECT term, doc FROM {CITY_TRIGRAM_VOCAB_TABLE_NAME} WHERE term IN ({{}})"
+CITY_TRIGRAM_SEARCH_SELECT = f"""
+SELECT {CITY_NAME_TABLE_NAME}.geonames_id, {CITY_NAME_TABLE_NAME}.name, {CITY_TABLE_NAME}.population
+FROM {CITY_TRIGRAM_TABLE_NAME}
+INNER JOIN {CITY_NAME_TABLE_NAME} ON {CITY_NAME_TABLE_NAME}.id = {CITY_TRIGRAM_TABLE_NAME}.rowid
+INNER JOIN {CITY_TABLE_NAME} ON {CITY_TABLE_NAME}.geonames_id = {CITY_NAME_TABLE_NAME}.geonames_id
+WHERE {CITY_TRIGRAM_TABLE_NAME} MATCH ? ORDER BY rank LIMIT ?
+"""
 CITY_SELECT_BY_ID = CITY_SELECT_TEMPLATE + f"""WHERE {CITY_TABLE_NAME}.geonames_id = ?"""
 CITY_SELECT_NEAREST = CITY_SELECT_TEMPLATE + f"""
-ORDER BY DISTANCE(?, ?, {CITY_TABLE_NAME}.latitude, {CITY_TABLE_NAME}.longitude) 
+ORDER BY DISTANCE(?, ?, {CITY_TABLE_NAME}.latitude, {CITY_TABLE_NAME}.longitude), {CITY_TABLE_NAME}.geonames_id
 LIMIT ?
 """
+CITY_RTREE_BOX_SELECT = f"""
+SELECT id FROM {CITY_RTREE_TABLE_NAME}
+WHERE max_latitude >= ? AND min_latitude <= ? AND max_longitude >= ? AND min_longitude <= ?
+"""
+CITY_SELECT_NEAREST_INDEXED = CITY_SELECT_TEMPLATE + f"""
+WHERE {CITY_TABLE_NAME}.geonames_id IN ({CITY_RTREE_BOX_SELECT} UNION ALL {CITY_RTREE_BOX_SELECT})
+AND DISTANCE(?, ?, {CITY_TABLE_NAME}.latitude, {CITY_TABLE_NAME}.longitude) <= ?
+ORDER BY DISTANCE(?, ?, {CITY_TABLE_NAME}.latitude, {CITY_TABLE_NAME}.longitude), {CITY_TABLE_NAME}.geonames_id
+LIMIT ?
+"""
+CITY_COUNT_NEAREST_INDEXED = f"""
+SELECT COUNT(*) FROM {CITY_TABLE_NAME}
+WHERE {CITY_TABLE_NAME}.geonames_id IN ({CITY_RTREE_BOX_SELECT} UNION ALL {CITY_RTREE_BOX_SELECT})
+AND DISTANCE(?, ?, {CITY_TABLE_NAME}.latitude, {CITY_TABLE_NAME}.longitude) <= ?
+"""
+NEAREST_SEARCH_RADIUS_KM = 50.0
+ITER_BATCH_SIZE = 256
+ASYNC_WORKERS = 4
+ASYNC_MAX_PENDING = 64
+STATS_LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0, 1000.0)
+CITY_SELECT_IN_BOX = CITY_SELECT_TEMPLATE + f"""
+WHERE {CITY_TABLE_NAME}.latitude BETWEEN ? AND ?
+AND ({CITY_TABLE_NAME}.longitude BETWEEN ? AND ? OR {CITY_TABLE_NAME}.longitude BETWEEN ? AND ?)
+"""
+CITY_FILTERS = {
+    "country_code": f"{CITY_TABLE_NAME}.country_code = ?",
+    "admin1_code": f"{CITY_TABLE_NAME}.admin1_code = ?",
+    "min_population": f"{CITY_TABLE_NAME}.population >= ?",
+}
+CITY_WITHIN_RADIUS_ORDER = f"""
+AND DISTANCE(?, ?, {CITY_TABLE_NAME}.latitude, {CITY_TABLE_NAME}.longitude) <= ?
+ORDER BY DISTANCE(?, ?, {CITY_TABLE_NAME}.latitude, {CITY_TABLE_NAME}.longitude), {CITY_TABLE_NAME}.geonames_id
+LIMIT ?
+"""
+CITY_IN_BOX_ORDER = f"""
+ORDER BY {CITY_TABLE_NAME}.population DESC, {CITY_TABLE_NAME}.geonames_id
+LIMIT ?
+"""
+CITY_IDS_CTE_NAME = "city_ids"
+CITY_SELECT_BY_IDS = CITY_SELECT_TEMPLATE + f"""
+INNER JOIN {CITY_IDS_CTE_NAME} ON {CITY_TABLE_NAME}.geonames_id = {CITY_IDS_CTE_NAME}.geonames_id
+ORDER BY {CITY_IDS_CTE_NAME}.position
+"""
+CITY_SELECT_EXISTING_IDS = f"SELECT geonames_id FROM {CITY_TABLE_NAME} WHERE geonames_id IN ({{}})"
+# Every id takes two parameters, so a chunk stays within the default SQLite limit of 999 variables
+CITY_SELECT_BY_IDS_CHUNK_SIZE = 400
+
+# Per-language lookup tables hold cities with resolved names, one table per language and one without a suffix
+# for the default names. Queries of these fields read a lookup table without joins instead of the normalized tables.
+CITY_LOOKUP_FIELDS = (
+    "geonames_id", "name", "administrative_name", "country_name", "longitude", "latitude", "population",
+    "timezone", "ascii_name", "feature_class", "feature_code", "country_code", "cc2",
+    "admin1_code", "admin2_code", "admin3_code", "admin4_code", "elevation", "dem", "modification",
+)
+CITY_LOOKUP_SELECT_FIELDS = {
+    "id": f"{CITY_TABLE_NAME}.geonames_id AS id",
+    **{field: f"{CITY_TABLE_NAME}.{field} AS {field}" for field in CITY_LOOKUP_FIELDS},
+}
+# The lookup table takes the alias of the city table, so the conditions of the other templates apply to it as they are
+CITY_LOOKUP_SELECT_TEMPLATE = f"""
+SELECT
+{{}}
+FROM {CITY_LOOKUP_TABLE_NAME}{{{{0}}}} AS {CITY_TABLE_NAME}
+"""
+
+# Binary snapshots hold the fields of the lookup tables in columns of fixed-width items read through mmap.
+# Strings are stored as indexes of a shared string pool, the localized names have a column per language.
+SNAPSHOT_FIELDS = tuple(CITY_LOOKUP_SELECT_FIELDS)
+SNAPSHOT_LOCALIZED_FIELDS = ("name", "administrative_name", "country_name")
+SNAPSHOT_COLUMN_TYPECODES = {
+    "geonames_id": "q", "longitude": "d", "latitude": "d", "population": "q", "elevation": "q", "dem": "q",
+}
+SNAPSHOT_STRING_TYPECODE = "I"
 
 
 CITY_ALL_FIELDS = tuple(CITY_SELECT_FIELDS.keys())
@@ -1,60 +1,183 @@
 # -*- coding: utf-8 -*-
-import logging
+import inspect
+import math
+import os
 import sqlite3
 import sys
 import threading
-from functools import lru_cache
+import time
+from contextlib import closing, contextmanager, nullcontext
+from functools import lru_cache, partial
 from os import PathLike
-from typing import Optional, Generic, Union, Type, Tuple, List
+from pathlib import Path
+from typing import (
+    Optional, Union, Tuple, List, Sequence, Iterable, Iterator, Dict, Any, Callable, ContextManager,
+    FrozenSet, Hashable,
+)
 
 from . import config
-from .model import TCityModel, RowFactoryModelConfig
-from .utils import calculate_distance
+from .base import BaseCityDatabase
+from .cache import ResultCache
+from .datadump import city_lookup_languages, city_name_languages
+from .model import TCityModel
+from .pool import ConnectionPool, read_only_uri
+from .spatial import CityPoints, CityKDTree, Point
+from .stats import QueryStats, QueryPlan, instrumented
+from .utils import (
+    calculate_distance, calculate_bounding_boxes, edit_distance, name_trigrams, normalize_name,
+    MAX_DISTANCE_KM, BoundingBox,
+)
 
 
-class CityDatabase(Generic[TCityModel]):
+def _create_functions(conn: sqlite3.Connection) -> None:
+    functions = [("DISTANCE", 4, calculate_distance)]
+    try:
+        conn.execute("SELECT LN(1)")
+    except sqlite3.OperationalError:
+        # SQLite is built without math functions
+        functions.append(("LN", 1, math.log))
 
-    def __init__(self, fetch_fields: Optional[Tuple[str, ...]] = None, use_lock: bool = True) -> None:
+    for name, num_params, func in functions:
+        if sys.version_info >= (3, 8):
+            conn.create_function(name, num_params, func, deterministic=True)
+        else:
+            conn.create_function(name, num_params, func)
+
+
+@contextmanager
+def _holding(lock: ContextManager, value: Any) -> Iterator[Any]:
+    with lock:
+        yield value
+
+
+class CityDatabase(BaseCityDatabase[TCityModel]):
+
+    def __init__(
+            self,
+            fetch_fields: Optional[Tuple[str, ...]] = None,
+            use_lock: bool = True,
+            use_kdtree: bool = False,
+            result_cache: Optional[ResultCache] = None,
+            query_stats: Optional[QueryStats] = None,
+    ) -> None:
+        super().__init__(fetch_fields, query_stats)
         self.__conn: Optional[sqlite3.Connection] = None
+        self.__datasource: Optional[Union[str, PathLike]] = None
+        self._cache_source: Optional[Hashable] = None
         self.__cursor: Optional[sqlite3.Cursor] = None
-        self._log = logging.getLogger(self.__class__.__name__)
-        self.fetch_fields = fetch_fields or ("*", )
         self._lock = threading.Lock()
         self.use_lock = use_lock
+        self._has_spatial_index = False
+        self._has_trigram_index = False
+        self._lookup_languages: FrozenSet[str] = frozenset()
+        self._city_points: Optional[CityPoints] = None
+        self.use_kdtree = use_kdtree
+        self._kdtree: Optional[CityKDTree] = None
+        self._kdtree_lock = threading.Lock()
+        self._pool: Optional[ConnectionPool] = None
+        self.result_cache = result_cache
+        self._local = threading.local()
+        # Number of running `explain` calls, queries are captured only by the threads which run them
+        self._explain_count = 0
+        self._explain_lock = threading.Lock()
 
-    def connect(self, datasource: Union[str, PathLike] = config.DEFAULT_DATA_SOURCE, **params) -> 'CityDatabase':
-        """Creates a new connection to the datasource"""
+    def connect(
+            self,
+            datasource: Union[str, PathLike] = config.DEFAULT_DATA_SOURCE,
+            *,
+            load_kdtree: bool = False,
+            pool_size: int = 0,
+            in_memory: bool = False,
+            mmap_size: int = 0,
+            **params
+    ) -> 'CityDatabase':
+        """
+        Creates a new connection to the datasource
 
-        check_same_thread = params.get("check_same_thread", False)
-        self.__conn = sqlite3.connect(datasource, check_same_thread=check_same_thread, **params)
+        :param datasource: Path to the database file
+        :param load_kdtree: Loads or builds the KD-tree for nearest lookups right away instead of on first use
+        :param pool_size: Number of read-only connections which run queries of different threads in parallel.
+            With zero, all queries go through the single connection.
+        :param in_memory: Copies the whole datasource into a shared in-memory database
+        :param mmap_size: Maximum number of bytes of the database file accessed through memory-mapped I/O
+        :param params: Other parameters of `sqlite3.connect`
+        """
 
-        if sys.version_info >= (3, 8):
-            self.__conn.create_function("DISTANCE", 4, calculate_distance, deterministic=True)
+        # The model is only known after the constructor, so the fields are checked against it here
+        self._get_row_factory()
+        self.__datasource = datasource
+        self._cache_source = self._get_cache_source(datasource)
+        check_same_thread = params.pop("check_same_thread", False)
+        if in_memory:
+            memory_uri = f"file:pycities-{id(self)}?mode=memory&cache=shared"
+            self.__conn = sqlite3.connect(memory_uri, uri=True, check_same_thread=check_same_thread)
+            with closing(sqlite3.connect(datasource, **params)) as source_conn:
+                source_conn.backup(self.__conn)
+            self._set_read_only_pragmas(self.__conn, mmap_size)
         else:
-            self.__conn.create_function("DISTANCE", 4, calculate_distance)
+            self.__conn = sqlite3.connect(datasource, check_same_thread=check_same_thread, **params)
+            if mmap_size:
+                self.__conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+        _create_functions(self.__conn)
+
+        if pool_size:
+            if in_memory:
+                connect = partial(self._connect_read_only, memory_uri, mmap_size)
+            else:
+                params.pop("uri", None)
+                connect = partial(self._connect_read_only, read_only_uri(datasource), mmap_size, **params)
+            self._pool = ConnectionPool(connect, pool_size)
 
+        self._has_spatial_index = self._table_exists(config.CITY_RTREE_TABLE_NAME)
+        self._has_trigram_index = all(
+            self._table_exists(table_name)
+            for table_name in (
+                config.CITY_NAME_TABLE_NAME, config.CITY_TRIGRAM_TABLE_NAME, config.CITY_TRIGRAM_VOCAB_TABLE_NAME
+            )
+        )
+        self._lookup_languages = self._find_lookup_languages()
         self._log.info('Connected source "%s"', datasource)
         self._log.debug(f"Languages found: %s", ",".join(self.supported_languages))
+
+        if load_kdtree:
+            self.use_kdtree = True
+            _ = self.kdtree
         return self
 
+    def _get_cache_source(self, datasource: Union[str, PathLike]) -> Hashable:
+        """Gets the part of cache keys which tells apart results of different datasources"""
+        datasource = os.fspath(datasource)
+        if datasource == ":memory:" or datasource.startswith("file:"):
+            # Such databases can't be identified by a path, so their results are only shared by this instance
+            return datasource, id(self)
+        return os.path.abspath(datasource)
+
+    @staticmethod
+    def _set_read_only_pragmas(conn: sqlite3.Connection, mmap_size: int = 0) -> None:
+        for pragma, value in config.READ_ONLY_PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        if mmap_size:
+            conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+
+    def _connect_read_only(self, uri: str, mmap_size: int = 0, **params) -> sqlite3.Connection:
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, **params)
+        self._set_read_only_pragmas(conn, mmap_size)
+        _create_functions(conn)
+        conn.row_factory = self._get_row_factory()
+        return conn
+
     @property
     def supported_languages(self) -> Tuple[str, ...]:
         """Gets a sequence of languages available in the database"""
-        result = self.conn.execute(
-            "SELECT SUBSTR(name, 6, 2) as languages FROM PRAGMA_TABLE_INFO(?) WHERE name LIKE 'name_' || '%'",
-            (config.CITY_TABLE_NAME,)
-        )
-        return tuple(lang[0] for lang in result)
+        return tuple(city_name_languages(self.conn))
 
-    @property
-    @lru_cache(1)
-    def _row_cls(self) -> Type[TCityModel]:
-        orig_class = self.__dict__.get("__orig_class__")
-        if not orig_class:
-            raise ValueError(
-                "Generic wasn't provided or an attempt was made to access from __init__ which is not allowed"
-            )
-        return orig_class.__args__[0]
+    def _find_lookup_languages(self) -> FrozenSet[str]:
+        """Gets languages of the lookup tables, the empty string stands for the table of the default names"""
+        return frozenset(city_lookup_languages(self.conn))
+
+    def _table_exists(self, table_name: str) -> bool:
+        result = self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,))
+        return result.fetchone() is not None
 
     @property
     def conn(self) -> sqlite3.Connection:
@@ -62,12 +185,50 @@ class CityDatabase(Generic[TCityModel]):
             raise RuntimeError("There is no connection to the datasource")
         return self.__conn
 
+    def _is_explaining(self) -> bool:
+        return self._explain_count > 0 and getattr(self._local, "queries", None) is not None
+
+    def __fetch_measured(
+            self,
+            acquire: ContextManager[Union[sqlite3.Cursor, sqlite3.Connection]],
+            sql_query: str,
+            params: tuple,
+    ) -> list:
+        """
+        Fetches rows like `__fetch_all` while measuring the time of waiting for the connection,
+        of SQLite and of the row factory separately, and captures the query for `explain`
+        """
+
+        queries = getattr(self._local, "queries", None)
+        if queries is not None:
+            queries.append((sql_query, params))
+
+        start = time.perf_counter()
+        with acquire as conn_or_cursor:
+            acquired = time.perf_counter()
+            conn = conn_or_cursor if isinstance(conn_or_cursor, sqlite3.Connection) else conn_or_cursor.connection
+            with closing(conn.cursor()) as cursor:
+                cursor.row_factory = None
+                rows = cursor.execute(sql_query, params).fetchall()
+            fetched = time.perf_counter()
+
+        row_factory = conn_or_cursor.row_factory
+        if row_factory is not None:
+            rows = [row_factory(cursor, row) for row in rows]
+        if self.query_stats is not None:
+            self.query_stats.add_query(acquired - start, fetched - acquired, time.perf_counter() - fetched)
+        return rows
+
     def __fetch_all(
             self,
             conn_or_cursor: Union[sqlite3.Cursor, sqlite3.Connection],
             sql_query: str,
             params: tuple
     ) -> list:
+        if self.query_stats is not None or self._is_explaining():
+            lock = self._lock if self.use_lock else nullcontext()
+            return self.__fetch_measured(_holding(lock, conn_or_cursor), sql_query, params)
+
         if not self.use_lock:
             return conn_or_cursor.execute(sql_query, params).fetchall()
 
@@ -75,43 +236,334 @@ class CityDatabase(Generic[TCityModel]):
             result: sqlite3.Cursor = conn_or_cursor.execute(sql_query, params)
             return result.fetchall()
 
+    def __fetch_cities(self, sql_query: str, params: tuple) -> List[TCityModel]:
+        if self._pool is None:
+            return self.__fetch_all(self.cursor, sql_query, params)
+
+        if self.query_stats is not None or self._is_explaining():
+            return self.__fetch_measured(self._pool.connection(), sql_query, params)
+
+        with self._pool.connection() as conn:
+            return conn.execute(sql_query, params).fetchall()
+
+    def __iter_cities(self, sql_query: str, params: tuple, batch_size: int) -> Iterator[TCityModel]:
+        """
+        Yields cities of the query fetched in batches. The iterator has its own cursor on the main connection,
+        which is closed when the iterator is exhausted, closed or garbage collected. The lock is only held
+        while a batch is fetched, so other queries can run while the iterator is partially consumed.
+        """
+
+        if self.query_stats is not None or self._is_explaining():
+            yield from self.__iter_cities_measured(sql_query, params, batch_size)
+            return
+
+        lock = self._lock if self.use_lock else nullcontext()
+        cursor = self.conn.cursor()
+        cursor.row_factory = self._get_row_factory()
+        try:
+            with lock:
+                cursor.execute(sql_query, params)
+            while True:
+                with lock:
+                    rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cursor.close()
+
+    def __iter_cities_measured(self, sql_query: str, params: tuple, batch_size: int) -> Iterator[TCityModel]:
+        """Yields cities like `__iter_cities`, measuring every batch like `__fetch_measured`"""
+
+        queries = getattr(self._local, "queries", None)
+        if queries is not None:
+            queries.append((sql_query, params))
+
+        lock = self._lock if self.use_lock else nullcontext()
+        row_factory = self._get_row_factory()
+        cursor = self.conn.cursor()
+        cursor.row_factory = None
+        try:
+            fetch = partial(cursor.execute, sql_query, params)
+            while True:
+                start = time.perf_counter()
+                with lock:
+                    acquired = time.perf_counter()
+                    if fetch is not None:
+                        fetch()
+                        fetch = None
+                    rows = cursor.fetchmany(batch_size)
+                fetched = time.perf_counter()
+                if row_factory is not None:
+                    rows = [row_factory(cursor, row) for row in rows]
+                if self.query_stats is not None:
+                    self.query_stats.add_query(acquired - start, fetched - acquired, time.perf_counter() - fetched)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cursor.close()
+
     @property
     def cursor(self) -> sqlite3.Cursor:
         if not self.__cursor:
             self.__cursor = self.conn.cursor()
-            self.__cursor.row_factory = RowFactoryModelConfig.get(self._row_cls)
+            self.__cursor.row_factory = self._get_row_factory()
         return self.__cursor
 
     @staticmethod
     @lru_cache(None)
-    def _prepare_select_template(field_names: Tuple[str, ...], template_query: str, lang: str = "") -> str:
-        fields = (config.CITY_SELECT_FIELDS[field] for field in field_names)
+    def _prepare_select_template(
+            field_names: Tuple[str, ...], template_query: str, lang: str = "", lookup: bool = False
+    ) -> str:
+        select_fields = config.CITY_SELECT_FIELDS
+        if lookup:
+            select_fields = config.CITY_LOOKUP_SELECT_FIELDS
+            template_query = template_query.replace(config.CITY_SELECT_TEMPLATE, config.CITY_LOOKUP_SELECT_TEMPLATE)
+        fields = (select_fields[field] for field in field_names)
         return template_query.format(",".join(fields)).format(f"_{lang}" if lang else "")
 
-    def search(self, query: str, *, lang: str = "", limit: int = -1) -> List[TCityModel]:
+    @property
+    def _lookup_fields_fetched(self) -> bool:
+        return all(field in config.CITY_LOOKUP_SELECT_FIELDS for field in self.fetch_fields)
+
+    def _select_query(self, template_query: str, lang: str) -> str:
+        """Prepares the query of the fetched fields, it reads the lookup table of the language if there is one"""
+        lookup = lang in self._lookup_languages and self._lookup_fields_fetched
+        return self._prepare_select_template(self.fetch_fields, template_query, lang, lookup)
+
+    def _fetch_by_ids(self, geonames_ids: Sequence[int], lang: str = "") -> List[TCityModel]:
+        """Fetches cities in the order of the given ids, the missing ones are skipped"""
+
+        select_query = self._select_query(config.CITY_SELECT_BY_IDS, lang)
+        result = []
+        for start in range(0, len(geonames_ids), config.CITY_SELECT_BY_IDS_CHUNK_SIZE):
+            chunk = geonames_ids[start:start + config.CITY_SELECT_BY_IDS_CHUNK_SIZE]
+            values = ", ".join(["(?, ?)"] * len(chunk))
+            query = f"WITH {config.CITY_IDS_CTE_NAME}(geonames_id, position) AS (VALUES {values})" + select_query
+            params = tuple(value for position, geonames_id in enumerate(chunk) for value in (geonames_id, position))
+            result.extend(self.__fetch_cities(query, params))
+        return result
+
+    @property
+    def city_points(self) -> CityPoints:
+        """Gets the array-backed city coordinates, they are loaded from the datasource on first access"""
+        if self._city_points is None:
+            rows = self.__fetch_all(
+                self.conn, f"SELECT geonames_id, latitude, longitude FROM {config.CITY_TABLE_NAME}", ()
+            )
+            self._city_points = CityPoints(rows)
+        return self._city_points
+
+    def _kdtree_path(self) -> Optional[Path]:
+        datasource = str(self.__datasource or ":memory:")
+        if datasource == ":memory:" or datasource.startswith("file:"):
+            return None
+        return Path(datasource + config.KDTREE_FILE_SUFFIX)
+
+    @property
+    def kdtree(self) -> CityKDTree:
+        """
+        Gets the KD-tree of city coordinates. It is loaded from the file next to the datasource
+        if that file is up-to-date, otherwise it is built and saved there.
+        Concurrent first callers wait for one of them to load it.
+        """
+        if self._kdtree is not None:
+            return self._kdtree
+
+        with self._kdtree_lock:
+            if self._kdtree is None:
+                self._kdtree = self._load_kdtree()
+        return self._kdtree
+
+    def _load_kdtree(self) -> CityKDTree:
+        city_count = self.__fetch_all(self.conn, f"SELECT COUNT(*) FROM {config.CITY_TABLE_NAME}", ())[0][0]
+        path = self._kdtree_path()
+        if path and path.exists() and path.stat().st_mtime >= Path(self.__datasource).stat().st_mtime:
+            try:
+                kdtree = CityKDTree.load(path)
+            except (OSError, EOFError, ValueError) as e:
+                self._log.warning('Failed to load KD-tree "%s": %s', path, e)
+            else:
+                if len(kdtree) == city_count:
+                    self._log.info('Loaded KD-tree "%s"', path)
+                    return kdtree
+
+        rows = self.__fetch_all(self.conn, f"SELECT geonames_id, latitude, longitude FROM {config.CITY_TABLE_NAME}", ())
+        kdtree = CityKDTree.build(rows)
+        if path:
+            try:
+                kdtree.save(path)
+                self._log.info('Saved KD-tree "%s"', path)
+            except OSError as e:
+                self._log.warning('Failed to save KD-tree "%s": %s', path, e)
+        return kdtree
+
+    def _cached(self, method: str, args: tuple, lang: str, fetch: Callable[[], List[TCityModel]]) -> List[TCityModel]:
+        if self.result_cache is None or self._is_explaining():
+            return fetch()
+
+        # A cache can be shared by databases of different datasources, so their results are kept apart
+        key = (method, args, lang, self.fetch_fields, self._row_cls, self._cache_source)
+        return self.result_cache.get_or_fetch(key, fetch)
+
+    @instrumented()
+    def search(
+            self, query: str, *, lang: str = "", limit: int = -1, ranked: bool = False, fuzzy: bool = False
+    ) -> List[TCityModel]:
         """
         Searches for cities based on a given query string.
         The search is carried out by the FTS5 module using the “alternate_names” column.
+        Ranked search orders cities by the bm25 relevance of the match combined with the logarithm
+        of population, so big cities come before small ones with similar names.
+        Fuzzy search tolerates typos: it finds names within an edit distance of the query or of its prefix,
+        one edit per `config.FUZZY_CHARACTERS_PER_EDIT` characters, and orders cities by the distance and population.
+        It needs the trigram index, which is built by `python -m pycities.build --fuzzy`,
+        see `datadump.create_city_trigram_index`.
 
         :param query: Input query string
         :param lang: Names in particular language for some columns
         :param limit: Limit of the result
+        :param ranked: Orders cities by relevance and population
+        :param fuzzy: Tolerates typos in the query, the cities are always ranked
         :return: List of suitable cities
+        :raises ValueError: If the search is fuzzy and the database has no trigram index
         """
 
-        select_query = self._prepare_select_template(self.fetch_fields, config.FTS_CITY_SEARCH_SELECT, lang)
-        result = self.__fetch_all(self.cursor, select_query, (query, limit))
+        if fuzzy:
+            if not self._has_trigram_index:
+                raise ValueError(
+                    "Fuzzy search needs the trigram index, rebuild the database with `python -m pycities.build --fuzzy`"
+                )
+            fetch = partial(self._fuzzy_search, query, lang, limit)
+            return self._cached("fuzzy_search", (query, limit), lang, fetch)
+
+        template = config.FTS_CITY_SEARCH_RANKED_SELECT if ranked else config.FTS_CITY_SEARCH_SELECT
+        select_query = self._select_query(template, lang)
+        fetch = partial(self.__fetch_cities, select_query, (query, limit))
+        result = self._cached("search", (query, limit, ranked), lang, fetch)
         return result
 
+    def _fuzzy_search(self, query: str, lang: str, limit: int) -> List[TCityModel]:
+        normalized = normalize_name(query)
+        trigrams = name_trigrams(normalized)
+        if not trigrams:
+            # Queries shorter than a trigram can only be matched as a prefix
+            select_query = self._select_query(config.FTS_CITY_SEARCH_RANKED_SELECT, lang)
+            return self.__fetch_cities(select_query, (query, limit))
+
+        # The rarest trigrams select the fewest candidates while common ones like "an" would match most names
+        doc_counts = dict(self.__fetch_all(
+            self.conn, config.CITY_TRIGRAM_DOC_COUNTS.format(", ".join(["?"] * len(trigrams))), tuple(trigrams)
+        ))
+        selected, postings = [], 0
+        for trigram in sorted((trigram for trigram in trigrams if trigram in doc_counts), key=doc_counts.get):
+            postings += doc_counts[trigram]
+            if len(selected) >= config.FUZZY_MIN_TRIGRAMS and postings > config.FUZZY_MAX_POSTINGS:
+                break
+            selected.append(trigram)
+        if not selected:
+            return []
+
+        match = " OR ".join('"{}"'.format(trigram.replace('"', '""')) for trigram in selected)
+        candidates = self.__fetch_all(self.conn, config.CITY_TRIGRAM_SEARCH_SELECT, (match, config.FUZZY_CANDIDATES))
+        max_distance = max(1, len(normalized) // config.FUZZY_CHARACTERS_PER_EDIT)
+        distances: Dict[str, float] = {}
+        scores: Dict[int, Tuple[float, int]] = {}
+        for geonames_id, name, population in candidates:
+            distance = distances.get(name)
+            if distance is None:
+                # The whole name is one of its prefixes, so names far from every prefix are skipped right away.
+                # Completing the query costs less than a typo, so "Wroc" finds "Wroclaw" after exact matches.
+                distance = edit_distance(normalized, name, max_distance, prefix=True)
+                if distance <= max_distance and name != normalized:
+                    distance = min(edit_distance(normalized, name, max_distance), distance + 0.5)
+                distances[name] = distance
+            score = (distance, -(population or 0))
+            if distance <= max_distance and score < scores.get(geonames_id, (math.inf, 0)):
+                scores[geonames_id] = score
+
+        geonames_ids = sorted(scores, key=lambda geonames_id: (scores[geonames_id], geonames_id))
+        return self._fetch_by_ids(geonames_ids if limit < 0 else geonames_ids[:limit], lang)
+
+    @instrumented()
+    def iter_search(
+            self,
+            query: str,
+            *,
+            lang: str = "",
+            limit: int = -1,
+            ranked: bool = False,
+            batch_size: int = config.ITER_BATCH_SIZE,
+    ) -> Iterator[TCityModel]:
+        """
+        Searches for cities like `search`, but yields them lazily, fetching them in batches
+
+        :param query: Input query string
+        :param lang: Names in particular language for some columns
+        :param limit: Limit of the result
+        :param ranked: Orders cities by relevance and population
+        :param batch_size: Number of cities fetched at once
+        :return: Iterator of suitable cities
+        """
+
+        template = config.FTS_CITY_SEARCH_RANKED_SELECT if ranked else config.FTS_CITY_SEARCH_SELECT
+        select_query = self._select_query(template, lang)
+        yield from self.__iter_cities(select_query, (query, limit), batch_size)
+
+    @instrumented(lambda city: int(city is not None))
     def get_city(self, geonames_id: int, *, lang: str = "") -> Optional[TCityModel]:
-        select_query = self._prepare_select_template(self.fetch_fields, config.CITY_SELECT_BY_ID, lang)
-        result = self.__fetch_all(self.cursor, select_query, (geonames_id,))
-        return result[0]
+        select_query = self._select_query(config.CITY_SELECT_BY_ID, lang)
+        fetch = partial(self.__fetch_cities, select_query, (geonames_id,))
+        result = self._cached("get_city", (geonames_id,), lang, fetch)
+        return result[0] if result else None
+
+    @instrumented(lambda cities: sum(city is not None for city in cities))
+    def get_cities(self, geonames_ids: Iterable[int], *, lang: str = "") -> List[Optional[TCityModel]]:
+        """
+        Gets cities by a batch of ids with one query per chunk of ids
+
+        :param geonames_ids: Sequence of city ids
+        :param lang: Names in particular language for some columns
+        :return: List of cities in the order of the ids, with None for the missing ones
+        """
+
+        geonames_ids = list(geonames_ids)
+        unique_ids = list(dict.fromkeys(geonames_ids))
+        rows = self._fetch_by_ids(unique_ids, lang)
+        found_ids = unique_ids
+        if len(rows) < len(unique_ids):
+            # Rows don't have to contain ids, so the ids of found cities are fetched separately
+            found_ids = self._existing_ids(unique_ids)
+
+        cities = dict(zip(found_ids, rows))
+        return [cities.get(geonames_id) for geonames_id in geonames_ids]
 
+    def _existing_ids(self, geonames_ids: Sequence[int], filters: Optional[Dict[str, Any]] = None) -> List[int]:
+        """Gets the ids of existing cities which pass the filters, in the order of the given ids"""
+
+        conditions, filter_params = "", ()
+        for filter_name, value in (filters or {}).items():
+            if value is not None:
+                conditions += f" AND {config.CITY_FILTERS[filter_name]}"
+                filter_params += (value,)
+
+        existing_ids = set()
+        for start in range(0, len(geonames_ids), config.CITY_SELECT_BY_IDS_CHUNK_SIZE):
+            chunk = tuple(geonames_ids[start:start + config.CITY_SELECT_BY_IDS_CHUNK_SIZE])
+            query = config.CITY_SELECT_EXISTING_IDS.format(", ".join(["?"] * len(chunk))) + conditions
+            existing_ids.update(row[0] for row in self.__fetch_all(self.conn, query, chunk + filter_params))
+        return [geonames_id for geonames_id in geonames_ids if geonames_id in existing_ids]
+
+    @instrumented()
     def get_nearest(self, latitude: float, longitude: float, *, lang: str = "", limit: int = 1) -> List[TCityModel]:
         """
         Gets nearest cities by given point with latitude and longitude
 
+        With `use_kdtree` the nearest cities are found by the in-memory KD-tree.
+        Otherwise, if the datasource has a spatial index, only cities within an expanding
+        bounding box around the point are compared instead of the whole table.
+
         :param latitude: Latitude of the point
         :param longitude: Longitude of the point
         :param lang: Names in particular language for some columns
@@ -119,11 +571,250 @@ class CityDatabase(Generic[TCityModel]):
         :return: List of nearest cities to the given point
         """
 
-        query = self._prepare_select_template(self.fetch_fields, config.CITY_SELECT_NEAREST, lang)
-        result = self.__fetch_all(self.cursor, query, (latitude, longitude, limit))
-        return result
+        if self.use_kdtree:
+            return self._fetch_by_ids(self.kdtree.nearest(latitude, longitude, limit), lang)
+
+        if not self._has_spatial_index or limit < 0 or not -90 <= latitude <= 90:
+            query = self._select_query(config.CITY_SELECT_NEAREST, lang)
+            return self.__fetch_cities(query, (latitude, longitude, limit))
+
+        query = self._select_query(config.CITY_SELECT_NEAREST_INDEXED, lang)
+        radius_km = config.NEAREST_SEARCH_RADIUS_KM
+        while True:
+            params = self._box_params(latitude, longitude, radius_km) + (latitude, longitude, limit)
+            result = self.__fetch_cities(query, params)
+            if len(result) >= limit or radius_km >= MAX_DISTANCE_KM:
+                return result
+
+            radius_km *= 2
+
+    @staticmethod
+    def _box_params(latitude: float, longitude: float, radius_km: float) -> tuple:
+        """Makes parameters of the indexed nearest queries for boxes of the circle"""
+
+        # The query always takes two boxes, an empty one is added when the circle doesn't cross the antimeridian
+        boxes = calculate_bounding_boxes(latitude, longitude, radius_km) + [(0.0, -1.0, 0.0, -1.0)]
+        box_params = tuple(
+            value for min_lat, max_lat, min_long, max_long in boxes[:2]
+            for value in (min_lat, max_lat, min_long, max_long)
+        )
+        return box_params + (latitude, longitude, radius_km)
+
+    @instrumented()
+    def iter_nearest(
+            self,
+            latitude: float,
+            longitude: float,
+            *,
+            lang: str = "",
+            limit: int = -1,
+            batch_size: int = config.ITER_BATCH_SIZE,
+    ) -> Iterator[TCityModel]:
+        """
+        Yields nearest cities by given point lazily, fetching them in batches
+
+        :param latitude: Latitude of the point
+        :param longitude: Longitude of the point
+        :param lang: Names in particular language for some columns
+        :param limit: Limit of the result
+        :param batch_size: Number of cities fetched at once
+        :return: Iterator of nearest cities to the given point
+        """
+
+        if self.use_kdtree:
+            nearest_ids = self.kdtree.nearest(latitude, longitude, limit)
+            for start in range(0, len(nearest_ids), batch_size):
+                yield from self._fetch_by_ids(nearest_ids[start:start + batch_size], lang)
+            return
+
+        if not self._has_spatial_index or limit < 0 or not -90 <= latitude <= 90:
+            query = self._select_query(config.CITY_SELECT_NEAREST, lang)
+            yield from self.__iter_cities(query, (latitude, longitude, limit), batch_size)
+            return
+
+        # Widens the circle until it holds enough cities, then streams them
+        radius_km = config.NEAREST_SEARCH_RADIUS_KM
+        while radius_km < MAX_DISTANCE_KM:
+            params = self._box_params(latitude, longitude, radius_km)
+            if self.__fetch_all(self.conn, config.CITY_COUNT_NEAREST_INDEXED, params)[0][0] >= limit:
+                break
+            radius_km *= 2
+
+        query = self._select_query(config.CITY_SELECT_NEAREST_INDEXED, lang)
+        params = self._box_params(latitude, longitude, radius_km) + (latitude, longitude, limit)
+        yield from self.__iter_cities(query, params, batch_size)
+
+    @instrumented(lambda cities: sum(len(nearest) for nearest in cities))
+    def get_nearest_many(
+            self, points: Iterable[Point], *, lang: str = "", limit: int = 1
+    ) -> List[List[TCityModel]]:
+        """
+        Gets nearest cities for a batch of points. City coordinates are loaded once
+        and kept in memory, and cities are fetched with one query per chunk of ids.
+
+        With `use_kdtree` every point is looked up in the KD-tree instead.
+
+        :param points: Sequence of (latitude, longitude) pairs
+        :param lang: Names in particular language for some columns
+        :param limit: Limit of the result per point
+        :return: List of nearest cities lists in the order of the points
+        """
+
+        if self.use_kdtree:
+            nearest_ids = [self.kdtree.nearest(latitude, longitude, limit) for latitude, longitude in points]
+        else:
+            nearest_ids = self.city_points.nearest_many(points, limit)
+        unique_ids = list(dict.fromkeys(geonames_id for ids in nearest_ids for geonames_id in ids))
+        cities = dict(zip(unique_ids, self._fetch_by_ids(unique_ids, lang)))
+        return [[cities[geonames_id] for geonames_id in ids] for ids in nearest_ids]
+
+    def _fetch_in_boxes(
+            self,
+            boxes: List[BoundingBox],
+            filters: Dict[str, Any],
+            order_query: str,
+            order_params: tuple,
+            lang: str,
+    ) -> List[TCityModel]:
+        """Fetches cities within one or two boxes which share the latitude range"""
+
+        query = self._select_query(config.CITY_SELECT_IN_BOX, lang)
+        (min_lat, max_lat, min_long, max_long), *rest = boxes
+        # The second longitude range is empty unless the box crosses the antimeridian
+        second_min_long, second_max_long = (rest[0][2], rest[0][3]) if rest else (0.0, -1.0)
+        params = (min_lat, max_lat, min_long, max_long, second_min_long, second_max_long)
+
+        for filter_name, value in filters.items():
+            if value is not None:
+                query += f"AND {config.CITY_FILTERS[filter_name]}\n"
+                params += (value,)
+
+        return self.__fetch_cities(query + order_query, params + order_params)
+
+    @instrumented()
+    def get_within_radius(
+            self,
+            latitude: float,
+            longitude: float,
+            distance_km: float,
+            *,
+            country_code: Optional[str] = None,
+            admin1_code: Optional[str] = None,
+            min_population: Optional[int] = None,
+            lang: str = "",
+            limit: int = -1,
+    ) -> List[TCityModel]:
+        """
+        Gets cities within the given distance of the point, ordered by distance.
+        The indexed bounding box of the circle is filtered first in SQL,
+        then the exact distance is checked for the remaining cities.
+        With `use_kdtree` the cities within the distance are found by the KD-tree and only filtered in SQL.
+
+        :param latitude: Latitude of the point
+        :param longitude: Longitude of the point
+        :param distance_km: Radius in kilometers
+        :param country_code: ISO code of the country of cities
+        :param admin1_code: Code of the administrative unit of cities, e.g. "72" for Lower Silesian Voivodeship
+        :param min_population: Minimal population of cities
+        :param lang: Names in particular language for some columns
+        :param limit: Limit of the result
+        :return: List of cities within the radius
+        """
+
+        filters = {"country_code": country_code, "admin1_code": admin1_code, "min_population": min_population}
+        if self.use_kdtree:
+            found_ids = [geonames_id for geonames_id, _ in self.kdtree.radius_search(latitude, longitude, distance_km)]
+            if any(value is not None for value in filters.values()):
+                found_ids = self._existing_ids(found_ids, filters)
+            return self._fetch_by_ids(found_ids if limit < 0 else found_ids[:limit], lang)
+
+        boxes = calculate_bounding_boxes(latitude, longitude, distance_km)
+        order_params = (latitude, longitude, distance_km, latitude, longitude, limit)
+        return self._fetch_in_boxes(boxes, filters, config.CITY_WITHIN_RADIUS_ORDER, order_params, lang)
+
+    @instrumented()
+    def get_in_bbox(
+            self,
+            min_latitude: float,
+            min_longitude: float,
+            max_latitude: float,
+            max_longitude: float,
+            *,
+            country_code: Optional[str] = None,
+            admin1_code: Optional[str] = None,
+            min_population: Optional[int] = None,
+            lang: str = "",
+            limit: int = -1,
+    ) -> List[TCityModel]:
+        """
+        Gets cities within the bounding box, the most populated first.
+        The box crosses the antimeridian if the minimal longitude is greater than the maximal one.
+
+        :param min_latitude: Southern latitude of the box
+        :param min_longitude: Western longitude of the box
+        :param max_latitude: Northern latitude of the box
+        :param max_longitude: Eastern longitude of the box
+        :param country_code: ISO code of the country of cities
+        :param admin1_code: Code of the administrative unit of cities, e.g. "72" for Lower Silesian Voivodeship
+        :param min_population: Minimal population of cities
+        :param lang: Names in particular language for some columns
+        :param limit: Limit of the result
+        :return: List of cities within the box
+        """
+
+        filters = {"country_code": country_code, "admin1_code": admin1_code, "min_population": min_population}
+        if min_longitude <= max_longitude:
+            boxes = [(min_latitude, max_latitude, min_longitude, max_longitude)]
+        else:
+            boxes = [
+                (min_latitude, max_latitude, min_longitude, 180.0),
+                (min_latitude, max_latitude, -180.0, max_longitude),
+            ]
+        return self._fetch_in_boxes(boxes, filters, config.CITY_IN_BOX_ORDER, (limit,), lang)
+
+    def explain(self, method: str, *args, **kwargs) -> List[QueryPlan]:
+        """
+        Gets plans of the SQL queries which the lookup method runs with the given arguments.
+        The method is actually called, so the queries which depend on results of the previous ones,
+        like widening nearest lookups, are explained as they run. The result cache is bypassed.
+
+        :param method: Name of the lookup method, e.g. "search"
+        :param args: Positional arguments of the method
+        :param kwargs: Keyword arguments of the method
+        :return: List of queries with their EXPLAIN QUERY PLAN output
+        """
+
+        if not getattr(getattr(type(self), method, None), "instrumented", False):
+            raise ValueError(f"{method} is not a lookup method")
+
+        queries: List[Tuple[str, tuple]] = []
+        self._local.queries = queries
+        with self._explain_lock:
+            self._explain_count += 1
+        try:
+            result = getattr(self, method)(*args, **kwargs)
+            if inspect.isgenerator(result):
+                for _ in result:
+                    pass
+        finally:
+            self._local.queries = None
+            with self._explain_lock:
+                self._explain_count -= 1
+
+        plans = []
+        for sql_query, params in queries:
+            depths: Dict[int, int] = {}
+            lines = []
+            for node_id, parent_id, _, detail in self.__fetch_all(self.conn, f"EXPLAIN QUERY PLAN {sql_query}", params):
+                depths[node_id] = depths.get(parent_id, -1) + 1
+                lines.append("  " * depths[node_id] + detail)
+            plans.append(QueryPlan(sql_query, params, lines))
+        return plans
 
     def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
         self.cursor.close()
         self.conn.close()
         self._log.info("Disconnected")
@@ -1,45 +1,225 @@
+import json
 import os
+import re
 import sys
+import threading
 import time
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
 from http.client import HTTPMessage
-from typing import Tuple, Union
+from typing import Callable, Dict, Iterable, Optional, Tuple, Union
 
-from urllib.request import urlretrieve
+from urllib.error import ContentTooShortError, HTTPError, URLError
+from urllib.request import Request, urlopen
 from urllib.parse import urljoin
 
+from . import config
 
-_start_time = 0.0
 
+ProgressCallback = Callable[[str, int, Optional[int]], None]
 
-def _on_chunk_received(count: int, block_size: int, total_size: int) -> None:
-    global _start_time
+_CONTENT_RANGE_PATTERN = re.compile(r"bytes (\d+)-\d+/(\d+|\*)")
+_stdout_lock = threading.Lock()
 
-    if count == 0:
-        _start_time = time.time()
-        return
 
-    duration_sec = time.time() - _start_time
-    progress_size = int(count * block_size)
-    speed_kbs = int(progress_size / (1024 * duration_sec))
-    percent = min(int(count * block_size * 100 / total_size), 100)
-    sys.stdout.write(
-        f"\rDownload...{percent}%, {progress_size / (1024 * 1024):.2f} MB, {speed_kbs} KB/s, {duration_sec:.0f}s"
-    )
-    sys.stdout.flush()
-    if percent >= 100:
-        print()
+class _ProgressPrinter:
+    """Prints the download progress of one file, at most once per the given interval"""
+
+    def __init__(self, interval: float = 1.0) -> None:
+        self.interval = interval
+        self._start_time = time.time()
+        self._printed_at = 0.0
+
+    def __call__(self, filename: str, downloaded: int, total: Optional[int]) -> None:
+        now = time.time()
+        finished = total is not None and downloaded >= total
+        if not finished and now - self._printed_at < self.interval:
+            return
+
+        self._printed_at = now
+        duration_sec = max(now - self._start_time, 1e-9)
+        percent = f"{min(int(downloaded * 100 / total), 100)}%" if total else "?%"
+        with _stdout_lock:
+            print(
+                f"{filename}: {percent}, {downloaded / (1024 * 1024):.2f} MB, "
+                f"{int(downloaded / (1024 * duration_sec))} KB/s, {duration_sec:.0f}s",
+                file=sys.stdout,
+                flush=True,
+            )
+
+
+def _read_metadata(path: str) -> Dict[str, Optional[Union[str, int]]]:
+    try:
+        with open(path + config.DOWNLOAD_METADATA_SUFFIX, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
 
+def _write_metadata(path: str, headers: HTTPMessage, size: Optional[int]) -> None:
+    metadata = {"etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified"), "size": size}
+    with open(path + config.DOWNLOAD_METADATA_SUFFIX, "w", encoding="utf-8") as file:
+        json.dump(metadata, file)
 
-def download_file(filename: str, directory: Union[os.PathLike, str], url: str,) -> Tuple[str, HTTPMessage]:
-    return urlretrieve(
-        urljoin(url, filename),
-        filename=os.path.join(directory, filename),
-        reporthook=_on_chunk_received
+
+def _is_complete(path: str, metadata: dict) -> bool:
+    """Checks that the file was completely downloaded and its part isn't being downloaded again"""
+    return (
+        os.path.exists(path)
+        and not os.path.exists(path + config.DOWNLOAD_PART_SUFFIX)
+        and metadata.get("size") == os.path.getsize(path)
     )
 
 
+def _has_same_size(request: Request, size: int, timeout: float) -> bool:
+    with urlopen(Request(request.full_url, method="HEAD"), timeout=timeout) as response:
+        content_length = response.headers.get("Content-Length")
+    return content_length is not None and int(content_length) == size
+
+
+def download_file(
+        filename: str,
+        directory: Union[os.PathLike, str],
+        url: str,
+        *,
+        progress: Optional[ProgressCallback] = None,
+        timeout: float = config.DOWNLOAD_TIMEOUT,
+) -> Tuple[str, HTTPMessage]:
+    """
+    Downloads the file into the directory.
+    The file is skipped if the server reports it's unchanged since the previous download,
+    a partially downloaded file is continued with a range request if the server supports it.
+
+    :param filename: Name of the file on the server and on disk
+    :param directory: Destination directory
+    :param url: Base URL of the files
+    :param progress: Callable that takes the file name, downloaded and total bytes,
+                     the progress is printed if it's None
+    :param timeout: Socket timeout in seconds
+    :return: Path of the file and headers of the response
+    """
+
+    path = os.path.join(directory, filename)
+    part_path = path + config.DOWNLOAD_PART_SUFFIX
+    progress = progress or _ProgressPrinter()
+    metadata = _read_metadata(path)
+    request = Request(urljoin(url, filename))
+
+    offset = 0
+    if _is_complete(path, metadata):
+        if not metadata.get("etag") and not metadata.get("last_modified"):
+            # The server doesn't send validators, so the size is the only thing to compare.
+            # If the size can't be requested, the file is downloaded again.
+            try:
+                same_size = _has_same_size(request, metadata["size"], timeout)
+            except URLError:
+                same_size = False
+            if same_size:
+                progress(filename, metadata["size"], metadata["size"])
+                return path, HTTPMessage()
+        if metadata.get("etag"):
+            request.add_header("If-None-Match", metadata["etag"])
+        if metadata.get("last_modified"):
+            request.add_header("If-Modified-Since", metadata["last_modified"])
+    elif os.path.exists(part_path) and (metadata.get("etag") or metadata.get("last_modified")):
+        offset = os.path.getsize(part_path)
+        request.add_header("Range", f"bytes={offset}-")
+        # The server sends the whole file instead of the range if it has changed since the part was downloaded
+        request.add_header("If-Range", metadata.get("etag") or metadata["last_modified"])
+
+    try:
+        response = urlopen(request, timeout=timeout)
+    except HTTPError as e:
+        if e.code == 304:
+            size = os.path.getsize(path)
+            progress(filename, size, size)
+            return path, e.headers
+        if e.code != 416 or not offset:
+            raise e
+        # The part can't be continued, it's downloaded from the start
+        with suppress(FileNotFoundError):
+            os.remove(part_path)
+        return download_file(filename, directory, url, progress=progress, timeout=timeout)
+
+    with response:
+        headers = response.headers
+        content_length = headers.get("Content-Length")
+        total = None
+        if response.status == 206:
+            match = _CONTENT_RANGE_PATTERN.match(headers.get("Content-Range", ""))
+            if match is None or int(match.group(1)) != offset:
+                raise HTTPError(request.full_url, 206, "Unexpected content range", headers, None)
+            total = int(match.group(2)) if match.group(2) != "*" else None
+            mode = "ab"
+        else:
+            offset = 0
+            total = int(content_length) if content_length is not None else None
+            mode = "wb"
+
+        _write_metadata(path, headers, total)
+        downloaded = offset
+        with open(part_path, mode) as file:
+            while True:
+                chunk = response.read(config.DOWNLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                file.write(chunk)
+                downloaded += len(chunk)
+                progress(filename, downloaded, total)
+
+    if total is not None and downloaded != total:
+        raise ContentTooShortError(
+            f"{filename}: retrieval incomplete, got only {downloaded} out of {total} bytes", (part_path, headers)
+        )
+
+    os.replace(part_path, path)
+    _write_metadata(path, headers, downloaded)
+    return path, headers
+
+
+def download_files(
+        filenames: Iterable[str],
+        directory: Union[os.PathLike, str],
+        url: str = config.GEONAMES_URL,
+        *,
+        max_workers: int = config.DOWNLOAD_WORKERS,
+        progress: Optional[ProgressCallback] = None,
+        timeout: float = config.DOWNLOAD_TIMEOUT,
+) -> Dict[str, str]:
+    """
+    Downloads files concurrently, see `download_file`
+
+    :param filenames: Names of the files on the server and on disk
+    :param directory: Destination directory
+    :param url: Base URL of the files
+    :param max_workers: Maximum number of parallel downloads
+    :param progress: Callable that takes the file name, downloaded and total bytes,
+                     the progress of every file is printed if it's None
+    :param timeout: Socket timeout in seconds
+    :return: Paths of the files by their names
+    """
+
+    filenames = list(filenames)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            filename: executor.submit(
+                download_file, filename, directory, url, progress=progress, timeout=timeout
+            )
+            for filename in filenames
+        }
+        return {filename: future.result()[0] for filename, future in futures.items()}
+
+
+def download_geonames(
+        directory: Union[os.PathLike, str],
+        url: str = config.GEONAMES_URL,
+        **kwargs,
+) -> Dict[str, str]:
+    """Downloads the country, administrative, cities and alternate names files, see `download_files`"""
+    return download_files(config.GEONAMES_DOWNLOAD_FILENAMES, directory, url, **kwargs)
+
+
 def file_unzip(to_directory: Union[os.PathLike, str], filepath: Union[str, os.PathLike]) -> None:
     with zipfile.ZipFile(filepath, "r") as zip_file:
         zip_file.extractall(path=to_directory)
-
@@ -1,9 +1,21 @@
 # -*- coding: utf-8 -*-
+import io
+import logging
 import os
 import sqlite3
-from typing import Sequence, Optional, Dict, Union, List
+import time
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+from functools import wraps
+from itertools import islice
+from typing import Sequence, Optional, Dict, Union, List, Iterator, Iterable, TextIO, FrozenSet
 
 from . import config
+from .utils import normalize_name
+
+
+_log = logging.getLogger(__name__)
 
 
 def _init_table(conn: sqlite3.Connection, table_name: str, column_types: Dict[str, str]) -> None:
@@ -12,25 +24,94 @@ def _init_table(conn: sqlite3.Connection, table_name: str, column_types: Dict[st
     conn.execute(f"CREATE TABLE {table_name} ({columns})")
 
 
-def data_loader(table_name: str, table_fields: Dict[str, str]):
+@contextmanager
+def open_data_file(filepath: Union[os.PathLike, str]) -> Iterator[TextIO]:
+    """
+    Opens a GeoNames text file. A zip archive is read without extracting it: the member with the same name
+    and the `.txt` extension is decompressed while it's read.
+    """
+
+    if not zipfile.is_zipfile(filepath):
+        with open(filepath, "r", encoding="utf-8") as file:
+            yield file
+        return
+
+    with zipfile.ZipFile(filepath, "r") as zip_file:
+        member_name = Path(filepath).with_suffix(".txt").name
+        with zip_file.open(member_name, "r") as member:
+            buffered = io.BufferedReader(member, buffer_size=config.ARCHIVE_READ_BUFFER_SIZE)
+            with io.TextIOWrapper(buffered, encoding="utf-8") as file:
+                yield file
+
+
+def parse_lines(file: TextIO) -> Iterator[List[Optional[str]]]:
+    """Splits lines of a GeoNames text file into values, comments are skipped and empty values become None"""
+    for line in file:
+        if line.startswith("#"):
+            continue
+
+        data = line.split("\t")
+        data[-1] = data[-1].replace("\n", "")
+        yield [item if item else None for item in data]
+
+
+def _batches(rows: Iterable[list], batch_size: int) -> Iterator[List[list]]:
+    rows = iter(rows)
+    batch = list(islice(rows, batch_size))
+    while batch:
+        yield batch
+        batch = list(islice(rows, batch_size))
+
+
+@contextmanager
+def _build_transaction(conn: sqlite3.Connection) -> Iterator[None]:
+    """
+    Runs a bulk load in its own transaction with `config.BUILD_PRAGMAS`,
+    the previous values of the pragmas are restored after it
+    """
+
+    if conn.in_transaction:
+        raise RuntimeError("Bulk loads run in their own transaction, commit or roll back the open one first")
+
+    saved_pragmas = {pragma: conn.execute(f"PRAGMA {pragma}").fetchone()[0] for pragma in config.BUILD_PRAGMAS}
+    try:
+        for pragma, value in config.BUILD_PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+
+        conn.execute("BEGIN")
+        try:
+            yield
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+    finally:
+        for pragma, value in saved_pragmas.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+
+
+def data_loader(table_name: str, table_fields: Dict[str, str], indexes: Optional[Dict[str, Sequence[str]]] = None):
+    query = f"INSERT INTO {table_name} ({','.join(table_fields.keys())}) VALUES ({','.join(['?'] * len(table_fields))})"
+
     def decorator(func: callable):
-        def wrapper(conn: sqlite3.Connection, filepath: Union[os.PathLike, str], *args, **kwargs):
-            with open(filepath, "r", encoding="utf-8") as file:
-                for line in file:
-                    if line.startswith("#"):
-                        continue
-
-                    data = line.split("\t")
-                    data[-1] = data[-1].replace("\n", "")
-                    data = [item if item else None for item in data]
-                    data = func(conn, data, *args, **kwargs)
-                    if data is None:
-                        continue
-
-                    query = (f"INSERT INTO {table_name} ({','.join(table_fields.keys())}) "
-                             f"VALUES ({','.join(['?'] * len(table_fields))})")
-                    conn.execute(query, data)
-                conn.commit()
+        @wraps(func)
+        def wrapper(conn: sqlite3.Connection, filepath: Union[os.PathLike, str], *args, **kwargs) -> int:
+            start_time = time.perf_counter()
+            row_count = 0
+            with open_data_file(filepath) as file, _build_transaction(conn):
+                rows = func(conn, parse_lines(file), *args, **kwargs)
+                for batch in _batches(rows, config.LOAD_BATCH_SIZE):
+                    conn.executemany(query, batch)
+                    row_count += len(batch)
+
+                for index_name, columns in (indexes or {}).items():
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name}({', '.join(columns)})")
+
+            duration = time.perf_counter() - start_time
+            _log.info(
+                "Loaded %d rows into %s in %.2fs, %.0f rows/s", row_count, table_name, duration, row_count / duration
+            )
+            return row_count
         return wrapper
     return decorator
 
@@ -49,59 +130,91 @@ def init_city_table(conn: sqlite3.Connection) -> None:
 
 def init_alternate_name_table(conn: sqlite3.Connection) -> None:
     _init_table(conn, config.ALTERNATE_NAME_TABLE_NAME, config.ALTERNATE_NAME_COLUMN_TYPES)
-    conn.execute('DROP INDEX IF EXISTS geonames_ids_idx')
-    conn.execute('CREATE INDEX "geonames_ids_idx" ON alternate_name("geonames_id")')
 
 
 @data_loader(config.COUNTRY_TABLE_NAME, config.COUNTRIES_COLUMN_TYPES)
-def load_country_data(_conn: sqlite3.Connection, row_data: List[str], *_args, **_kwargs) -> Optional[List[str]]:
-    return row_data
+def load_country_data(_conn: sqlite3.Connection, rows: Iterator[list], *_args, **_kwargs) -> Iterator[list]:
+    yield from rows
+
+
+def _country_ids(conn: sqlite3.Connection) -> Dict[str, int]:
+    return dict(conn.execute(f"SELECT iso, geonames_id FROM {config.COUNTRY_TABLE_NAME}"))
+
+
+def _administrative_ids(conn: sqlite3.Connection) -> Dict[str, int]:
+    return dict(conn.execute(f"SELECT key, geonames_id FROM {config.ADMINISTRATIVE_TABLE_NAME}"))
 
 
 @data_loader(config.ADMINISTRATIVE_TABLE_NAME, config.ADMINISTRATIVE_COLUMN_TYPES)
-def load_administrative_data(conn: sqlite3.Connection, row_data: List[str], *_args, **_kwargs) -> Optional[List[str]]:
-    country_code = row_data[0].split(".")[0]
-    country_id = conn.execute(
-        f"SELECT geonames_id FROM {config.COUNTRY_TABLE_NAME} WHERE iso = ?", (country_code,)
-    ).fetchone()[0]
-    row_data.append(country_id)
-    return row_data
+def load_administrative_data(conn: sqlite3.Connection, rows: Iterator[list], *_args, **_kwargs) -> Iterator[list]:
+    country_ids = _country_ids(conn)
+    for row_data in rows:
+        country_code = row_data[0].split(".")[0]
+        row_data.append(country_ids[country_code])
+        yield row_data
+
+
+def city_rows(conn: sqlite3.Connection, rows: Iterable[list]) -> Iterator[list]:
+    """Appends ids of the administrative unit and the country to parsed city rows"""
+    country_ids = _country_ids(conn)
+    administrative_ids = _administrative_ids(conn)
+    for row_data in rows:
+        admin_code, country_code = row_data[10], row_data[8]
+        row_data.append(administrative_ids.get(f"{country_code}.{admin_code}"))
+        row_data.append(country_ids[country_code])
+        yield row_data
 
 
 @data_loader(config.CITY_TABLE_NAME, config.CITIES_COLUMN_TYPES)
-def load_city_data(conn: sqlite3.Connection, row_data: List[str], *_args, **_kwargs) -> Optional[List[str]]:
-    admin_code, country_code = row_data[10], row_data[8]
-    admin_key = f"{country_code}.{admin_code}"
-
-    administrative_unit_id = conn.execute(
-        f"SELECT geonames_id FROM {config.ADMINISTRATIVE_TABLE_NAME} WHERE key = ?", (admin_key,)
-    ).fetchone()
-    administrative_unit_id = administrative_unit_id[0] if administrative_unit_id else None
-    country_id = conn.execute(
-        f"SELECT geonames_id FROM {config.COUNTRY_TABLE_NAME} WHERE iso = ?", (country_code,)
-    ).fetchone()[0]
-    row_data.append(administrative_unit_id)
-    row_data.append(country_id)
-    return row_data
-
-
-@data_loader(config.ALTERNATE_NAME_TABLE_NAME, config.ALTERNATE_NAME_COLUMN_TYPES)
-def load_alternate_names(conn: sqlite3.Connection, row_data: List[str], *_args, **kwargs) -> Optional[List[str]]:
-    geonames_id = row_data[1]
-    languages: List[Union[str, None]] = kwargs.get("languages", [])
-    languages.append(None)
-    for table_name in (config.COUNTRY_TABLE_NAME, config.CITY_TABLE_NAME, config.ADMINISTRATIVE_TABLE_NAME):
-        location_id = conn.execute(
-            f"SELECT geonames_id FROM {table_name} WHERE geonames_id = ?", (geonames_id,)
-        ).fetchone()
-        location_id = location_id[0] if location_id else None
-        if location_id and row_data[2] in languages:
-            return row_data
-
-    return None
+def load_city_data(conn: sqlite3.Connection, rows: Iterator[list], *_args, **_kwargs) -> Iterator[list]:
+    yield from city_rows(conn, rows)
+
+
+def known_geonames_ids(conn: sqlite3.Connection) -> FrozenSet[str]:
+    """Gets ids of all countries, administrative units and cities as strings, the way they are parsed from files"""
+    table_names = (config.COUNTRY_TABLE_NAME, config.CITY_TABLE_NAME, config.ADMINISTRATIVE_TABLE_NAME)
+    return frozenset(
+        str(row[0]) for table_name in table_names for row in conn.execute(f"SELECT geonames_id FROM {table_name}")
+    )
+
+
+@data_loader(config.ALTERNATE_NAME_TABLE_NAME, config.ALTERNATE_NAME_COLUMN_TYPES, config.ALTERNATE_NAME_INDEXES)
+def load_alternate_names(conn: sqlite3.Connection, rows: Iterator[list], *_args, **kwargs) -> Iterator[list]:
+    known_ids = known_geonames_ids(conn)
+    # Names without a language are always kept
+    languages = frozenset(kwargs.get("languages", ())) | {None}
+    for row_data in rows:
+        if row_data[1] in known_ids and row_data[2] in languages:
+            yield row_data
 
 
 def create_alternate_name_columns(conn: sqlite3.Connection, table_name: str, languages: Sequence[str]) -> None:
+    """
+    Adds a `name_<lang>` column for every language and fills it with the preferred non-historic alternate name.
+    The best name of every place and language is picked in one window function pass into a staging table,
+    then each column is filled by primary key lookups in it.
+    """
+
+    languages = list(languages)
+    conn.execute(f"DROP TABLE IF EXISTS temp.{config.LOCALIZED_NAME_TABLE_NAME}")
+    conn.execute(
+        f"CREATE TEMP TABLE {config.LOCALIZED_NAME_TABLE_NAME} "
+        f"(lang TEXT, geonames_id INTEGER, name TEXT, PRIMARY KEY (lang, geonames_id)) WITHOUT ROWID"
+    )
+    conn.execute(f"""
+INSERT INTO temp.{config.LOCALIZED_NAME_TABLE_NAME} (lang, geonames_id, name)
+SELECT lang, geonames_id, name FROM (
+    SELECT lang, geonames_id, name, ROW_NUMBER() OVER (
+        PARTITION BY geonames_id, lang ORDER BY is_preferred DESC, id
+    ) AS position
+    FROM {config.ALTERNATE_NAME_TABLE_NAME}
+    WHERE is_historic IS NULL
+    AND lang IN ({", ".join(["?"] * len(languages))})
+    AND geonames_id IN (SELECT geonames_id FROM {table_name})
+)
+WHERE position = 1
+    """, languages)
+
     for lang in languages:
         try:
             conn.execute(f"ALTER TABLE {table_name} ADD COLUMN name_{lang} TEXT")
@@ -110,22 +223,82 @@ def create_alternate_name_columns(conn: sqlite3.Connection, table_name: str, lan
                 raise e
 
         conn.execute(f"""
-
 UPDATE {table_name} SET name_{lang} = (
-    SELECT name FROM {config.ALTERNATE_NAME_TABLE_NAME} 
-    WHERE geonames_id = {table_name}.geonames_id AND lang = \"{lang}\" AND is_historic IS NULL
-    ORDER BY is_preferred DESC LIMIT 1
+    SELECT name FROM temp.{config.LOCALIZED_NAME_TABLE_NAME}
+    WHERE lang = ? AND geonames_id = {table_name}.geonames_id
 )
-        """)
+        """, (lang,))
+
+    conn.execute(f"DROP TABLE temp.{config.LOCALIZED_NAME_TABLE_NAME}")
+    conn.commit()
+
+
+def _city_name_rows(conn: sqlite3.Connection, where: str = "") -> Iterator[tuple]:
+    """Yields distinct normalized names of cities: the name, the ASCII name and every alternate name"""
+    query = f"SELECT geonames_id, name, ascii_name, alternate_names FROM {config.CITY_TABLE_NAME} {where}"
+    for geonames_id, name, ascii_name, alternate_names in conn.execute(query).fetchall():
+        names = [name, ascii_name] + (alternate_names.split(",") if alternate_names else [])
+        for normalized_name in dict.fromkeys(normalize_name(name) for name in names if name):
+            if normalized_name:
+                yield geonames_id, normalized_name
+
+
+def insert_city_names(conn: sqlite3.Connection, where: str = "") -> None:
+    """Adds names of the cities matching the condition to the trigram index"""
+    max_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {config.CITY_NAME_TABLE_NAME}").fetchone()[0]
+    conn.executemany(
+        f"INSERT INTO {config.CITY_NAME_TABLE_NAME}(geonames_id, name) VALUES (?, ?)", _city_name_rows(conn, where)
+    )
+    conn.execute(f"""
+INSERT INTO {config.CITY_TRIGRAM_TABLE_NAME}(rowid, name)
+SELECT id, name FROM {config.CITY_NAME_TABLE_NAME} WHERE id > ?
+    """, (max_id,))
+
+
+def create_city_trigram_index(conn: sqlite3.Connection) -> None:
+    """
+    Creates the trigram index of fuzzy search: a table of normalized names of every city
+    and an FTS5 `trigram` table with the table as its external content
+    """
 
+    conn.execute(f"DROP TABLE IF EXISTS {config.CITY_TRIGRAM_VOCAB_TABLE_NAME}")
+    conn.execute(f"DROP TABLE IF EXISTS {config.CITY_TRIGRAM_TABLE_NAME}")
+    conn.execute(f"DROP TABLE IF EXISTS {config.CITY_NAME_TABLE_NAME}")
+    conn.execute(
+        f"CREATE TABLE {config.CITY_NAME_TABLE_NAME} "
+        f"(id INTEGER PRIMARY KEY, geonames_id INTEGER NOT NULL, name TEXT NOT NULL)"
+    )
+    conn.execute(
+        f"CREATE INDEX {config.CITY_NAME_TABLE_NAME}_geonames_id ON {config.CITY_NAME_TABLE_NAME}(geonames_id)"
+    )
+    conn.execute(
+        f"CREATE VIRTUAL TABLE {config.CITY_TRIGRAM_TABLE_NAME} USING FTS5("
+        f"name, content='{config.CITY_NAME_TABLE_NAME}', content_rowid='id', tokenize='trigram')"
+    )
+    conn.execute(
+        f"CREATE VIRTUAL TABLE {config.CITY_TRIGRAM_VOCAB_TABLE_NAME} "
+        f"USING fts5vocab({config.CITY_TRIGRAM_TABLE_NAME}, 'row')"
+    )
+    insert_city_names(conn)
     conn.commit()
 
 
-def create_city_names_fts(conn: sqlite3.Connection) -> None:
+def create_city_names_fts(
+        conn: sqlite3.Connection, prefix_lengths: Sequence[int] = config.FTS_PREFIX_LENGTHS, fuzzy: bool = False
+) -> None:
+    """
+    Creates the full-text search table of city names
+
+    :param conn: Connection to the database
+    :param prefix_lengths: Lengths of the prefix indexes of the FTS5 table
+    :param fuzzy: Creates the trigram index of fuzzy search as well, see `create_city_trigram_index`
+    """
+
     conn.execute(f"DROP TABLE IF EXISTS {config.CITY_FTS_TABLE_NAME}")
+    prefix = f", prefix='{' '.join(str(length) for length in prefix_lengths)}'" if prefix_lengths else ""
     conn.execute(
         f"CREATE VIRTUAL TABLE {config.CITY_FTS_TABLE_NAME} "
-        f"USING FTS5(name, geonames_id, tokenize='unicode61 remove_diacritics 1');"
+        f"USING FTS5(name, geonames_id, tokenize='unicode61 remove_diacritics 1'{prefix});"
     )
     conn.execute(
         f"INSERT INTO {config.CITY_FTS_TABLE_NAME}(name, geonames_id) "
@@ -136,3 +309,108 @@ def create_city_names_fts(conn: sqlite3.Connection) -> None:
         f"SELECT name, geonames_id FROM {config.CITY_TABLE_NAME} WHERE alternate_names IS NULL;"
     )
     conn.commit()
+    if fuzzy:
+        create_city_trigram_index(conn)
+
+
+def create_city_indexes(conn: sqlite3.Connection) -> None:
+    for index_name, columns in config.CITY_INDEXES.items():
+        conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+        conn.execute(f"CREATE INDEX {index_name} ON {config.CITY_TABLE_NAME}({', '.join(columns)})")
+    conn.execute(f"ANALYZE {config.CITY_TABLE_NAME}")
+    conn.commit()
+
+
+def city_name_languages(conn: sqlite3.Connection) -> List[str]:
+    """Gets languages of the localized name columns of the city table"""
+    result = conn.execute(
+        "SELECT SUBSTR(name, 6, 2) as languages FROM PRAGMA_TABLE_INFO(?) WHERE name LIKE 'name_' || '%'",
+        (config.CITY_TABLE_NAME,)
+    )
+    return [lang for lang, in result]
+
+
+def city_lookup_table_name(lang: str = "") -> str:
+    return f"{config.CITY_LOOKUP_TABLE_NAME}_{lang}" if lang else config.CITY_LOOKUP_TABLE_NAME
+
+
+def city_lookup_languages(conn: sqlite3.Connection) -> List[str]:
+    """Gets languages of the existing lookup tables, the empty string stands for the table of the default names"""
+    prefix = config.CITY_LOOKUP_TABLE_NAME
+    result = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND (name = ? OR name GLOB ?)", (prefix, f"{prefix}_*")
+    )
+    return [name[len(prefix) + 1:] for name, in result]
+
+
+def insert_city_lookup_rows(conn: sqlite3.Connection, lang: str = "", where: str = "") -> None:
+    """Adds cities matching the condition with names resolved in the language to its lookup table"""
+    fields = ", ".join(config.CITY_SELECT_FIELDS[field] for field in config.CITY_LOOKUP_FIELDS)
+    select_query = config.CITY_SELECT_TEMPLATE.format(fields).format(f"_{lang}" if lang else "")
+    conn.execute(
+        f"INSERT OR REPLACE INTO {city_lookup_table_name(lang)} ({', '.join(config.CITY_LOOKUP_FIELDS)}) "
+        f"{select_query} {where}"
+    )
+
+
+def create_city_lookup_tables(conn: sqlite3.Connection, languages: Sequence[str]) -> None:
+    """
+    Creates read-optimized lookup tables of cities, one per language and one of the default names.
+    Every row holds the resolved names of the city, its administrative unit and country,
+    so lookups read one row by the primary key instead of joining three tables.
+    The lookup tables must be created after `create_alternate_name_columns` and recreated after it runs again.
+
+    :param conn: Connection to the database
+    :param languages: Languages of the `name_<lang>` columns
+    """
+
+    column_types = {
+        "geonames_id": "INTEGER PRIMARY KEY",
+        "name": "TEXT NOT NULL",
+        "administrative_name": "TEXT",
+        "country_name": "TEXT",
+        **{
+            field: config.CITIES_COLUMN_TYPES[field]
+            for field in config.CITY_LOOKUP_FIELDS if field in config.CITIES_COLUMN_TYPES and field != "geonames_id"
+        },
+    }
+    for lang in ("", *languages):
+        table_name = city_lookup_table_name(lang)
+        _init_table(conn, table_name, {field: column_types[field] for field in config.CITY_LOOKUP_FIELDS})
+        insert_city_lookup_rows(conn, lang)
+        for index_name, columns in config.CITY_INDEXES.items():
+            conn.execute(f"CREATE INDEX {table_name}_{index_name} ON {table_name}({', '.join(columns)})")
+        conn.execute(f"ANALYZE {table_name}")
+    conn.commit()
+
+
+def write_build_info(conn: sqlite3.Connection, **values) -> None:
+    """Records parameters of the build in the database, e.g. the population threshold of the cities file"""
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {config.BUILD_INFO_TABLE_NAME} (name TEXT NOT NULL PRIMARY KEY, value TEXT)"
+    )
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {config.BUILD_INFO_TABLE_NAME} (name, value) VALUES (?, ?)",
+        ((name, str(value)) for name, value in values.items()),
+    )
+    conn.commit()
+
+
+def read_build_info(conn: sqlite3.Connection) -> Dict[str, str]:
+    """Gets parameters of the build recorded by `write_build_info`, they are empty if the database has none"""
+    query = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?"
+    if conn.execute(query, (config.BUILD_INFO_TABLE_NAME,)).fetchone() is None:
+        return {}
+    return dict(conn.execute(f"SELECT name, value FROM {config.BUILD_INFO_TABLE_NAME}").fetchall())
+
+
+def create_city_spatial_index(conn: sqlite3.Connection) -> None:
+    conn.execute(f"DROP TABLE IF EXISTS {config.CITY_RTREE_TABLE_NAME}")
+    conn.execute(
+        f"CREATE VIRTUAL TABLE {config.CITY_RTREE_TABLE_NAME} USING rtree({', '.join(config.CITY_RTREE_COLUMNS)})"
+    )
+    conn.execute(
+        f"INSERT INTO {config.CITY_RTREE_TABLE_NAME}({', '.join(config.CITY_RTREE_COLUMNS)}) "
+        f"SELECT geonames_id, latitude, latitude, longitude, longitude FROM {config.CITY_TABLE_NAME};"
+    )
+    conn.commit()
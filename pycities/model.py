@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
+import dataclasses
+import inspect
 import sqlite3
 from dataclasses import dataclass
+from functools import lru_cache
 from sqlite3 import Cursor, Row
-from typing import TypeVar, Callable, Dict
+from typing import TypeVar, Callable, Dict, Optional, Tuple
+
+from . import config
 
 
 TCityModel = TypeVar("TCityModel")
@@ -29,6 +34,107 @@ def dict_factory(cursor: Cursor, row: tuple) -> dict:
     return {desc[0]: row[i] for i, desc in enumerate(cursor.description)}
 
 
+def _compile_init(cls_name: str, fields: Tuple[str, ...]) -> Callable[..., None]:
+    """Compiles a constructor which takes the fields as optional arguments, positionally or by name"""
+    parameters = ", ".join(f"{field}=None" for field in fields)
+    assignments = "".join(f"\n    self.{field} = {field}" for field in fields)
+    namespace: dict = {}
+    exec(f"def __init__(self, {parameters}):{assignments}\n", namespace)
+    namespace["__init__"].__qualname__ = f"{cls_name}.__init__"
+    return namespace["__init__"]
+
+
+class City:
+    """Default model with every field of `config.CITY_SELECT_FIELDS`, the fields which aren't fetched are None"""
+
+    __slots__ = tuple(field for field in config.CITY_SELECT_FIELDS if field != "*")
+    __init__ = _compile_init("City", __slots__)
+
+    def __eq__(self, other: object) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    # Cities are mutable, so they are compared by value but aren't hashable
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        fields = ", ".join(
+            f"{field}={getattr(self, field)!r}" for field in self.__slots__ if getattr(self, field) is not None
+        )
+        return f"{self.__class__.__name__}({fields})"
+
+
+def model_fields(row_cls: type) -> Tuple[str, ...]:
+    """Gets the fields of a dataclass, NamedTuple or `__slots__` class in the order of its constructor"""
+
+    if dataclasses.is_dataclass(row_cls):
+        return tuple(field.name for field in dataclasses.fields(row_cls) if field.init)
+    if issubclass(row_cls, tuple) and hasattr(row_cls, "_fields"):
+        return tuple(row_cls._fields)
+
+    slots = set()
+    for cls in row_cls.__mro__:
+        cls_slots = cls.__dict__.get("__slots__", ())
+        slots.update((cls_slots,) if isinstance(cls_slots, str) else cls_slots)
+    # Slots are declared in any order, the order of the fields is the order of the constructor parameters
+    parameters = inspect.signature(row_cls).parameters.values() if slots else ()
+    fields = [
+        parameter.name for parameter in parameters
+        if parameter.name in slots and parameter.kind is inspect.Parameter.POSITIONAL_OR_KEYWORD
+    ]
+    if not fields:
+        raise ValueError(f"{row_cls} is not a dataclass, NamedTuple or __slots__ class")
+    return tuple(fields)
+
+
+@lru_cache(None)
+def compile_row_factory(row_cls: type, fetch_fields: Tuple[str, ...]) -> RowFactory:
+    """
+    Compiles a positional row factory of a dataclass, NamedTuple or `__slots__` class for rows of `fetch_fields`.
+    The model is created from row items by index, so the column names aren't looked up for every row.
+
+    :param row_cls: Model class, its constructor takes the fields by name
+    :param fetch_fields: Selected fields, keys of `config.CITY_SELECT_FIELDS`
+    :raises ValueError: If a field isn't selectable, isn't a field of the model or a required field isn't fetched
+    """
+
+    if row_cls is dict:
+        return lambda _cursor, row: dict(zip(fetch_fields, row))
+
+    unknown = [field for field in fetch_fields if field == "*" or field not in config.CITY_SELECT_FIELDS]
+    if unknown:
+        raise ValueError(f"Fields {unknown} can't be fetched into {row_cls.__name__}, list the fields explicitly")
+
+    names = model_fields(row_cls)
+    extra = [field for field in fetch_fields if field not in names]
+    if extra:
+        raise ValueError(f"Fields {extra} are not fields of {row_cls.__name__}")
+    parameters = inspect.signature(row_cls).parameters
+    missing = [
+        name for name in names
+        if name not in fetch_fields and name in parameters and parameters[name].default is inspect.Parameter.empty
+    ]
+    if missing:
+        raise ValueError(f"Required fields {missing} of {row_cls.__name__} are not fetched")
+
+    if names == fetch_fields:
+        if issubclass(row_cls, tuple):
+            return lambda _cursor, row: tuple.__new__(row_cls, row)
+        return lambda _cursor, row: row_cls(*row)
+
+    positions = {field: index for index, field in enumerate(fetch_fields)}
+    args = []
+    for name in names:
+        if name not in positions:
+            break
+        args.append(f"row[{positions[name]}]")
+    args.extend(f"{name}=row[{positions[name]}]" for name in names[len(args):] if name in positions)
+    namespace = {"row_cls": row_cls}
+    exec(f"def row_factory(_cursor, row):\n    return row_cls({', '.join(args)})\n", namespace)
+    return namespace["row_factory"]
+
+
 class RowFactoryModelConfig:
 
     _row_factories: Dict[type, RowFactory] = {
@@ -43,8 +149,15 @@ class RowFactoryModelConfig:
         cls._row_factories[row_cls] = row_factory
 
     @classmethod
-    def get(cls, row_cls: type) -> RowFactory:
+    def get(cls, row_cls: type, fetch_fields: Optional[Tuple[str, ...]] = None) -> RowFactory:
+        """
+        Gets the factory set for the model. If there is none, or it's the default dict factory,
+        and the fields are listed explicitly, the factory is compiled by `compile_row_factory`.
+        """
+
         row_factory = cls._row_factories.get(row_cls)
+        if fetch_fields and "*" not in fetch_fields and (row_factory is None or row_factory is dict_factory):
+            return compile_row_factory(row_cls, tuple(fetch_fields))
         if not row_factory:
             raise ValueError(f"Factory for {row_cls} does not exists")
 
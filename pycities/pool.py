@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import queue
+import sqlite3
+from contextlib import contextmanager
+from os import PathLike
+from pathlib import Path
+from typing import Callable, Iterator, List, Union
+
+
+def read_only_uri(datasource: Union[str, PathLike]) -> str:
+    """Makes an URI which opens the database file as read-only and immutable"""
+    return f"{Path(datasource).resolve().as_uri()}?mode=ro&immutable=1"
+
+
+class ConnectionPool:
+    """
+    Fixed-size pool of connections. A connection is taken by one thread at a time,
+    so queries of different threads run in parallel without a shared lock.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], size: int) -> None:
+        if size < 1:
+            raise ValueError("Pool size must be positive")
+
+        self._connections: List[sqlite3.Connection] = [connect() for _ in range(size)]
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        for conn in self._connections:
+            self._idle.put(conn)
+
+    @property
+    def size(self) -> int:
+        return len(self._connections)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Takes an idle connection, waits for one if all of them are busy"""
+        conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self) -> None:
+        for conn in self._connections:
+            conn.close()
+        self._connections.clear()
@@ -0,0 +1,531 @@
+# -*- coding: utf-8 -*-
+"""
+Memory-mapped binary snapshots of the city database.
+
+A snapshot is written once from the database and read through mmap, so lookups don't run SQL queries.
+The file starts with a header and a directory of sections, every section is an array of fixed-width items:
+
+* columns of the city fields in the order of ids, strings are indexes of the string pool
+* the string pool, UTF-8 strings followed by their offsets
+* the search index, sorted distinct words of the city names with postings of city indexes
+* the KD-tree of city coordinates, see `spatial.CityKDTree`
+* city indexes sorted by latitude for bounding box lookups
+
+Sections are read as memoryviews of the mapped file, processes which map the same snapshot share its pages
+in the page cache, and opening a snapshot only reads the directory.
+"""
+import heapq
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from os import PathLike
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from . import config
+from .base import BaseCityDatabase
+from .datadump import city_name_languages
+from .model import TCityModel, RowFactory
+from .spatial import CityKDTree, Point
+from .stats import QueryStats, instrumented
+from .utils import name_tokens
+
+
+_HEADER = struct.Struct("<8sQ")
+_SECTION = struct.Struct("<32s8sQQ")
+_MAGIC = b"PYCSNP1" + (b"L" if sys.byteorder == "little" else b"B")
+_ALIGNMENT = 8
+_NULL_INTEGER = -(1 << 63)
+_NULL_STRING = (1 << 32) - 1
+_KDTREE_SECTIONS = ("kdtree_ids", "kdtree_xs", "kdtree_ys", "kdtree_zs", "kdtree_axes")
+
+
+class _StringPool:
+    """Distinct strings in the order they are added"""
+
+    def __init__(self) -> None:
+        self.indexes: Dict[str, int] = {}
+        self.offsets = array("I", [0])
+        self.data = array("B")
+
+    def add(self, value: Optional[str]) -> int:
+        if value is None:
+            return _NULL_STRING
+        index = self.indexes.get(value)
+        if index is None:
+            index = self.indexes[value] = len(self.offsets) - 1
+            self.data.frombytes(value.encode())
+            self.offsets.append(len(self.data))
+        return index
+
+
+def _column(field: str, values: Iterable[Any], strings: _StringPool) -> array:
+    typecode = config.SNAPSHOT_COLUMN_TYPECODES.get(field, config.SNAPSHOT_STRING_TYPECODE)
+    if typecode == "q":
+        return array(typecode, (_NULL_INTEGER if value is None else value for value in values))
+    if typecode == config.SNAPSHOT_STRING_TYPECODE:
+        return array(typecode, (strings.add(value) for value in values))
+    return array(typecode, values)
+
+
+def _select_cities(conn: sqlite3.Connection, fields: Sequence[str], lang: str = "") -> List[tuple]:
+    select_fields = ", ".join(config.CITY_SELECT_FIELDS[field] for field in fields)
+    query = config.CITY_SELECT_TEMPLATE.format(select_fields) + f"ORDER BY {config.CITY_TABLE_NAME}.geonames_id"
+    return conn.execute(query.format(f"_{lang}" if lang else "")).fetchall()
+
+
+def _snapshot_sections(conn: sqlite3.Connection, languages: Sequence[str]) -> Dict[str, array]:
+    strings = _StringPool()
+    sections: Dict[str, array] = {}
+    rows = _select_cities(conn, config.CITY_LOOKUP_FIELDS)
+    for position, field in enumerate(config.CITY_LOOKUP_FIELDS):
+        sections[field] = _column(field, (row[position] for row in rows), strings)
+    for lang in languages:
+        localized_rows = _select_cities(conn, config.SNAPSHOT_LOCALIZED_FIELDS, lang)
+        for position, field in enumerate(config.SNAPSHOT_LOCALIZED_FIELDS):
+            sections[f"{field}_{lang}"] = _column(field, (row[position] for row in localized_rows), strings)
+    sections["string_offsets"], sections["strings"] = strings.offsets, strings.data
+
+    # The full-text index holds the alternate names or the name if there are none, so the same words are found
+    postings: Dict[str, List[int]] = {}
+    names = conn.execute(
+        f"SELECT COALESCE(alternate_names, name) FROM {config.CITY_TABLE_NAME} ORDER BY geonames_id"
+    )
+    for index, (name,) in enumerate(names):
+        for word in dict.fromkeys(name_tokens(name)):
+            postings.setdefault(word, []).append(index)
+    # The order of UTF-8 bytes is the order of code points, so the words are looked up by their bytes
+    words = _StringPool()
+    sections["posting_offsets"], sections["postings"] = array("I", [0]), array("I")
+    for word in sorted(postings):
+        words.add(word)
+        sections["postings"].extend(postings[word])
+        sections["posting_offsets"].append(len(sections["postings"]))
+    sections["word_offsets"], sections["words"] = words.offsets, words.data
+
+    latitudes, longitudes = sections["latitude"], sections["longitude"]
+    kdtree = CityKDTree.build((index, latitudes[index], longitudes[index]) for index in range(len(latitudes)))
+    sections.update(zip(_KDTREE_SECTIONS, (kdtree.ids, kdtree.xs, kdtree.ys, kdtree.zs, kdtree.axes)))
+    latitude_order = sorted(range(len(latitudes)), key=lambda index: (latitudes[index], index))
+    sections["latitude_order"] = array("I", latitude_order)
+    sections["sorted_latitudes"] = array("d", (latitudes[index] for index in latitude_order))
+    return sections
+
+
+def write_snapshot(
+        conn: sqlite3.Connection, path: Union[str, PathLike], languages: Optional[Sequence[str]] = None
+) -> None:
+    """
+    Writes the snapshot of cities in the database. The file is replaced at once, so processes which have
+    the previous snapshot open keep reading it until they connect again.
+    Daily updates don't change the snapshot, it has to be written again after them.
+
+    :param conn: Connection to the database
+    :param path: Path of the snapshot file
+    :param languages: Languages of localized names, all languages of the database by default
+    """
+
+    if languages is None:
+        languages = city_name_languages(conn)
+    sections = _snapshot_sections(conn, languages)
+
+    entries, offset = [], _HEADER.size + _SECTION.size * len(sections)
+    for name, values in sections.items():
+        offset += -offset % _ALIGNMENT
+        entries.append(_SECTION.pack(name.encode(), values.typecode.encode(), offset, len(values)))
+        offset += len(values) * values.itemsize
+
+    part_path = f"{path}{config.SNAPSHOT_PART_SUFFIX}"
+    with open(part_path, "wb") as file:
+        file.write(_HEADER.pack(_MAGIC, len(sections)))
+        for entry in entries:
+            file.write(entry)
+        for values in sections.values():
+            file.write(bytes(-file.tell() % _ALIGNMENT))
+            values.tofile(file)
+    os.replace(part_path, path)
+
+
+class CitySnapshot:
+    """Sections of a snapshot file mapped into memory"""
+
+    def __init__(self, path: Union[str, PathLike]) -> None:
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.sections: Dict[str, memoryview] = {}
+        try:
+            magic, section_count = _HEADER.unpack_from(self._mmap)
+            if magic != _MAGIC:
+                raise ValueError(f"{path} is not a snapshot file of this platform")
+
+            with memoryview(self._mmap) as buffer:
+                for position in range(section_count):
+                    name, typecode, offset, count = _SECTION.unpack_from(
+                        self._mmap, _HEADER.size + position * _SECTION.size
+                    )
+                    typecode = typecode.rstrip(b"\0").decode()
+                    size = count * array(typecode).itemsize
+                    if offset + size > len(self._mmap):
+                        raise ValueError(f"{path} is truncated")
+                    self.sections[name.rstrip(b"\0").decode()] = buffer[offset:offset + size].cast(typecode)
+        except (struct.error, ValueError):
+            self.close()
+            raise
+
+    @property
+    def languages(self) -> Tuple[str, ...]:
+        return tuple(name[len("name_"):] for name in self.sections if name.startswith("name_"))
+
+    def close(self) -> None:
+        # The file can't be unmapped while views of it exist
+        for view in self.sections.values():
+            view.release()
+        self.sections = {}
+        self._mmap.close()
+
+
+class _Strings:
+    """Sequence of the strings of a pool, the items are bytes, so the sorted words can be bisected"""
+
+    __slots__ = ("offsets", "data")
+
+    def __init__(self, offsets: memoryview, data: memoryview) -> None:
+        self.offsets, self.data = offsets, data
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> bytes:
+        return self.data[self.offsets[index]:self.offsets[index + 1]].tobytes()
+
+    def text(self, index: int) -> Optional[str]:
+        return None if index == _NULL_STRING else self[index].decode()
+
+
+class SnapshotCityDatabase(BaseCityDatabase[TCityModel]):
+    """
+    Read-only backend of the `CityDatabase` lookups over a snapshot written by `write_snapshot`.
+    The snapshot is mapped into memory and shared by threads and forked processes, lookups don't copy it.
+
+    It fetches the fields of `config.SNAPSHOT_FIELDS`, "*" stands for all of them.
+    Search matches words of the names by prefix like the full-text index, ranked search orders cities
+    by population without bm25. Fuzzy search needs the trigram index of the database, so it isn't supported.
+    """
+
+    def __init__(
+            self,
+            fetch_fields: Optional[Tuple[str, ...]] = None,
+            query_stats: Optional[QueryStats] = None,
+    ) -> None:
+        super().__init__(fetch_fields, query_stats)
+        self._snapshot: Optional[CitySnapshot] = None
+        self._row_factory: Optional[RowFactory] = None
+        self._cursor: Optional[SimpleNamespace] = None
+        self._fields: Tuple[str, ...] = ()
+        self._columns: Dict[str, List[Callable[[int], Any]]] = {}
+        self._kdtree: Optional[CityKDTree] = None
+        self._strings: Optional[_Strings] = None
+        self._words: Optional[_Strings] = None
+
+    @property
+    def snapshot(self) -> CitySnapshot:
+        if self._snapshot is None:
+            raise RuntimeError("There is no connection to the datasource")
+        return self._snapshot
+
+    def connect(self, datasource: Union[str, PathLike] = config.DEFAULT_SNAPSHOT) -> 'SnapshotCityDatabase':
+        """
+        Maps the snapshot into memory
+
+        :param datasource: Path to the snapshot file
+        """
+
+        if self._row_cls is sqlite3.Row:
+            raise ValueError("sqlite3.Row needs an SQLite cursor, snapshots don't have one")
+        fields = config.SNAPSHOT_FIELDS if "*" in self.fetch_fields else tuple(self.fetch_fields)
+        self._row_factory = self._check_fields(fields, config.SNAPSHOT_FIELDS)
+        # Factories which read column names get them from the description like from a cursor
+        self._cursor = SimpleNamespace(description=tuple((field,) + (None,) * 6 for field in fields))
+        self._snapshot = CitySnapshot(datasource)
+        self._fields, self._columns = fields, {}
+        sections = self._snapshot.sections
+        self._kdtree = CityKDTree(*(sections[name] for name in _KDTREE_SECTIONS))
+        self._strings = _Strings(sections["string_offsets"], sections["strings"])
+        self._words = _Strings(sections["word_offsets"], sections["words"])
+        self._languages = frozenset(self._snapshot.languages)
+        self._log.info('Mapped snapshot "%s"', datasource)
+        return self
+
+    @property
+    def supported_languages(self) -> Tuple[str, ...]:
+        """Gets a sequence of languages available in the snapshot"""
+        return self.snapshot.languages
+
+    def _getter(self, field: str, lang: str = "") -> Callable[[int], Any]:
+        """Makes a function which reads the field of a city by its index"""
+
+        name = "geonames_id" if field == "id" else field
+        if lang and field in config.SNAPSHOT_LOCALIZED_FIELDS:
+            name = f"{field}_{lang}"
+        column = self.snapshot.sections[name]
+        if column.format == config.SNAPSHOT_STRING_TYPECODE:
+            text = self._strings.text
+            return lambda index: text(column[index])
+        if column.format == "q":
+            return lambda index: None if column[index] == _NULL_INTEGER else column[index]
+        return column.__getitem__
+
+    def _getters(self, lang: str) -> List[Callable[[int], Any]]:
+        getters = self._columns.get(lang)
+        if getters is None:
+            self._check_lang(lang)
+            getters = self._columns[lang] = [self._getter(field, lang) for field in self._fields]
+        return getters
+
+    def _cities(self, indexes: Iterable[int], lang: str) -> List[TCityModel]:
+        getters, row_factory, cursor = self._getters(lang), self._row_factory, self._cursor
+        return [row_factory(cursor, tuple(getter(index) for getter in getters)) for index in indexes]
+
+    def _index(self, geonames_id: int) -> Optional[int]:
+        ids = self.snapshot.sections["geonames_id"]
+        index = bisect_left(ids, geonames_id)
+        return index if index < len(ids) and ids[index] == geonames_id else None
+
+    def _by_population(self, indexes: List[int]) -> List[int]:
+        population = self.snapshot.sections["population"]
+        return sorted(indexes, key=lambda index: (-population[index], index))
+
+    def _match(self, query: str, limit: int, ranked: bool) -> List[int]:
+        """Gets indexes of cities having every word of the query, the last one as a prefix"""
+
+        words = name_tokens(query)
+        sections = self.snapshot.sections
+        offsets, postings = sections["posting_offsets"], sections["postings"]
+        matched: Optional[set] = None
+        for position, word in enumerate(words):
+            key = word.encode()
+            start = bisect_left(self._words, key)
+            if position == len(words) - 1:
+                # UTF-8 doesn't have the 0xff byte, so it follows all the words with the prefix
+                stop = bisect_left(self._words, key + b"\xff", start)
+            else:
+                stop = start + 1 if start < len(self._words) and self._words[start] == key else start
+
+            found = set()
+            for word_index in range(start, stop):
+                found.update(postings[offsets[word_index]:offsets[word_index + 1]])
+            matched = found if matched is None else matched & found
+            if not matched:
+                return []
+
+        population = self.snapshot.sections["population"]
+        key = (lambda index: (-population[index], index)) if ranked else None
+        if limit < 0:
+            return sorted(matched or (), key=key)
+        return heapq.nsmallest(limit, matched or (), key=key)
+
+    @instrumented()
+    def search(
+            self, query: str, *, lang: str = "", limit: int = -1, ranked: bool = False, fuzzy: bool = False
+    ) -> List[TCityModel]:
+        """
+        Searches for cities which have names with every word of the query, the last word is matched as a prefix
+
+        :param query: Input query string
+        :param lang: Names in particular language for some columns
+        :param limit: Limit of the result
+        :param ranked: Orders cities by population, otherwise they are ordered by id
+        :param fuzzy: Isn't supported by snapshots
+        :return: List of suitable cities
+        """
+
+        if fuzzy:
+            raise ValueError("Fuzzy search needs the trigram index of the database, snapshots don't have it")
+        return self._cities(self._match(query, limit, ranked), lang)
+
+    @instrumented()
+    def iter_search(
+            self,
+            query: str,
+            *,
+            lang: str = "",
+            limit: int = -1,
+            ranked: bool = False,
+            batch_size: int = config.ITER_BATCH_SIZE,
+    ) -> Iterator[TCityModel]:
+        """See `search`, the cities are created in batches"""
+        indexes = self._match(query, limit, ranked)
+        for start in range(0, len(indexes), batch_size):
+            yield from self._cities(indexes[start:start + batch_size], lang)
+
+    @instrumented(lambda city: int(city is not None))
+    def get_city(self, geonames_id: int, *, lang: str = "") -> Optional[TCityModel]:
+        index = self._index(geonames_id)
+        return None if index is None else self._cities((index,), lang)[0]
+
+    @instrumented(lambda cities: sum(city is not None for city in cities))
+    def get_cities(self, geonames_ids: Iterable[int], *, lang: str = "") -> List[Optional[TCityModel]]:
+        """
+        Gets cities by a batch of ids
+
+        :param geonames_ids: Sequence of city ids
+        :param lang: Names in particular language for some columns
+        :return: List of cities in the order of the ids, with None for the missing ones
+        """
+
+        indexes = [self._index(geonames_id) for geonames_id in geonames_ids]
+        cities = iter(self._cities((index for index in indexes if index is not None), lang))
+        return [None if index is None else next(cities) for index in indexes]
+
+    @instrumented()
+    def get_nearest(self, latitude: float, longitude: float, *, lang: str = "", limit: int = 1) -> List[TCityModel]:
+        """
+        Gets nearest cities by given point with latitude and longitude, they are found by the KD-tree of the snapshot
+
+        :param latitude: Latitude of the point
+        :param longitude: Longitude of the point
+        :param lang: Names in particular language for some columns
+        :param limit: Limit of the result
+        :return: List of nearest cities to the given point
+        """
+
+        return self._nearest(latitude, longitude, lang, limit)
+
+    def _nearest(self, latitude: float, longitude: float, lang: str, limit: int) -> List[TCityModel]:
+        return self._cities(self._kdtree.nearest(latitude, longitude, limit), lang)
+
+    @instrumented()
+    def iter_nearest(
+            self,
+            latitude: float,
+            longitude: float,
+            *,
+            lang: str = "",
+            limit: int = -1,
+            batch_size: int = config.ITER_BATCH_SIZE,
+    ) -> Iterator[TCityModel]:
+        """See `get_nearest`, the cities are created in batches"""
+        indexes = self._kdtree.nearest(latitude, longitude, limit)
+        for start in range(0, len(indexes), batch_size):
+            yield from self._cities(indexes[start:start + batch_size], lang)
+
+    @instrumented(lambda cities: sum(len(nearest) for nearest in cities))
+    def get_nearest_many(
+            self, points: Iterable[Point], *, lang: str = "", limit: int = 1
+    ) -> List[List[TCityModel]]:
+        """
+        Gets nearest cities for a batch of points
+
+        :param points: Sequence of (latitude, longitude) pairs
+        :param lang: Names in particular language for some columns
+        :param limit: Limit of the result per point
+        :return: List of nearest cities lists in the order of the points
+        """
+
+        return [self._nearest(latitude, longitude, lang, limit) for latitude, longitude in points]
+
+    def _filter(
+            self,
+            indexes: Iterable[int],
+            country_code: Optional[str],
+            admin1_code: Optional[str],
+            min_population: Optional[int],
+    ) -> List[int]:
+        codes = [
+            (self._getter(field), value)
+            for field, value in (("country_code", country_code), ("admin1_code", admin1_code)) if value is not None
+        ]
+        population = self.snapshot.sections["population"]
+        return [
+            index for index in indexes
+            if (min_population is None or population[index] >= min_population)
+            and all(get(index) == value for get, value in codes)
+        ]
+
+    @instrumented()
+    def get_within_radius(
+            self,
+            latitude: float,
+            longitude: float,
+            distance_km: float,
+            *,
+            country_code: Optional[str] = None,
+            admin1_code: Optional[str] = None,
+            min_population: Optional[int] = None,
+            lang: str = "",
+            limit: int = -1,
+    ) -> List[TCityModel]:
+        """
+        Gets cities within the given distance of the point, ordered by distance
+
+        :param latitude: Latitude of the point
+        :param longitude: Longitude of the point
+        :param distance_km: Radius in kilometers
+        :param country_code: ISO code of the country of cities
+        :param admin1_code: Code of the administrative unit of cities, e.g. "72" for Lower Silesian Voivodeship
+        :param min_population: Minimal population of cities
+        :param lang: Names in particular language for some columns
+        :param limit: Limit of the result
+        :return: List of cities within the radius
+        """
+
+        found = (index for index, _ in self._kdtree.radius_search(latitude, longitude, distance_km))
+        indexes = self._filter(found, country_code, admin1_code, min_population)
+        return self._cities(indexes if limit < 0 else indexes[:limit], lang)
+
+    @instrumented()
+    def get_in_bbox(
+            self,
+            min_latitude: float,
+            min_longitude: float,
+            max_latitude: float,
+            max_longitude: float,
+            *,
+            country_code: Optional[str] = None,
+            admin1_code: Optional[str] = None,
+            min_population: Optional[int] = None,
+            lang: str = "",
+            limit: int = -1,
+    ) -> List[TCityModel]:
+        """
+        Gets cities within the bounding box, the most populated first.
+        The box crosses the antimeridian if the minimal longitude is greater than the maximal one.
+
+        :param min_latitude: Southern latitude of the box
+        :param min_longitude: Western longitude of the box
+        :param max_latitude: Northern latitude of the box
+        :param max_longitude: Eastern longitude of the box
+        :param country_code: ISO code of the country of cities
+        :param admin1_code: Code of the administrative unit of cities, e.g. "72" for Lower Silesian Voivodeship
+        :param min_population: Minimal population of cities
+        :param lang: Names in particular language for some columns
+        :param limit: Limit of the result
+        :return: List of cities within the box
+        """
+
+        sections = self.snapshot.sections
+        latitudes, longitudes = sections["sorted_latitudes"], sections["longitude"]
+        start, stop = bisect_left(latitudes, min_latitude), bisect_right(latitudes, max_latitude)
+        if min_longitude <= max_longitude:
+            in_box = (
+                index for index in sections["latitude_order"][start:stop]
+                if min_longitude <= longitudes[index] <= max_longitude
+            )
+        else:
+            in_box = (
+                index for index in sections["latitude_order"][start:stop]
+                if longitudes[index] >= min_longitude or longitudes[index] <= max_longitude
+            )
+        indexes = self._by_population(self._filter(in_box, country_code, admin1_code, min_population))
+        return self._cities(indexes if limit < 0 else indexes[:limit], lang)
+
+    def close(self) -> None:
+        self._kdtree = None
+        self._strings = self._words = None
+        self.snapshot.close()
+        self._snapshot = None
+        self._log.info("Disconnected")
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+import heapq
+import math
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from os import PathLike
+from typing import Iterable, List, Tuple, Optional, Union
+
+from . import config
+from .utils import EARTH_RADIUS_KM, MAX_DISTANCE_KM
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+Point = Tuple[float, float]
+
+
+def to_unit_vector(latitude: float, longitude: float) -> Tuple[float, float, float]:
+    """Converts a point on the earth to a 3D unit vector"""
+    lat, long = math.radians(latitude), math.radians(longitude)
+    cos_lat = math.cos(lat)
+    return cos_lat * math.cos(long), cos_lat * math.sin(long), math.sin(lat)
+
+
+class CityPoints:
+    """
+    Compact array-backed copy of city coordinates used for batch nearest lookups.
+    Cities are stored as unit vectors sorted by latitude, so the nearest ones to
+    a point are looked up in a narrow latitude band which grows until it is wide enough.
+    NumPy is used for the whole batch when it's installed.
+    """
+
+    __slots__ = ("ids", "latitudes", "xs", "ys", "zs")
+
+    def __init__(self, rows: Iterable[Tuple[int, float, float]]) -> None:
+        self.ids = array("q")
+        self.latitudes = array("d")
+        self.xs, self.ys, self.zs = array("d"), array("d"), array("d")
+
+        for geonames_id, latitude, longitude in sorted(rows, key=lambda row: (row[1], row[0])):
+            x, y, z = to_unit_vector(latitude, longitude)
+            self.ids.append(geonames_id)
+            self.latitudes.append(latitude)
+            self.xs.append(x)
+            self.ys.append(y)
+            self.zs.append(z)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def nearest(self, latitude: float, longitude: float, limit: int = 1) -> List[int]:
+        """
+        Gets ids of the nearest cities to the given point, ordered by distance
+
+        :param latitude: Latitude of the point
+        :param longitude: Longitude of the point
+        :param limit: Limit of the result, negative value means all cities
+        :return: List of city ids
+        """
+
+        limit = len(self) if limit < 0 else min(limit, len(self))
+        if limit == 0:
+            return []
+
+        px, py, pz = to_unit_vector(latitude, longitude)
+        xs, ys, zs, ids = self.xs, self.ys, self.zs, self.ids
+        radius_km = config.NEAREST_SEARCH_RADIUS_KM
+        while True:
+            angular_distance = radius_km / EARTH_RADIUS_KM
+            delta_lat = math.degrees(angular_distance)
+            start = bisect_left(self.latitudes, latitude - delta_lat)
+            stop = bisect_right(self.latitudes, latitude + delta_lat)
+            # Unit vectors within the radius have a dot product not less than the cosine of the angular distance
+            min_dot = math.cos(angular_distance) if radius_km < MAX_DISTANCE_KM else -2.0
+
+            candidates = []
+            for i in range(start, stop):
+                dot = px * xs[i] + py * ys[i] + pz * zs[i]
+                if dot >= min_dot:
+                    candidates.append((-dot, ids[i]))
+
+            if len(candidates) >= limit or radius_km >= MAX_DISTANCE_KM:
+                return [geonames_id for _, geonames_id in heapq.nsmallest(limit, candidates)]
+
+            radius_km *= 2
+
+    def nearest_many(self, points: Iterable[Point], limit: int = 1) -> List[List[int]]:
+        """
+        Gets ids of the nearest cities for every given point
+
+        :param points: Sequence of (latitude, longitude) pairs
+        :param limit: Limit of the result per point, negative value means all cities
+        :return: List of city id lists in the order of the points
+        """
+
+        if numpy is None:
+            return [self.nearest(latitude, longitude, limit) for latitude, longitude in points]
+
+        return self._nearest_many_vectorized(list(points), limit)
+
+    def _nearest_many_vectorized(self, points: List[Point], limit: int) -> List[List[int]]:
+        limit = len(self) if limit < 0 else min(limit, len(self))
+        if limit == 0 or not points:
+            return [[] for _ in points]
+
+        cities = numpy.column_stack((
+            numpy.frombuffer(self.xs, dtype=numpy.float64),
+            numpy.frombuffer(self.ys, dtype=numpy.float64),
+            numpy.frombuffer(self.zs, dtype=numpy.float64),
+        ))
+        ids = numpy.frombuffer(self.ids, dtype=numpy.int64)
+        # Keeps a matrix of dot products of a chunk at about 32 MB
+        chunk_size = max(1, (1 << 22) // len(self))
+
+        result: List[List[int]] = []
+        for chunk_start in range(0, len(points), chunk_size):
+            coordinates = numpy.radians(numpy.array(points[chunk_start:chunk_start + chunk_size], dtype=numpy.float64))
+            lat, long = coordinates[:, 0], coordinates[:, 1]
+            cos_lat = numpy.cos(lat)
+            vectors = numpy.column_stack((cos_lat * numpy.cos(long), cos_lat * numpy.sin(long), numpy.sin(lat)))
+            dots = vectors @ cities.T
+
+            if limit < len(self):
+                nearest = numpy.argpartition(-dots, limit - 1, axis=1)[:, :limit]
+            else:
+                nearest = numpy.broadcast_to(numpy.arange(len(self)), dots.shape)
+
+            for row, candidates in enumerate(nearest):
+                order = numpy.lexsort((ids[candidates], -dots[row, candidates]))
+                result.append(ids[candidates[order]].tolist())
+
+        return result
+
+
+def chord_to_distance(chord: float) -> float:
+    """Converts a chord length between two unit vectors to the great circle distance in kilometers"""
+    return 2 * EARTH_RADIUS_KM * math.asin(min(chord / 2, 1.0))
+
+
+def distance_to_chord(distance_km: float) -> float:
+    """Converts a great circle distance in kilometers to the chord length between two unit vectors"""
+    return 2 * math.sin(min(distance_km, MAX_DISTANCE_KM) / (2 * EARTH_RADIUS_KM))
+
+
+class CityKDTree:
+    """
+    KD-tree over 3D unit vectors of cities kept in flat arrays. The tree is implicit:
+    a node of the range [start, stop) is stored at its middle index, the left
+    subtree takes [start, middle) and the right one takes (middle, stop).
+    Squared chord lengths are compared instead of distances, they have the same order.
+    """
+
+    __slots__ = ("ids", "xs", "ys", "zs", "axes")
+
+    _HEADER = struct.Struct("<8sQ")
+    _MAGIC = b"PYCKDT1" + (b"L" if sys.byteorder == "little" else b"B")
+
+    def __init__(
+            self,
+            ids: array,
+            xs: array,
+            ys: array,
+            zs: array,
+            axes: array,
+    ) -> None:
+        self.ids, self.xs, self.ys, self.zs, self.axes = ids, xs, ys, zs, axes
+
+    @classmethod
+    def build(cls, rows: Iterable[Tuple[int, float, float]]) -> 'CityKDTree':
+        points = [(geonames_id, *to_unit_vector(latitude, longitude)) for geonames_id, latitude, longitude in rows]
+        nodes: List[Optional[Tuple[int, float, float, float]]] = [None] * len(points)
+        axes = array("B", bytes(len(points)))
+
+        stack = [(0, len(points), points)]
+        while stack:
+            start, stop, subset = stack.pop()
+            if not subset:
+                continue
+
+            # Splits by the axis with the largest spread, the points lie on a sphere so it rarely alternates evenly
+            axis = max(
+                (1, 2, 3), key=lambda i: max(point[i] for point in subset) - min(point[i] for point in subset)
+            )
+            subset.sort(key=lambda point: (point[axis], point[0]))
+            middle = (start + stop) // 2
+            pivot = middle - start
+            nodes[middle], axes[middle] = subset[pivot], axis - 1
+            stack.append((start, middle, subset[:pivot]))
+            stack.append((middle + 1, stop, subset[pivot + 1:]))
+
+        return cls(
+            array("q", (node[0] for node in nodes)),
+            array("d", (node[1] for node in nodes)),
+            array("d", (node[2] for node in nodes)),
+            array("d", (node[3] for node in nodes)),
+            axes,
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def save(self, path: Union[str, PathLike]) -> None:
+        """Writes the tree into a temporary file next to the path, it replaces the file when it's complete"""
+
+        part_path = f"{path}{config.KDTREE_PART_SUFFIX}"
+        with open(part_path, "wb") as file:
+            file.write(self._HEADER.pack(self._MAGIC, len(self)))
+            for values in (self.ids, self.xs, self.ys, self.zs, self.axes):
+                values.tofile(file)
+        os.replace(part_path, path)
+
+    @classmethod
+    def load(cls, path: Union[str, PathLike]) -> 'CityKDTree':
+        with open(path, "rb") as file:
+            magic, count = cls._HEADER.unpack(file.read(cls._HEADER.size))
+            if magic != cls._MAGIC:
+                raise ValueError(f"{path} is not a KD-tree file of this platform")
+
+            values = []
+            for typecode in ("q", "d", "d", "d", "B"):
+                items = array(typecode)
+                items.fromfile(file, count)
+                values.append(items)
+
+        return cls(*values)
+
+    def nearest(self, latitude: float, longitude: float, limit: int = 1) -> List[int]:
+        """
+        Gets ids of the nearest cities to the given point, ordered by distance
+
+        :param latitude: Latitude of the point
+        :param longitude: Longitude of the point
+        :param limit: Limit of the result, negative value means all cities
+        :return: List of city ids
+        """
+
+        limit = len(self) if limit < 0 else min(limit, len(self))
+        if limit == 0:
+            return []
+
+        point = to_unit_vector(latitude, longitude)
+        coordinates = (self.xs, self.ys, self.zs)
+        ids, axes = self.ids, self.axes
+        # Max-heap of the best found cities ordered by (squared chord, id)
+        best: List[Tuple[float, int]] = []
+
+        def visit(start: int, stop: int) -> None:
+            if start >= stop:
+                return
+
+            middle = (start + stop) // 2
+            dx, dy, dz = point[0] - self.xs[middle], point[1] - self.ys[middle], point[2] - self.zs[middle]
+            distance = dx * dx + dy * dy + dz * dz
+            candidate = (-distance, -ids[middle])
+            if len(best) < limit:
+                heapq.heappush(best, candidate)
+            elif candidate > best[0]:
+                heapq.heapreplace(best, candidate)
+
+            axis = axes[middle]
+            diff = point[axis] - coordinates[axis][middle]
+            near, far = ((start, middle), (middle + 1, stop)) if diff < 0 else ((middle + 1, stop), (start, middle))
+            visit(*near)
+            if len(best) < limit or diff * diff <= -best[0][0]:
+                visit(*far)
+
+        visit(0, len(self))
+        return [-geonames_id for _, geonames_id in sorted(best, reverse=True)]
+
+    def radius_search(self, latitude: float, longitude: float, distance_km: float) -> List[Tuple[int, float]]:
+        """
+        Gets cities within the given distance of the point
+
+        :param latitude: Latitude of the point
+        :param longitude: Longitude of the point
+        :param distance_km: Radius in kilometers
+        :return: List of (city id, distance in kilometers) pairs ordered by distance
+        """
+
+        point = to_unit_vector(latitude, longitude)
+        radius = distance_to_chord(distance_km) ** 2
+        coordinates = (self.xs, self.ys, self.zs)
+        ids, axes = self.ids, self.axes
+        found: List[Tuple[float, int]] = []
+
+        stack = [(0, len(self))]
+        while stack:
+            start, stop = stack.pop()
+            if start >= stop:
+                continue
+
+            middle = (start + stop) // 2
+            dx, dy, dz = point[0] - self.xs[middle], point[1] - self.ys[middle], point[2] - self.zs[middle]
+            distance = dx * dx + dy * dy + dz * dz
+            if distance <= radius:
+                found.append((distance, ids[middle]))
+
+            axis = axes[middle]
+            diff = point[axis] - coordinates[axis][middle]
+            if diff <= 0 or diff * diff <= radius:
+                stack.append((start, middle))
+            if diff >= 0 or diff * diff <= radius:
+                stack.append((middle + 1, stop))
+
+        return [(geonames_id, chord_to_distance(math.sqrt(distance))) for distance, geonames_id in sorted(found)]
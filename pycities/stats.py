@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+import inspect
+import logging
+import threading
+import time
+from bisect import bisect_left
+from functools import partial, wraps
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from . import config
+
+
+_log = logging.getLogger(__name__)
+
+
+class QueryEvent(NamedTuple):
+    """Measurements of one call, times are in milliseconds"""
+    method: str
+    duration_ms: float
+    rows: int
+    lock_wait_ms: float
+    sqlite_ms: float
+    row_factory_ms: float
+
+
+class MethodStats(NamedTuple):
+    calls: int
+    rows: int
+    total_ms: float
+    lock_wait_ms: float
+    sqlite_ms: float
+    row_factory_ms: float
+    # Number of calls per latency bucket, the last one counts calls slower than all bucket bounds
+    histogram: Tuple[int, ...]
+
+
+class QueryPlan(NamedTuple):
+    sql: str
+    params: tuple
+    # Lines of EXPLAIN QUERY PLAN indented by their depth in the plan tree
+    plan: List[str]
+
+
+class _CallTimings:
+    __slots__ = ("lock_wait", "sqlite", "row_factory")
+
+    def __init__(self) -> None:
+        self.lock_wait = self.sqlite = self.row_factory = 0.0
+
+
+class _MethodCounters:
+    __slots__ = ("calls", "rows", "total", "lock_wait", "sqlite", "row_factory", "histogram")
+
+    def __init__(self, bucket_count: int) -> None:
+        self.calls = self.rows = 0
+        self.total = self.lock_wait = self.sqlite = self.row_factory = 0.0
+        self.histogram = [0] * (bucket_count + 1)
+
+
+class QueryStats:
+    """
+    Thread-safe recorder of lookup statistics: calls, returned rows and a latency histogram per method,
+    and the time spent waiting for the lock or a pooled connection, in SQLite and in the row factory.
+    Every call is also passed to the callback, e.g. to export it to a metrics system.
+    """
+
+    def __init__(
+            self,
+            callback: Optional[Callable[[QueryEvent], None]] = None,
+            buckets_ms: Sequence[float] = config.STATS_LATENCY_BUCKETS_MS,
+    ) -> None:
+        """
+        :param callback: Callable which takes a `QueryEvent` of every call
+        :param buckets_ms: Ascending upper bounds of the latency histogram buckets in milliseconds
+        """
+
+        self.callback = callback
+        self.buckets_ms = tuple(buckets_ms)
+        self._methods: Dict[str, _MethodCounters] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def add_query(self, lock_wait: float, sqlite: float, row_factory: float) -> None:
+        """Adds times of a query in seconds to the call which is measured in the current thread"""
+        timings: Optional[_CallTimings] = getattr(self._local, "timings", None)
+        if timings is not None:
+            timings.lock_wait += lock_wait
+            timings.sqlite += sqlite
+            timings.row_factory += row_factory
+
+    def measure(self, method: str, call: Callable[[], Any], count_rows: Callable[[Any], int] = len) -> Any:
+        """
+        Makes the call and records it
+
+        :param method: Name of the method
+        :param call: Callable without arguments
+        :param count_rows: Callable which counts cities in the result of the call
+        """
+
+        timings, previous = _CallTimings(), getattr(self._local, "timings", None)
+        self._local.timings = timings
+        start = time.perf_counter()
+        try:
+            result = call()
+        finally:
+            self._local.timings = previous
+        self._record(method, time.perf_counter() - start, count_rows(result), timings)
+        return result
+
+    def measure_iter(self, method: str, iterator: Iterator[Any]) -> Iterator[Any]:
+        """
+        Yields items of the iterator and records it as one call when it's exhausted or closed.
+        Only the time spent inside the iterator is measured, not the time of the consumer.
+        """
+
+        timings, duration, rows = _CallTimings(), 0.0, 0
+        try:
+            while True:
+                previous = getattr(self._local, "timings", None)
+                self._local.timings = timings
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    duration += time.perf_counter() - start
+                    self._local.timings = previous
+                rows += 1
+                yield item
+        finally:
+            self._record(method, duration, rows, timings)
+
+    def _record(self, method: str, duration: float, rows: int, timings: _CallTimings) -> None:
+        duration_ms = duration * 1000
+        with self._lock:
+            counters = self._methods.get(method)
+            if counters is None:
+                counters = self._methods[method] = _MethodCounters(len(self.buckets_ms))
+            counters.calls += 1
+            counters.rows += rows
+            counters.total += duration
+            counters.lock_wait += timings.lock_wait
+            counters.sqlite += timings.sqlite
+            counters.row_factory += timings.row_factory
+            counters.histogram[bisect_left(self.buckets_ms, duration_ms)] += 1
+
+        if self.callback is None:
+            return
+
+        event = QueryEvent(
+            method, duration_ms, rows, timings.lock_wait * 1000, timings.sqlite * 1000, timings.row_factory * 1000
+        )
+        try:
+            self.callback(event)
+        except Exception:
+            _log.exception("Stats callback failed")
+
+    def snapshot(self) -> Dict[str, MethodStats]:
+        """Gets statistics of every called method, times are in milliseconds"""
+        with self._lock:
+            return {
+                method: MethodStats(
+                    counters.calls,
+                    counters.rows,
+                    counters.total * 1000,
+                    counters.lock_wait * 1000,
+                    counters.sqlite * 1000,
+                    counters.row_factory * 1000,
+                    tuple(counters.histogram),
+                )
+                for method, counters in self._methods.items()
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._methods.clear()
+
+
+def instrumented(count_rows: Callable[[Any], int] = len):
+    """
+    Makes the lookup method record its calls in the `query_stats` attribute of the database.
+    The method is called directly if it's None, so disabled statistics cost one attribute check.
+
+    :param count_rows: Callable which counts cities in the result of the method
+    """
+
+    def decorator(func: Callable) -> Callable:
+        if inspect.isgeneratorfunction(func):
+            @wraps(func)
+            def wrapper(self, *args, **kwargs):
+                if self.query_stats is None:
+                    return func(self, *args, **kwargs)
+                return self.query_stats.measure_iter(func.__name__, func(self, *args, **kwargs))
+        else:
+            @wraps(func)
+            def wrapper(self, *args, **kwargs):
+                if self.query_stats is None:
+                    return func(self, *args, **kwargs)
+                return self.query_stats.measure(func.__name__, partial(func, self, *args, **kwargs), count_rows)
+
+        wrapper.instrumented = True
+        return wrapper
+    return decorator
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+import datetime
+import logging
+import os
+import sqlite3
+import time
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Set, Union
+
+from . import config
+from .datadump import (
+    city_lookup_languages, city_lookup_table_name, city_rows, insert_city_lookup_rows, insert_city_names,
+    known_geonames_ids, open_data_file, parse_lines, read_build_info,
+)
+
+
+_log = logging.getLogger(__name__)
+
+_FilePath = Union[os.PathLike, str]
+
+
+class UpdateResult(NamedTuple):
+    updated_cities: int
+    deleted_cities: int
+    updated_alternate_names: int
+    deleted_alternate_names: int
+
+
+def _read_rows(filepath: Optional[_FilePath]) -> List[list]:
+    if filepath is None:
+        return []
+    with open_data_file(filepath) as file:
+        return list(parse_lines(file))
+
+
+def _is_city(row_data: list, country_codes: Set[str], min_population: int) -> bool:
+    return (
+        row_data[6] == config.CITY_FEATURE_CLASS
+        and row_data[8] in country_codes
+        and (int(row_data[14] or 0) >= min_population or row_data[7] in config.CITY_CAPITAL_FEATURE_CODES)
+    )
+
+
+def _build_min_population(conn: sqlite3.Connection) -> int:
+    min_population = read_build_info(conn).get("min_population")
+    if min_population is None:
+        raise ValueError(
+            "The database doesn't record the population threshold of its cities file, pass min_population"
+        )
+    return int(min_population)
+
+
+def _table_exists(conn: sqlite3.Connection, table_name: str) -> bool:
+    query = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?"
+    return conn.execute(query, (table_name,)).fetchone() is not None
+
+
+def _localized_languages(conn: sqlite3.Connection, table_name: str) -> List[str]:
+    """Gets languages of the `name_<lang>` columns of the table"""
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]
+    return [column[len("name_"):] for column in columns if column.startswith("name_")]
+
+
+def _fill_updated_ids(conn: sqlite3.Connection, geonames_ids: Iterable[int]) -> None:
+    conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {config.UPDATED_ID_TABLE_NAME} (geonames_id INTEGER PRIMARY KEY)")
+    conn.execute(f"DELETE FROM temp.{config.UPDATED_ID_TABLE_NAME}")
+    conn.executemany(
+        f"INSERT OR IGNORE INTO temp.{config.UPDATED_ID_TABLE_NAME} (geonames_id) VALUES (?)",
+        ((geonames_id,) for geonames_id in geonames_ids),
+    )
+
+
+def _refresh_localized_names(conn: sqlite3.Connection, table_name: str) -> None:
+    """Recomputes the `name_<lang>` columns of the updated places the way `create_alternate_name_columns` does"""
+    for lang in _localized_languages(conn, table_name):
+        conn.execute(f"""
+UPDATE {table_name} SET name_{lang} = (
+    SELECT name FROM {config.ALTERNATE_NAME_TABLE_NAME}
+    WHERE geonames_id = {table_name}.geonames_id AND lang = ? AND is_historic IS NULL
+    ORDER BY is_preferred DESC, id LIMIT 1
+)
+WHERE geonames_id IN (SELECT geonames_id FROM temp.{config.UPDATED_ID_TABLE_NAME})
+        """, (lang,))
+
+
+def _refresh_city_lookup(conn: sqlite3.Connection, lang: str) -> None:
+    """Replaces rows of the updated cities and of the cities of the updated administrative units and countries"""
+    updated_ids = f"SELECT geonames_id FROM temp.{config.UPDATED_ID_TABLE_NAME}"
+    conn.execute(f"DELETE FROM {city_lookup_table_name(lang)} WHERE geonames_id IN ({updated_ids})")
+    insert_city_lookup_rows(conn, lang, f"""
+WHERE {config.CITY_TABLE_NAME}.geonames_id IN ({updated_ids})
+OR {config.CITY_TABLE_NAME}.administrative_unit_id IN ({updated_ids})
+OR {config.CITY_TABLE_NAME}.country_id IN ({updated_ids})
+    """)
+
+
+def _refresh_city_names(conn: sqlite3.Connection) -> None:
+    """Replaces names of the updated cities in the trigram index of fuzzy search"""
+    updated_ids = f"SELECT geonames_id FROM temp.{config.UPDATED_ID_TABLE_NAME}"
+    # Rows of an external content table are removed from the index by the delete command with their old values
+    conn.execute(f"""
+INSERT INTO {config.CITY_TRIGRAM_TABLE_NAME}({config.CITY_TRIGRAM_TABLE_NAME}, rowid, name)
+SELECT 'delete', id, name FROM {config.CITY_NAME_TABLE_NAME} WHERE geonames_id IN ({updated_ids})
+    """)
+    conn.execute(f"DELETE FROM {config.CITY_NAME_TABLE_NAME} WHERE geonames_id IN ({updated_ids})")
+    insert_city_names(conn, f"WHERE geonames_id IN ({updated_ids})")
+
+
+def _refresh_city_search(conn: sqlite3.Connection, geonames_ids: Iterable[int]) -> None:
+    """Replaces full-text search rows, fuzzy search names and the spatial index entries of the updated cities"""
+    # Equality on an FTS5 column scans the whole table, a column filter query uses the full-text index instead
+    conn.executemany(
+        f"DELETE FROM {config.CITY_FTS_TABLE_NAME} WHERE {config.CITY_FTS_TABLE_NAME} MATCH ?",
+        ((f'geonames_id : "{geonames_id}"',) for geonames_id in geonames_ids),
+    )
+    conn.execute(f"""
+INSERT INTO {config.CITY_FTS_TABLE_NAME}(name, geonames_id)
+SELECT COALESCE(alternate_names, name), geonames_id FROM {config.CITY_TABLE_NAME}
+WHERE geonames_id IN (SELECT geonames_id FROM temp.{config.UPDATED_ID_TABLE_NAME})
+    """)
+
+    if _table_exists(conn, config.CITY_TRIGRAM_TABLE_NAME):
+        _refresh_city_names(conn)
+    if not _table_exists(conn, config.CITY_RTREE_TABLE_NAME):
+        return
+
+    conn.execute(f"""
+DELETE FROM {config.CITY_RTREE_TABLE_NAME}
+WHERE id IN (SELECT geonames_id FROM temp.{config.UPDATED_ID_TABLE_NAME})
+    """)
+    conn.execute(f"""
+INSERT INTO {config.CITY_RTREE_TABLE_NAME}({', '.join(config.CITY_RTREE_COLUMNS)})
+SELECT geonames_id, latitude, latitude, longitude, longitude FROM {config.CITY_TABLE_NAME}
+WHERE geonames_id IN (SELECT geonames_id FROM temp.{config.UPDATED_ID_TABLE_NAME})
+    """)
+
+
+def apply_updates(
+        conn: sqlite3.Connection,
+        *,
+        modifications: Optional[_FilePath] = None,
+        deletes: Optional[_FilePath] = None,
+        alternate_name_modifications: Optional[_FilePath] = None,
+        alternate_name_deletes: Optional[_FilePath] = None,
+        languages: Optional[Sequence[str]] = None,
+        min_population: Optional[int] = None,
+) -> UpdateResult:
+    """
+    Applies one day of GeoNames modification and deletion files to a built database in a single transaction.
+    Only the changed cities are upserted, their localized names, full-text search rows, lookup table rows and
+    spatial index entries are recomputed, so the rest of the database stays untouched.
+
+    :param conn: Connection to the database
+    :param modifications: Path to a `modifications-YYYY-MM-DD.txt` file
+    :param deletes: Path to a `deletes-YYYY-MM-DD.txt` file
+    :param alternate_name_modifications: Path to an `alternateNamesModifications-YYYY-MM-DD.txt` file
+    :param alternate_name_deletes: Path to an `alternateNamesDeletes-YYYY-MM-DD.txt` file
+    :param languages: Languages of kept alternate names, languages of the `name_<lang>` columns if it's None
+    :param min_population: Minimum population of a new city, capitals are added regardless of it.
+        The population threshold of the cities file the database was built from if it's None
+    :return: Numbers of updated and deleted rows
+    """
+
+    start_time = time.perf_counter()
+    modified_rows = _read_rows(modifications)
+    deleted_ids = {int(row_data[0]) for row_data in _read_rows(deletes)}
+    alternate_name_rows = _read_rows(alternate_name_modifications)
+    alternate_name_delete_rows = _read_rows(alternate_name_deletes)
+    if languages is None:
+        languages = _localized_languages(conn, config.CITY_TABLE_NAME)
+    if min_population is None:
+        min_population = _build_min_population(conn)
+
+    with conn:
+        existing_ids = {
+            row[0] for row in conn.execute(f"SELECT geonames_id FROM {config.CITY_TABLE_NAME}")
+        }
+        country_codes = {row[0] for row in conn.execute(f"SELECT iso FROM {config.COUNTRY_TABLE_NAME}")}
+
+        modified_cities = []
+        for row_data in modified_rows:
+            geonames_id = int(row_data[0])
+            if _is_city(row_data, country_codes, min_population):
+                modified_cities.append(row_data)
+            elif geonames_id in existing_ids:
+                # The place isn't a city anymore, e.g. its population was corrected
+                deleted_ids.add(geonames_id)
+
+        deleted_ids &= existing_ids
+        city_columns = ", ".join(config.CITIES_COLUMN_TYPES)
+        conn.executemany(
+            f"INSERT OR REPLACE INTO {config.CITY_TABLE_NAME} ({city_columns}) "
+            f"VALUES ({', '.join(['?'] * len(config.CITIES_COLUMN_TYPES))})",
+            city_rows(conn, modified_cities),
+        )
+        conn.executemany(
+            f"DELETE FROM {config.CITY_TABLE_NAME} WHERE geonames_id = ?",
+            ((geonames_id,) for geonames_id in deleted_ids),
+        )
+        conn.executemany(
+            f"DELETE FROM {config.ALTERNATE_NAME_TABLE_NAME} WHERE geonames_id = ?",
+            ((geonames_id,) for geonames_id in deleted_ids),
+        )
+
+        # A modified alternate name is replaced, it's dropped if it no longer matches the kept languages
+        known_ids = known_geonames_ids(conn)
+        kept_languages = frozenset(languages) | {None}
+        deleted_alternate_names = conn.executemany(
+            f"DELETE FROM {config.ALTERNATE_NAME_TABLE_NAME} WHERE id = ?",
+            ((row_data[0],) for row_data in alternate_name_delete_rows),
+        ).rowcount
+        conn.executemany(
+            f"DELETE FROM {config.ALTERNATE_NAME_TABLE_NAME} WHERE id = ?",
+            ((row_data[0],) for row_data in alternate_name_rows),
+        )
+        kept_alternate_name_rows = [
+            row_data for row_data in alternate_name_rows if row_data[1] in known_ids and row_data[2] in kept_languages
+        ]
+        conn.executemany(
+            f"INSERT INTO {config.ALTERNATE_NAME_TABLE_NAME} ({', '.join(config.ALTERNATE_NAME_COLUMN_TYPES)}) "
+            f"VALUES ({', '.join(['?'] * len(config.ALTERNATE_NAME_COLUMN_TYPES))})",
+            kept_alternate_name_rows,
+        )
+
+        city_ids = {int(row_data[0]) for row_data in modified_cities} | deleted_ids
+        _fill_updated_ids(conn, city_ids.union(
+            int(row_data[1]) for row_data in alternate_name_rows + alternate_name_delete_rows
+        ))
+        for table_name in (config.COUNTRY_TABLE_NAME, config.ADMINISTRATIVE_TABLE_NAME, config.CITY_TABLE_NAME):
+            _refresh_localized_names(conn, table_name)
+        for lang in city_lookup_languages(conn):
+            _refresh_city_lookup(conn, lang)
+
+        _fill_updated_ids(conn, city_ids)
+        _refresh_city_search(conn, city_ids)
+        conn.execute(f"DROP TABLE temp.{config.UPDATED_ID_TABLE_NAME}")
+
+    result = UpdateResult(
+        len(modified_cities), len(deleted_ids), len(kept_alternate_name_rows), deleted_alternate_names
+    )
+    _log.info("Applied %s in %.2fs", result, time.perf_counter() - start_time)
+    return result
+
+
+def apply_daily_updates(
+        conn: sqlite3.Connection,
+        directory: _FilePath,
+        date: datetime.date,
+        **kwargs,
+) -> UpdateResult:
+    """
+    Applies the GeoNames update files of the date found in the directory, see `apply_updates`.
+    Updates of several days must be applied in chronological order.
+    """
+
+    def existing_path(filename_template: str) -> Optional[str]:
+        path = os.path.join(directory, filename_template.format(date=date.isoformat()))
+        return path if os.path.exists(path) else None
+
+    return apply_updates(
+        conn,
+        modifications=existing_path(config.MODIFICATIONS_FILENAME),
+        deletes=existing_path(config.DELETES_FILENAME),
+        alternate_name_modifications=existing_path(config.ALTERNATE_NAMES_MODIFICATIONS_FILENAME),
+        alternate_name_deletes=existing_path(config.ALTERNATE_NAMES_DELETES_FILENAME),
+        **kwargs,
+    )
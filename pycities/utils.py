@@ -1,5 +1,22 @@
 # -*- coding: utf-8 -*-
 import math
+import unicodedata
+from functools import lru_cache
+from typing import List, Tuple
+
+
+EARTH_RADIUS_KM = 6371
+MAX_DISTANCE_KM = math.pi * EARTH_RADIUS_KM
+
+BoundingBox = Tuple[float, float, float, float]
+
+# Combining marks which the unicode61 tokenizer drops with remove_diacritics, other marks split the words
+TOKEN_DIACRITICS = frozenset(
+    chr(code) for code in (
+        0x300, 0x301, 0x302, 0x303, 0x304, 0x306, 0x307, 0x308, 0x309, 0x30A, 0x30B, 0x30C, 0x30F,
+        0x311, 0x31B, 0x323, 0x324, 0x325, 0x326, 0x327, 0x328, 0x32D, 0x32E, 0x330, 0x331,
+    )
+)
 
 
 def calculate_distance(lat_1: float, long_1: float, lat_2: float, long_2: float) -> float:
@@ -22,5 +39,146 @@ def calculate_distance(lat_1: float, long_1: float, lat_2: float, long_2: float)
     d_lat, d_long = lat_2 - lat_1, long_2 - long_1
     a = math.sin(d_lat / 2) ** 2 + math.cos(lat_1) * math.cos(lat_2) * math.sin(d_long / 2) ** 2
     c = 2 * math.asin(math.sqrt(a))
-    r_km = 6371
-    return c * r_km
+    return c * EARTH_RADIUS_KM
+
+
+def calculate_bounding_boxes(latitude: float, longitude: float, distance_km: float) -> List[BoundingBox]:
+    """
+    Calculate boxes of latitude and longitude ranges which enclose every point
+    within the given great circle distance of the center point. The circle is
+    split into two boxes when it crosses the antimeridian and takes the whole
+    longitude range when it covers one of the poles.
+
+    :param latitude: latitude of the center point
+    :param longitude: longitude of the center point
+    :param distance_km: radius of the circle in kilometers
+    :return: list of (min latitude, max latitude, min longitude, max longitude) boxes
+    """
+
+    # A small margin in degrees keeps the points on the circle itself inside the boxes despite rounding errors
+    margin = 1e-6
+    angular_distance = distance_km / EARTH_RADIUS_KM
+    lat_rad = math.radians(latitude)
+    min_lat, max_lat = lat_rad - angular_distance, lat_rad + angular_distance
+
+    if min_lat <= -math.pi / 2 or max_lat >= math.pi / 2:
+        return [(max(math.degrees(min_lat) - margin, -90.0), min(math.degrees(max_lat) + margin, 90.0), -180.0, 180.0)]
+
+    delta_long = math.degrees(math.asin(math.sin(angular_distance) / math.cos(lat_rad))) + margin
+    min_lat, max_lat = math.degrees(min_lat) - margin, math.degrees(max_lat) + margin
+    if delta_long >= 180:
+        return [(min_lat, max_lat, -180.0, 180.0)]
+
+    longitude = (longitude + 180) % 360 - 180
+    min_long, max_long = longitude - delta_long, longitude + delta_long
+    if min_long < -180:
+        return [(min_lat, max_lat, min_long + 360, 180.0), (min_lat, max_lat, -180.0, max_long)]
+    if max_long > 180:
+        return [(min_lat, max_lat, min_long, 180.0), (min_lat, max_lat, -180.0, max_long - 360)]
+    return [(min_lat, max_lat, min_long, max_long)]
+
+
+def normalize_name(name: str) -> str:
+    """
+    Normalizes a place name for fuzzy matching: removes diacritics and case, collapses whitespace
+
+    :param name: Place name
+    :return: Normalized name
+    """
+
+    decomposed = unicodedata.normalize("NFKD", name)
+    name = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(name.casefold().split())
+
+
+def name_trigrams(name: str) -> List[str]:
+    """Gets distinct trigrams of the normalized name in the order of their positions"""
+    return list(dict.fromkeys(name[i:i + 3] for i in range(len(name) - 2)))
+
+
+@lru_cache(maxsize=None)
+def _fold_token_char(char: str) -> str:
+    """Folds the case of a word character and removes its diacritic if it's a letter with a single one"""
+    folded = char.casefold()
+    if len(folded) != 1:
+        folded = char.lower()
+    decomposed = unicodedata.normalize("NFD", folded)
+    if len(decomposed) == 2 and decomposed[0].isascii() and decomposed[1] in TOKEN_DIACRITICS:
+        return decomposed[0]
+    return folded
+
+
+def name_tokens(name: str) -> List[str]:
+    """
+    Splits the name into words the way the unicode61 tokenizer with remove_diacritics 1 of the full-text index does:
+    letters, numbers and private use characters make up the words and any other character separates them,
+    the case is folded and only single diacritics of Latin letters are removed
+
+    :param name: Place name or search query
+    :return: Folded words of the name
+    """
+
+    tokens, word = [], []
+    for char in name:
+        if char in TOKEN_DIACRITICS:
+            continue
+        category = unicodedata.category(char)
+        if category[0] in "LN" or category == "Co":
+            word.append(_fold_token_char(char))
+        elif word:
+            tokens.append("".join(word))
+            word = []
+    if word:
+        tokens.append("".join(word))
+    return tokens
+
+
+def edit_distance(source: str, target: str, max_distance: int, prefix: bool = False) -> int:
+    """
+    Calculate the edit distance between two strings: the number of inserted, deleted and substituted characters
+    and transpositions of adjacent ones. Only the diagonal band of the width of the maximum distance
+    is calculated and it stops as soon as the distance exceeds the maximum.
+
+    :param source: first string
+    :param target: second string
+    :param max_distance: maximum distance of interest
+    :param prefix: calculate the distance to the closest prefix of the second string instead of the whole string
+    :return: distance, or max_distance + 1 if it's greater than the maximum
+    """
+
+    too_far = max_distance + 1
+    if len(target) < len(source) - max_distance or not prefix and len(target) > len(source) + max_distance:
+        return too_far
+    # Longer prefixes need more than the maximum number of insertions
+    target = target[:len(source) + max_distance]
+
+    target_length = len(target)
+    before_previous: List[int] = []
+    previous = [j if j <= max_distance else too_far for j in range(target_length + 1)]
+    for i, source_char in enumerate(source, 1):
+        start, end = max(1, i - max_distance), min(target_length, i + max_distance)
+        current = [too_far] * (target_length + 1)
+        current[0] = row_min = i if i <= max_distance else too_far
+        # Plain comparisons instead of min() calls, this loop takes most of the time of fuzzy search
+        for j in range(start, end + 1):
+            target_char = target[j - 1]
+            distance = previous[j - 1] if source_char == target_char else previous[j - 1] + 1
+            if previous[j] < distance:
+                distance = previous[j] + 1
+            if current[j - 1] < distance:
+                distance = current[j - 1] + 1
+            if (
+                    i > 1 and j > 1 and source_char == target[j - 2] and source[i - 2] == target_char
+                    and before_previous[j - 2] < distance
+            ):
+                distance = before_previous[j - 2] + 1
+            if distance > too_far:
+                distance = too_far
+            current[j] = distance
+            if distance < row_min:
+                row_min = distance
+        if row_min >= too_far:
+            return too_far
+        before_previous, previous = previous, current
+
+    return min(previous) if prefix else previous[target_length]
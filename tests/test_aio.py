@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+
+import pytest
+
+from pycities import aio
+from pycities import config
+from pycities import database
+from pycities import model
+
+
+@pytest.fixture()
+def sync_city_db(data_dir):
+    cities = database.CityDatabase[model.CityInfo](fetch_fields=config.CITY_MIN_FIELDS)
+    cities.connect(data_dir / "data.db")
+    yield cities
+    cities.close()
+
+
+def _run(data_dir, scenario, row_cls=model.CityInfo, **params):
+    async def main():
+        cities = aio.AsyncCityDatabase[row_cls](fetch_fields=config.CITY_MIN_FIELDS, **params)
+        async with await cities.connect(data_dir / "data.db"):
+            return await scenario(cities)
+
+    return asyncio.run(main())
+
+
+def _gate(cities, method):
+    """Makes the method wait for the returned event and counts its calls"""
+    gate, calls, original = threading.Event(), [], getattr(cities.db, method)
+
+    def gated(*args, **kwargs):
+        calls.append(args)
+        gate.wait(5)
+        return original(*args, **kwargs)
+
+    setattr(cities.db, method, gated)
+    return gate, calls
+
+
+def test_async_results(data_dir, sync_city_db):
+    async def scenario(cities):
+        return await asyncio.gather(
+            cities.search("Kyiv", limit=5),
+            cities.get_city(3081368),
+            cities.get_cities([3081368, -1]),
+            cities.get_nearest(50.45, 30.52, limit=3),
+            cities.get_nearest_many([(50.45, 30.52), (51.1, 17.03)]),
+        )
+
+    search, city, cities_by_id, nearest, nearest_many = _run(data_dir, scenario)
+    assert search == sync_city_db.search("Kyiv", limit=5)
+    assert city == sync_city_db.get_city(3081368)
+    assert cities_by_id == sync_city_db.get_cities([3081368, -1])
+    assert nearest == sync_city_db.get_nearest(50.45, 30.52, limit=3)
+    assert nearest_many == sync_city_db.get_nearest_many([(50.45, 30.52), (51.1, 17.03)])
+
+
+def test_async_coalesce(data_dir):
+    async def scenario(cities):
+        gate, calls = _gate(cities, "search")
+        lookups = [asyncio.ensure_future(cities.search("Kyiv", limit=5)) for _ in range(5)]
+        await asyncio.sleep(0.05)
+        gate.set()
+        return calls, await asyncio.gather(*lookups)
+
+    calls, results = _run(data_dir, scenario, row_cls=dict)
+    assert len(calls) == 1
+    assert all(result == results[0] for result in results)
+    assert results[0] and results[0][0] is not results[1][0]
+
+
+def test_async_without_coalesce(data_dir):
+    async def scenario(cities):
+        gate, calls = _gate(cities, "get_city")
+        gate.set()
+        await asyncio.gather(*(cities.get_city(3081368) for _ in range(3)))
+        return calls
+
+    assert len(_run(data_dir, scenario, coalesce=False)) == 3
+
+
+def test_async_back_pressure(data_dir):
+    async def scenario(cities):
+        gate, calls = _gate(cities, "get_city")
+        lookups = [asyncio.ensure_future(cities.get_city(geonames_id)) for geonames_id in (1, 2, 3, 4)]
+        await asyncio.sleep(0.05)
+        pending = cities.pending
+        gate.set()
+        await asyncio.gather(*lookups)
+        return pending, calls, cities.pending
+
+    pending, calls, pending_after = _run(data_dir, scenario, workers=1, max_pending=2)
+    assert pending == 2
+    assert len(calls) == 4
+    assert pending_after == 0
+
+
+def test_async_cancel(data_dir):
+    async def scenario(cities):
+        gate, calls = _gate(cities, "get_city")
+        running = asyncio.ensure_future(cities.get_city(1))
+        queued = asyncio.ensure_future(cities.get_city(2))
+        await asyncio.sleep(0.05)
+        queued.cancel()
+        gate.set()
+        await running
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        await asyncio.sleep(0.05)
+        return calls, cities.pending
+
+    calls, pending = _run(data_dir, scenario, workers=1, max_pending=1)
+    assert calls == [(1,)]
+    assert pending == 0
+
+
+def test_async_not_connected():
+    cities = aio.AsyncCityDatabase[model.CityInfo]()
+    with pytest.raises(RuntimeError):
+        asyncio.run(cities.get_city(1))
+    with pytest.raises(ValueError):
+        aio.AsyncCityDatabase[model.CityInfo](workers=0)
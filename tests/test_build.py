@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import shutil
+import time
+import sqlite3
+import zipfile
+
+import pytest
+
+from pycities import build
+from pycities import config
+from pycities import database
+from pycities import model
+from pycities import snapshot
+
+
+@pytest.fixture()
+def geonames_dir(data_dir, tmp_path):
+    directory = tmp_path / "geonames"
+    directory.mkdir()
+    for filename in (config.COUNTRIES_FILENAME, config.ADMINISTRATIVE_FILENAME, config.CITIES_ARCHIVE_FILENAME):
+        shutil.copy(data_dir / filename, directory / filename)
+    with zipfile.ZipFile(directory / config.ALTERNATE_NAMES_ARCHIVE_FILENAME, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.write(data_dir / config.ALTERNATE_NAMES_FILENAME, config.ALTERNATE_NAMES_FILENAME)
+    return directory
+
+
+def test_build_main(geonames_dir, tmp_path, languages, capsys):
+    output = tmp_path / "built.db"
+    build.main(["--output", str(output), "--directory", str(geonames_dir), "--no-download", "--languages", *languages])
+
+    stages = [line.split()[0] for line in capsys.readouterr().out.splitlines()]
+    assert stages[0] == "load" and stages[-1] == "total"
+    assert not (tmp_path / "built.db.build").exists()
+
+    conn = sqlite3.connect(output)
+    city_count = conn.execute(f"SELECT COUNT(*) FROM {config.CITY_TABLE_NAME}").fetchone()[0]
+    assert city_count > 0
+    assert conn.execute(f"SELECT COUNT(*) FROM {config.CITY_RTREE_TABLE_NAME}").fetchone()[0] == city_count
+    assert conn.execute(f"SELECT COUNT(*) FROM {config.CITY_FTS_TABLE_NAME}").fetchone()[0] == city_count
+    conn.close()
+
+    cities = database.CityDatabase[model.CityInfo](fetch_fields=config.CITY_MIN_FIELDS).connect(output)
+    assert cities.supported_languages == tuple(languages)
+    assert cities.search("Kyiv", lang="uk", limit=1)
+    with pytest.raises(ValueError):
+        cities.search("Kyvi", fuzzy=True)
+    cities.close()
+
+
+def test_build_fuzzy(geonames_dir, tmp_path, languages):
+    output = tmp_path / "built.db"
+    build.main([
+        "--output", str(output), "--directory", str(geonames_dir), "--no-download", "--languages", *languages, "--fuzzy"
+    ])
+
+    cities = database.CityDatabase[model.CityInfo](fetch_fields=config.CITY_MIN_FIELDS).connect(output)
+    assert cities.search("Wroclw", lang="en", limit=1, fuzzy=True)[0].id == 3081368
+    cities.close()
+
+
+def test_build_population_threshold(geonames_dir, tmp_path):
+    with pytest.raises(ValueError):
+        build.build_database(tmp_path / "built.db", geonames_dir, min_population=100, download=False)
+
+
+def test_build_lookup_tables(geonames_dir, tmp_path, languages):
+    output = tmp_path / "built.db"
+    timings = build.build_database(output, geonames_dir, languages=languages, download=False, lookup_tables=True)
+    assert "lookup tables" in timings
+
+    conn = sqlite3.connect(output)
+    city_count = conn.execute(f"SELECT COUNT(*) FROM {config.CITY_TABLE_NAME}").fetchone()[0]
+    for lang in ("", *languages):
+        table_name = f"{config.CITY_LOOKUP_TABLE_NAME}_{lang}" if lang else config.CITY_LOOKUP_TABLE_NAME
+        assert conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0] == city_count
+    conn.close()
+
+
+def test_build_snapshot(geonames_dir, tmp_path, languages):
+    output = tmp_path / "built.db"
+    timings = build.build_database(output, geonames_dir, languages=languages, download=False, snapshot=True)
+    assert "snapshot" in timings
+
+    cities = snapshot.SnapshotCityDatabase[model.CityInfo](fetch_fields=config.CITY_MIN_FIELDS)
+    cities.connect(f"{output}{config.SNAPSHOT_FILE_SUFFIX}")
+    assert cities.supported_languages == tuple(languages)
+    assert cities.search("Kyiv", lang="uk", limit=1)
+    cities.close()
+
+
+def test_build_failure_cancels_downloads(geonames_dir, tmp_path, monkeypatch):
+    downloaded = []
+
+    def download(_timings, filename, directory, _url, _progress):
+        downloaded.append(filename)
+        if filename == config.ADMINISTRATIVE_FILENAME:
+            # Keeps the only worker busy until the load of countries fails
+            time.sleep(0.5)
+        return str(directory / filename)
+
+    monkeypatch.setattr(config, "DOWNLOAD_WORKERS", 1)
+    monkeypatch.setattr(build, "_download", download)
+    (geonames_dir / config.COUNTRIES_FILENAME).write_text("AA\tinvalid\n", encoding="utf-8")
+    with pytest.raises(Exception):
+        build.build_database(tmp_path / "built.db", geonames_dir)
+    assert downloaded == [config.COUNTRIES_FILENAME, config.ADMINISTRATIVE_FILENAME]
+    assert not (tmp_path / "built.db").exists()
+    assert not (tmp_path / "built.db.build").exists()
+
+
+def test_build_load_stages_exclude_downloads(geonames_dir, tmp_path, monkeypatch):
+    def download(_timings, filename, directory, _url, _progress):
+        if filename == config.ALTERNATE_NAMES_ARCHIVE_FILENAME:
+            time.sleep(1)
+        return str(directory / filename)
+
+    monkeypatch.setattr(build, "_download", download)
+    monkeypatch.setattr(build.datadump, "load_alternate_names", lambda *_args, **_kwargs: 0)
+    timings = build.build_database(tmp_path / "built.db", geonames_dir)
+    assert timings["load alternate names"] < 0.5 and timings["total"] >= 1
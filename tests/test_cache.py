@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import shutil
+import sqlite3
+import time
+
+import pytest
+
+from pycities import cache
+from pycities import database
+from pycities import model
+
+
+@pytest.fixture()
+def cached_city_db(data_dir):
+    result_cache = cache.ResultCache(maxsize=2)
+    cities = database.CityDatabase[dict](fetch_fields=("id", "name"), result_cache=result_cache)
+    cities.connect(data_dir / "data.db")
+    yield cities
+    cities.close()
+
+
+def test_result_cache_hits(cached_city_db):
+    first = cached_city_db.search("Kyiv", lang="en")
+    second = cached_city_db.search("Kyiv", lang="en")
+    assert first == second
+    assert cached_city_db.search("Kyiv", lang="uk") != first
+    assert cached_city_db.result_cache.info() == cache.CacheInfo(hits=1, misses=2, maxsize=2, currsize=2)
+
+
+def test_result_cache_returns_copies(cached_city_db):
+    city = cached_city_db.get_city(3081368, lang="en")
+    city["name"] = "Breslau"
+    cities = cached_city_db.search("Wroclaw", lang="en")
+    cities.clear()
+
+    assert cached_city_db.get_city(3081368, lang="en")["name"] == "Wroclaw"
+    assert cached_city_db.search("Wroclaw", lang="en")
+
+
+def test_copy_row():
+    row = (3081368, "Wroclaw")
+    assert cache.copy_row(row) is row
+    info = model.CityInfo(3081368, "Wroclaw", "Lower Silesia", "Poland")
+    assert cache.copy_row(info) is info
+    city = {"name": "Wroclaw"}
+    assert cache.copy_row(city) == city and cache.copy_row(city) is not city
+
+
+def test_result_cache_eviction_and_invalidation(cached_city_db):
+    for city_id in (3081368, 703448, 5128581):
+        cached_city_db.get_city(city_id)
+    assert cached_city_db.result_cache.info().currsize == 2
+
+    cached_city_db.get_city(3081368)
+    assert cached_city_db.result_cache.info().hits == 0
+
+    cached_city_db.result_cache.invalidate(lambda key: key[1] == (3081368,))
+    assert cached_city_db.result_cache.info().currsize == 1
+    cached_city_db.result_cache.invalidate()
+    assert cached_city_db.result_cache.info().currsize == 0
+
+
+def test_result_cache_ttl():
+    result_cache = cache.ResultCache(maxsize=10, ttl=0.05)
+    assert result_cache.get_or_fetch("key", lambda: [model.CityInfo(1, "a", "b", "c")])
+    result_cache.get_or_fetch("key", lambda: [])
+    time.sleep(0.06)
+    assert result_cache.get_or_fetch("key", lambda: []) == []
+    assert result_cache.info().hits == 1
+
+
+def test_result_cache_shared_by_datasources(data_dir, tmp_path):
+    datasource = tmp_path / "data.db"
+    shutil.copy(data_dir / "data.db", datasource)
+    conn = sqlite3.connect(datasource)
+    conn.execute("UPDATE city SET name = 'Breslau' WHERE geonames_id = 3081368")
+    conn.commit()
+    conn.close()
+
+    result_cache = cache.ResultCache(maxsize=10)
+    cities = database.CityDatabase[dict](fetch_fields=("id", "name"), result_cache=result_cache)
+    other_cities = database.CityDatabase[dict](fetch_fields=("id", "name"), result_cache=result_cache)
+    cities.connect(data_dir / "data.db")
+    other_cities.connect(datasource)
+    assert cities.get_city(3081368)["name"] == "Wrocław"
+    assert other_cities.get_city(3081368)["name"] == "Breslau"
+    assert result_cache.info().currsize == 2
+    cities.close()
+    other_cities.close()
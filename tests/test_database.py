@@ -1,8 +1,16 @@
 # -*- coding: utf-8 -*-
+import shutil
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 
+from pycities import config
 from pycities import database
+from pycities import datadump
 from pycities import model
+from pycities import spatial
+from pycities import utils
 
 
 @pytest.fixture(scope="module")
@@ -13,6 +21,40 @@ def city_db(data_dir):
     cities.close()
 
 
+@pytest.fixture(scope="module")
+def indexed_city_db(data_dir, temp_data_path):
+    datasource = temp_data_path / "data_indexed.db"
+    shutil.copy(data_dir / "data.db", datasource)
+    conn = sqlite3.connect(datasource)
+    datadump.create_city_spatial_index(conn)
+    datadump.create_city_indexes(conn)
+    datadump.create_city_trigram_index(conn)
+    conn.close()
+
+    cities = database.CityDatabase[model.CityInfo](fetch_fields=("id", "name", "administrative_name", "country_name"))
+    cities.connect(datasource)
+    yield cities
+    cities.close()
+
+
+@pytest.fixture(scope="module")
+def lookup_city_dbs(data_dir, temp_data_path):
+    datasource = temp_data_path / "data_lookup.db"
+    shutil.copy(data_dir / "data.db", datasource)
+    conn = sqlite3.connect(datasource)
+    datadump.create_city_spatial_index(conn)
+    datadump.create_city_lookup_tables(conn, ["uk", "en"])
+    conn.close()
+
+    fields = ("id", "name", "administrative_name", "country_name", "latitude", "longitude", "population")
+    cities = database.CityDatabase[tuple](fetch_fields=fields).connect(datasource)
+    # The alternate names aren't stored in the lookup tables, so this one reads the normalized tables
+    normalized_cities = database.CityDatabase[tuple](fetch_fields=fields + ("alternate_names",)).connect(datasource)
+    yield cities, normalized_cities
+    cities.close()
+    normalized_cities.close()
+
+
 def test_supported_languages(city_db, languages):
     assert city_db.supported_languages == tuple(languages)
 
@@ -30,6 +72,31 @@ def test_get_city(city_db, city_id, lang, expected_name):
     assert city.name == expected_name
 
 
+def test_get_city_missing(city_db):
+    assert city_db.get_city(1) is None
+
+
+@pytest.mark.parametrize(
+    "city_ids",
+    [
+        [3081368, 703448, 5128581],
+        [5128581, 1, 3081368, 5128581, 2],
+        [1, 2],
+        [],
+    ]
+)
+def test_get_cities(city_db, city_ids):
+    cities = city_db.get_cities(city_ids, lang="en")
+    assert cities == [city_db.get_city(city_id, lang="en") for city_id in city_ids]
+
+
+def test_get_cities_many_chunks(city_db):
+    city_ids = [row[0] for row in city_db.conn.execute("SELECT geonames_id FROM city ORDER BY name LIMIT 1000")]
+    cities = city_db.get_cities(city_ids + [1])
+    assert [city.id for city in cities[:-1]] == city_ids
+    assert cities[-1] is None
+
+
 @pytest.mark.parametrize(
     "query, expected_length",
     [
@@ -43,6 +110,81 @@ def test_search_city(city_db, query, expected_length):
     assert len(cities) == expected_length
 
 
+@pytest.mark.parametrize(
+    "query, expected_first_id",
+    [
+        ("Par", 2988507),
+        ("Lon", 2643743),
+        ("Wroc", 3081368),
+    ]
+)
+def test_search_ranked(city_db, query, expected_first_id):
+    cities = city_db.search(query, ranked=True)
+    assert cities[0].id == expected_first_id
+    assert sorted(cities, key=lambda city: city.id) == sorted(city_db.search(query), key=lambda city: city.id)
+    assert city_db.search(query, ranked=True, limit=3) == cities[:3]
+
+
+@pytest.mark.parametrize(
+    "query, expected_first_id",
+    [
+        ("Wroclw", 3081368),
+        ("Wroclaw", 3081368),
+        ("Breslau", 3081368),
+        ("Kiev ", 703448),
+        ("Nwe York", 5128581),
+        ("San Francsico", 5391959),
+        ("Krakw", 3094802),
+        ("Wroc", 3081368),
+        ("Lo", 2643743),
+    ]
+)
+def test_search_fuzzy(indexed_city_db, query, expected_first_id):
+    cities = indexed_city_db.search(query, fuzzy=True, limit=5)
+    assert cities[0].id == expected_first_id
+    assert indexed_city_db.search(query, fuzzy=True, limit=2) == cities[:2]
+
+
+def test_search_fuzzy_without_match(indexed_city_db):
+    assert indexed_city_db.search("Qqxqqxqq", fuzzy=True) == []
+
+
+def test_search_fuzzy_without_trigram_index(data_dir, tmp_path):
+    datasource = tmp_path / "data_no_trigrams.db"
+    shutil.copy(data_dir / "data.db", datasource)
+    conn = sqlite3.connect(datasource)
+    for table_name in (config.CITY_TRIGRAM_VOCAB_TABLE_NAME, config.CITY_TRIGRAM_TABLE_NAME):
+        conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+    conn.close()
+
+    cities = database.CityDatabase[model.CityInfo](fetch_fields=config.CITY_MIN_FIELDS).connect(datasource)
+    with pytest.raises(ValueError):
+        cities.search("Wroclw", fuzzy=True)
+    assert cities.search("Wroclaw")
+    cities.close()
+
+
+@pytest.mark.parametrize("query", ["Bre", "Kyiv", "query"])
+def test_iter_search(city_db, query):
+    assert list(city_db.iter_search(query, lang="en", batch_size=5)) == city_db.search(query, lang="en")
+
+
+def test_iter_search_partially_consumed(city_db):
+    cities = city_db.iter_search("Bre", batch_size=2)
+    first = next(cities)
+    assert city_db.get_city(3081368)
+    assert city_db.search("Kyiv")
+    assert [first, *cities] == city_db.search("Bre")
+
+
+@pytest.mark.parametrize("limit", [1, 7, 100])
+def test_iter_nearest(city_db, indexed_city_db, limit):
+    point = (-17.7, 179.99)
+    expected = city_db.get_nearest(*point, limit=limit)
+    assert list(city_db.iter_nearest(*point, limit=limit, batch_size=3)) == expected
+    assert list(indexed_city_db.iter_nearest(*point, limit=limit, batch_size=3)) == expected
+
+
 @pytest.mark.parametrize(
     "point, expected_city_ids",
     [
@@ -54,6 +196,161 @@ def test_get_nearest(city_db, point, expected_city_ids):
     assert all(city.id == city_id for city, city_id in zip(cities, expected_city_ids))
 
 
+@pytest.mark.parametrize(
+    "point",
+    [
+        (51.1, 17.03333),
+        (43.313, -31.123),
+        (-17.7, 179.99),
+        (65.5, -179.9),
+        (89.9, 0.0),
+        (-90.0, 0.0),
+    ]
+)
+@pytest.mark.parametrize("limit", [1, 3, 10])
+def test_get_nearest_indexed(city_db, indexed_city_db, point, limit):
+    assert indexed_city_db.get_nearest(*point, limit=limit) == city_db.get_nearest(*point, limit=limit)
+
+
+def test_get_nearest_kdtree(city_db, indexed_city_db, temp_data_path):
+    datasource = temp_data_path / "data_indexed.db"
+    kdtree_db = database.CityDatabase[model.CityInfo](fetch_fields=config.CITY_MIN_FIELDS)
+    kdtree_db.connect(datasource, load_kdtree=True)
+    assert (temp_data_path / "data_indexed.db.kdtree").exists()
+    assert not (temp_data_path / f"data_indexed.db.kdtree{config.KDTREE_PART_SUFFIX}").exists()
+
+    loaded_kdtree_db = database.CityDatabase[model.CityInfo](use_kdtree=True)
+    loaded_kdtree_db.connect(datasource)
+    assert list(loaded_kdtree_db.kdtree.ids) == list(kdtree_db.kdtree.ids)
+
+    for point in [(51.1, 17.03333), (43.313, -31.123), (-17.7, 179.99), (65.5, -179.9), (89.9, 0.0)]:
+        assert kdtree_db.get_nearest(*point, limit=5) == city_db.get_nearest(*point, limit=5)
+        assert list(kdtree_db.iter_nearest(*point, limit=5, batch_size=2)) == city_db.get_nearest(*point, limit=5)
+        radius_ids = [geonames_id for geonames_id, _ in kdtree_db.kdtree.radius_search(*point, 300)]
+        assert radius_ids == [city.id for city in kdtree_db.get_nearest(*point, limit=len(radius_ids))]
+
+    kdtree_db.close()
+    loaded_kdtree_db.close()
+
+
+@pytest.mark.parametrize(
+    "point, distance_km, filters",
+    [
+        ((51.1, 17.03333), 50, {}),
+        ((51.1, 17.03333), 300, {"country_code": "PL", "min_population": 100000}),
+        ((51.1, 17.03333), 300, {"country_code": "PL", "admin1_code": "72"}),
+        ((-17.7, 179.99), 500, {"country_code": "FJ"}),
+    ]
+)
+def test_get_within_radius(indexed_city_db, point, distance_km, filters):
+    conn = indexed_city_db.conn
+    rows = conn.execute("SELECT geonames_id, latitude, longitude, country_code, admin1_code, population FROM city")
+    expected = sorted(
+        (utils.calculate_distance(*point, latitude, longitude), geonames_id)
+        for geonames_id, latitude, longitude, country_code, admin1_code, population in rows
+        if utils.calculate_distance(*point, latitude, longitude) <= distance_km
+        and country_code == filters.get("country_code", country_code)
+        and admin1_code == filters.get("admin1_code", admin1_code)
+        and population >= filters.get("min_population", 0)
+    )
+
+    cities = indexed_city_db.get_within_radius(*point, distance_km, **filters)
+    assert cities
+    assert [city.id for city in cities] == [geonames_id for _, geonames_id in expected]
+
+    indexed_city_db.use_kdtree = True
+    try:
+        kdtree_cities = indexed_city_db.get_within_radius(*point, distance_km, **filters)
+        assert indexed_city_db.get_within_radius(*point, distance_km, limit=2, **filters) == kdtree_cities[:2]
+    finally:
+        indexed_city_db.use_kdtree = False
+    assert kdtree_cities == cities
+
+
+def test_kdtree_built_once(data_dir, tmp_path, monkeypatch):
+    datasource = tmp_path / "data.db"
+    shutil.copy(data_dir / "data.db", datasource)
+    builds = []
+    build = spatial.CityKDTree.build.__func__
+    monkeypatch.setattr(
+        spatial.CityKDTree, "build", classmethod(lambda cls, rows: builds.append(1) or build(cls, rows))
+    )
+
+    cities = database.CityDatabase[model.CityInfo](fetch_fields=config.CITY_MIN_FIELDS).connect(datasource, pool_size=4)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        kdtrees = list(executor.map(lambda _: cities.kdtree, range(8)))
+    assert len(builds) == 1
+    assert all(kdtree is kdtrees[0] for kdtree in kdtrees)
+    cities.close()
+
+
+@pytest.mark.parametrize(
+    "box, filters, expected_country_codes",
+    [
+        ((50.0, 16.0, 52.0, 18.0), {"min_population": 50000}, {"PL", "CZ"}),
+        ((-20.0, 170.0, -10.0, -170.0), {}, {"FJ", "WS", "TO", "WF", "AS", "VU", "NU"}),
+        ((-20.0, 170.0, -10.0, -170.0), {"country_code": "FJ"}, {"FJ"}),
+    ]
+)
+def test_get_in_bbox(indexed_city_db, temp_data_path, box, filters, expected_country_codes):
+    db = database.CityDatabase[dict](fetch_fields=("id", "country_code", "population"))
+    db.connect(temp_data_path / "data_indexed.db")
+    cities = db.get_in_bbox(*box, **filters)
+    db.close()
+
+    assert cities
+    assert {city["country_code"] for city in cities} <= expected_country_codes
+    assert all(city["population"] >= filters.get("min_population", 0) for city in cities)
+    assert [city["population"] for city in cities] == sorted((city["population"] for city in cities), reverse=True)
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_get_nearest_many(city_db, monkeypatch, use_numpy):
+    if use_numpy and spatial.numpy is None:
+        pytest.skip("NumPy is not installed")
+    if not use_numpy:
+        monkeypatch.setattr(spatial, "numpy", None)
+
+    points = [(51.1, 17.03333), (43.313, -31.123), (-17.7, 179.99), (89.9, 0.0), (51.1, 17.03333)]
+    cities = city_db.get_nearest_many(points, limit=3)
+    assert cities == [city_db.get_nearest(*point, limit=3) for point in points]
+
+
+def test_connection_pool(city_db, data_dir):
+    pooled_db = database.CityDatabase[model.CityInfo](fetch_fields=config.CITY_MIN_FIELDS)
+    pooled_db.connect(data_dir / "data.db", pool_size=3)
+    queries = ["Kyiv", "Bre", "Wroclaw", "Par"] * 5
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda query: pooled_db.search(query, lang="en"), queries))
+
+    assert results == [city_db.search(query, lang="en") for query in queries]
+    assert pooled_db.get_nearest(51.1, 17.03333, limit=3) == city_db.get_nearest(51.1, 17.03333, limit=3)
+    with pytest.raises(sqlite3.OperationalError):
+        with pooled_db._pool.connection() as conn:
+            conn.execute(f"DELETE FROM {config.CITY_TABLE_NAME}")
+    pooled_db.close()
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"in_memory": True},
+        {"in_memory": True, "pool_size": 2},
+        {"mmap_size": 1 << 26},
+    ]
+)
+def test_storage_modes(city_db, data_dir, params):
+    db = database.CityDatabase[model.CityInfo](fetch_fields=("id", "name", "administrative_name", "country_name"))
+    db.connect(data_dir / "data.db", **params)
+
+    assert db.supported_languages == city_db.supported_languages
+    assert db.search("Bre", lang="pl") == city_db.search("Bre", lang="pl")
+    assert db.get_city(703448, lang="uk") == city_db.get_city(703448, lang="uk")
+    assert db.get_nearest(51.1, 17.03333, limit=3) == city_db.get_nearest(51.1, 17.03333, limit=3)
+    db.close()
+
+
 @pytest.mark.parametrize(
     "row_cls, row_factory",
     [
@@ -71,3 +368,38 @@ def test_row_factory_config(data_dir, row_cls, row_factory):
     assert isinstance(city, row_cls)
 
     db.close()
+
+
+@pytest.mark.parametrize("lang", ["", "en", "uk"])
+def test_lookup_tables(lookup_city_dbs, lang):
+    cities, normalized_cities = lookup_city_dbs
+
+    def strip(rows):
+        return [row[:-1] for row in rows]
+
+    assert cities.get_city(703448, lang=lang) == normalized_cities.get_city(703448, lang=lang)[:-1]
+    assert cities.get_cities([703448, 1, 3081368], lang=lang) == [
+        city and city[:-1] for city in normalized_cities.get_cities([703448, 1, 3081368], lang=lang)
+    ]
+    assert cities.search("Bre", lang=lang, ranked=True) == strip(
+        normalized_cities.search("Bre", lang=lang, ranked=True)
+    )
+    assert cities.get_nearest(51.1, 17.03, lang=lang, limit=5) == strip(
+        normalized_cities.get_nearest(51.1, 17.03, lang=lang, limit=5)
+    )
+    assert cities.get_within_radius(50.45, 30.52, 100, lang=lang, min_population=50000) == strip(
+        normalized_cities.get_within_radius(50.45, 30.52, 100, lang=lang, min_population=50000)
+    )
+    assert cities.get_in_bbox(49, 14, 55, 24, lang=lang, country_code="PL") == strip(
+        normalized_cities.get_in_bbox(49, 14, 55, 24, lang=lang, country_code="PL")
+    )
+
+
+def test_lookup_tables_used(lookup_city_dbs):
+    cities, normalized_cities = lookup_city_dbs
+    plan = cities.explain("get_city", 703448, lang="en")[0]
+    assert f"{config.CITY_LOOKUP_TABLE_NAME}_en" in plan.sql
+    assert config.ADMINISTRATIVE_TABLE_NAME not in plan.sql
+    assert config.CITY_LOOKUP_TABLE_NAME not in normalized_cities.explain("get_city", 703448, lang="en")[0].sql
+    # A language without a lookup table reads the normalized tables
+    assert config.CITY_LOOKUP_TABLE_NAME not in cities.explain("get_city", 703448, lang="pl")[0].sql
@@ -1,4 +1,13 @@
 # -*- coding: utf-8 -*-
+import functools
+import http.server
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+from urllib.error import HTTPError
+
 import pytest
 
 from pycities import config
@@ -29,3 +38,196 @@ def test_file_unzip(data_dir, temp_data_path, filename, expected_filename):
     datadownload.file_unzip(temp_data_path, data_dir / filename)
     extracted_file_path = temp_data_path / expected_filename
     assert extracted_file_path.exists()
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Static file handler with ETag and single byte range support, it records the status of every response"""
+
+    statuses: List[Tuple[str, int]] = []
+
+    def log_message(self, *_args) -> None:
+        pass
+
+    def send_response(self, code, message=None) -> None:
+        self.statuses.append((self.path.lstrip("/"), code))
+        super().send_response(code, message)
+
+    def _etag(self, path: str) -> str:
+        stat = os.stat(path)
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return super().send_head()
+
+        etag = self._etag(path)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(http.HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return None
+
+        size = os.path.getsize(path)
+        file = open(path, "rb")
+        range_header = self.headers.get("Range")
+        if range_header and self.headers.get("If-Range", etag) == etag:
+            start = int(range_header[len("bytes="):].split("-")[0])
+            if start >= size:
+                file.close()
+                self.send_error(http.HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                return None
+            file.seek(start)
+            self.send_response(http.HTTPStatus.PARTIAL_CONTENT)
+            self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+            self.send_header("Content-Length", str(size - start))
+        else:
+            self.send_response(http.HTTPStatus.OK)
+            self.send_header("Content-Length", str(size))
+
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("ETag", etag)
+        self.end_headers()
+        return file
+
+
+@pytest.fixture()
+def server_dir(tmp_path, data_dir):
+    directory = tmp_path / "server"
+    directory.mkdir()
+    for filename in (config.COUNTRIES_FILENAME, config.ADMINISTRATIVE_FILENAME, config.CITIES_ARCHIVE_FILENAME):
+        shutil.copy(data_dir / filename, directory / filename)
+    return directory
+
+
+class NoValidatorsHandler(RangeRequestHandler):
+    """Handler of a server which doesn't send validators and doesn't allow HEAD requests"""
+
+    def send_header(self, keyword, value) -> None:
+        if keyword != "ETag":
+            super().send_header(keyword, value)
+
+    def do_HEAD(self) -> None:
+        self.send_error(http.HTTPStatus.METHOD_NOT_ALLOWED)
+
+
+class UnsatisfiableRangeHandler(RangeRequestHandler):
+    """Handler of a server which responds to every request with 416"""
+
+    def send_head(self):
+        self.send_error(http.HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+        return None
+
+
+@contextmanager
+def _serving(directory, handler_cls=RangeRequestHandler) -> Iterator[str]:
+    RangeRequestHandler.statuses = []
+    handler = functools.partial(handler_cls, directory=str(directory))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture()
+def server_url(server_dir):
+    with _serving(server_dir) as url:
+        yield url
+
+
+@pytest.fixture()
+def download_dir(tmp_path):
+    directory = tmp_path / "download"
+    directory.mkdir()
+    return directory
+
+
+def test_download_files(server_dir, server_url, download_dir):
+    filenames = [config.COUNTRIES_FILENAME, config.ADMINISTRATIVE_FILENAME, config.CITIES_ARCHIVE_FILENAME]
+    reported = {}
+    paths = datadownload.download_files(
+        filenames, download_dir, server_url,
+        progress=lambda filename, downloaded, total: reported.__setitem__(filename, (downloaded, total)),
+    )
+
+    assert set(paths) == set(filenames)
+    for filename in filenames:
+        size = (server_dir / filename).stat().st_size
+        assert (download_dir / filename).read_bytes() == (server_dir / filename).read_bytes()
+        assert reported[filename] == (size, size)
+        assert not (download_dir / (filename + config.DOWNLOAD_PART_SUFFIX)).exists()
+
+
+def test_download_file_unchanged(server_dir, server_url, download_dir):
+    filename = config.CITIES_ARCHIVE_FILENAME
+    datadownload.download_file(filename, download_dir, server_url, progress=lambda *_args: None)
+    datadownload.download_file(filename, download_dir, server_url, progress=lambda *_args: None)
+    assert RangeRequestHandler.statuses == [(filename, 200), (filename, 304)]
+
+    with open(server_dir / filename, "ab") as file:
+        file.write(b"\0")
+    datadownload.download_file(filename, download_dir, server_url, progress=lambda *_args: None)
+    assert RangeRequestHandler.statuses[-1] == (filename, 200)
+    assert (download_dir / filename).read_bytes() == (server_dir / filename).read_bytes()
+
+
+def test_download_file_resume(server_dir, server_url, download_dir):
+    filename = config.CITIES_ARCHIVE_FILENAME
+    datadownload.download_file(filename, download_dir, server_url, progress=lambda *_args: None)
+    content = (server_dir / filename).read_bytes()
+    # Imitates a dropped connection in the middle of the download
+    part_path = download_dir / (filename + config.DOWNLOAD_PART_SUFFIX)
+    (download_dir / filename).rename(part_path)
+    part_path.write_bytes(content[:len(content) // 2])
+
+    datadownload.download_file(filename, download_dir, server_url, progress=lambda *_args: None)
+    assert RangeRequestHandler.statuses[-1] == (filename, 206)
+    assert (download_dir / filename).read_bytes() == content
+    assert not part_path.exists()
+
+
+def test_download_file_resume_changed(server_dir, server_url, download_dir):
+    filename = config.CITIES_ARCHIVE_FILENAME
+    datadownload.download_file(filename, download_dir, server_url, progress=lambda *_args: None)
+    part_path = download_dir / (filename + config.DOWNLOAD_PART_SUFFIX)
+    (download_dir / filename).rename(part_path)
+
+    with open(server_dir / filename, "ab") as file:
+        file.write(b"\0")
+    datadownload.download_file(filename, download_dir, server_url, progress=lambda *_args: None)
+    assert RangeRequestHandler.statuses[-1] == (filename, 200)
+    assert (download_dir / filename).read_bytes() == (server_dir / filename).read_bytes()
+
+
+def test_download_file_part_too_long(server_dir, server_url, download_dir):
+    filename = config.CITIES_ARCHIVE_FILENAME
+    datadownload.download_file(filename, download_dir, server_url, progress=lambda *_args: None)
+    part_path = download_dir / (filename + config.DOWNLOAD_PART_SUFFIX)
+    (download_dir / filename).rename(part_path)
+    part_path.write_bytes(part_path.read_bytes() + b"\0")
+
+    datadownload.download_file(filename, download_dir, server_url, progress=lambda *_args: None)
+    assert RangeRequestHandler.statuses[-2:] == [(filename, 416), (filename, 200)]
+    assert (download_dir / filename).read_bytes() == (server_dir / filename).read_bytes()
+
+
+def test_download_file_unsatisfiable_without_part(server_dir, download_dir):
+    filename = config.CITIES_ARCHIVE_FILENAME
+    with _serving(server_dir, UnsatisfiableRangeHandler) as url:
+        with pytest.raises(HTTPError) as error:
+            datadownload.download_file(filename, download_dir, url, progress=lambda *_args: None)
+    assert error.value.code == 416
+    assert RangeRequestHandler.statuses == [(filename, 416)]
+
+
+def test_download_file_head_failed(server_dir, download_dir):
+    filename = config.CITIES_ARCHIVE_FILENAME
+    with _serving(server_dir, NoValidatorsHandler) as url:
+        datadownload.download_file(filename, download_dir, url, progress=lambda *_args: None)
+        datadownload.download_file(filename, download_dir, url, progress=lambda *_args: None)
+    assert RangeRequestHandler.statuses == [(filename, 200), (filename, 405), (filename, 200)]
+    assert (download_dir / filename).read_bytes() == (server_dir / filename).read_bytes()
@@ -1,4 +1,5 @@
 import sqlite3
+import zipfile
 
 import pytest
 
@@ -15,7 +16,8 @@ def sqlite_conn(temp_data_path):
 
 def test_load_countries(sqlite_conn, data_dir) -> None:
     datadump.init_country_table(sqlite_conn)
-    datadump.load_country_data(sqlite_conn, data_dir / config.COUNTRIES_FILENAME)
+    row_count = datadump.load_country_data(sqlite_conn, data_dir / config.COUNTRIES_FILENAME)
+    assert row_count == sqlite_conn.execute(f"SELECT COUNT(*) FROM {config.COUNTRY_TABLE_NAME}").fetchone()[0] > 0
 
 
 def test_load_administrative(sqlite_conn, data_dir) -> None:
@@ -25,12 +27,32 @@ def test_load_administrative(sqlite_conn, data_dir) -> None:
 
 def test_load_cities(sqlite_conn, data_dir) -> None:
     datadump.init_city_table(sqlite_conn)
-    datadump.load_city_data(sqlite_conn, data_dir / config.CITIES_FILENAME)
+    row_count = datadump.load_city_data(sqlite_conn, data_dir / config.CITIES_ARCHIVE_FILENAME)
+    assert row_count == sqlite_conn.execute(f"SELECT COUNT(*) FROM {config.CITY_TABLE_NAME}").fetchone()[0] > 0
 
 
 def test_load_alternate_names(sqlite_conn, data_dir, languages) -> None:
     datadump.init_alternate_name_table(sqlite_conn)
     datadump.load_alternate_names(sqlite_conn, data_dir / config.ALTERNATE_NAMES_FILENAME, languages=languages)
+    assert None not in languages
+    index_names = {
+        row[0] for row in sqlite_conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?", (config.ALTERNATE_NAME_TABLE_NAME,)
+        )
+    }
+    assert set(config.ALTERNATE_NAME_INDEXES) <= index_names
+
+
+def test_load_alternate_names_archive(data_dir, temp_data_path, languages) -> None:
+    archive_path = temp_data_path / config.ALTERNATE_NAMES_ARCHIVE_FILENAME
+    with zipfile.ZipFile(archive_path, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.write(data_dir / config.ALTERNATE_NAMES_FILENAME, config.ALTERNATE_NAMES_FILENAME)
+
+    conn = sqlite3.connect(temp_data_path / "geonames_test.db")
+    expected_count = conn.execute(f"SELECT COUNT(*) FROM {config.ALTERNATE_NAME_TABLE_NAME}").fetchone()[0]
+    datadump.init_alternate_name_table(conn)
+    assert datadump.load_alternate_names(conn, archive_path, languages=languages) == expected_count
+    conn.close()
 
 
 @pytest.mark.parametrize(
@@ -42,5 +64,60 @@ def test_create_alternate_name_columns(sqlite_conn, languages, table_name):
 
 
 def test_create_city_names_fts(sqlite_conn):
-    datadump.create_city_names_fts(sqlite_conn)
+    datadump.create_city_names_fts(sqlite_conn, fuzzy=True)
+    names = sqlite_conn.execute(
+        f"SELECT name FROM {config.CITY_NAME_TABLE_NAME} WHERE geonames_id = 3081368"
+    ).fetchall()
+    assert ("wroclaw",) in names and ("breslau",) in names
+    assert sqlite_conn.execute(
+        f"SELECT COUNT(*) FROM {config.CITY_TRIGRAM_TABLE_NAME} WHERE {config.CITY_TRIGRAM_TABLE_NAME} MATCH 'rocl'"
+    ).fetchone()[0] > 0
+
+
+def test_create_city_spatial_index(sqlite_conn):
+    datadump.create_city_spatial_index(sqlite_conn)
+    city_count = sqlite_conn.execute(f"SELECT COUNT(*) FROM {config.CITY_TABLE_NAME}").fetchone()[0]
+    index_count = sqlite_conn.execute(f"SELECT COUNT(*) FROM {config.CITY_RTREE_TABLE_NAME}").fetchone()[0]
+    assert index_count == city_count
+
+
+def test_create_city_indexes(sqlite_conn):
+    datadump.create_city_indexes(sqlite_conn)
+    index_names = {
+        row[0] for row in sqlite_conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?", (config.CITY_TABLE_NAME,)
+        )
+    }
+    assert set(config.CITY_INDEXES) <= index_names
+
+
+def test_load_restores_pragmas(data_dir, tmp_path):
+    conn = sqlite3.connect(tmp_path / "pragmas.db")
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.execute("PRAGMA synchronous = 2")
+    conn.execute("PRAGMA cache_size = -2000")
+    datadump.init_country_table(conn)
+    datadump.load_country_data(conn, data_dir / config.COUNTRIES_FILENAME)
+    pragmas = ("journal_mode", "synchronous", "cache_size")
+    assert [conn.execute(f"PRAGMA {pragma}").fetchone()[0] for pragma in pragmas] == ["delete", 2, -2000]
+
+    conn.execute(f"DELETE FROM {config.COUNTRY_TABLE_NAME}")
+    assert conn.in_transaction
+    with pytest.raises(RuntimeError):
+        datadump.load_country_data(conn, data_dir / config.COUNTRIES_FILENAME)
+    conn.rollback()
+    conn.close()
 
+
+def test_load_rolled_back(data_dir, tmp_path):
+    conn = sqlite3.connect(tmp_path / "rollback.db")
+    datadump.init_country_table(conn)
+    countries_path = tmp_path / config.COUNTRIES_FILENAME
+    # The second copy of the countries breaks their unique constraints in the middle of the load
+    countries = (data_dir / config.COUNTRIES_FILENAME).read_text(encoding="utf-8")
+    countries_path.write_text(countries + countries, encoding="utf-8")
+    with pytest.raises(sqlite3.IntegrityError):
+        datadump.load_country_data(conn, countries_path)
+    assert conn.execute(f"SELECT COUNT(*) FROM {config.COUNTRY_TABLE_NAME}").fetchone()[0] == 0
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    conn.close()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+from dataclasses import dataclass
+from typing import NamedTuple, Optional
+
+import pytest
+
+from pycities import config
+from pycities import database
+from pycities import model
+
+
+@dataclass(frozen=True)
+class CityDataclass:
+    id: int
+    name: str
+    country_name: str
+    population: Optional[int] = None
+
+
+class CityTuple(NamedTuple):
+    id: int
+    name: str
+    country_name: str
+
+
+class CitySlots:
+    __slots__ = ("id", "name", "country_name")
+
+    def __init__(self, id: int, name: str, country_name: str) -> None:
+        self.id = id
+        self.name = name
+        self.country_name = country_name
+
+
+class CityReorderedSlots:
+    __slots__ = ("name", "id")
+
+    def __init__(self, id: int, name: str) -> None:
+        self.id = id
+        self.name = name
+
+
+ROW = (3081368, "Wroclaw", "Poland")
+
+
+@pytest.mark.parametrize("row_cls", [CityDataclass, CityTuple, CitySlots])
+def test_compile_row_factory(row_cls):
+    city = model.compile_row_factory(row_cls, ("id", "name", "country_name"))(None, ROW)
+    assert (city.id, city.name, city.country_name) == ROW
+
+    reordered = model.compile_row_factory(row_cls, ("country_name", "id", "name"))(None, ROW[2:] + ROW[:2])
+    assert (reordered.id, reordered.name, reordered.country_name) == ROW
+
+
+def test_compile_row_factory_cached():
+    fields = ("id", "name", "country_name")
+    assert model.compile_row_factory(CityTuple, fields) is model.compile_row_factory(CityTuple, fields)
+    assert model.compile_row_factory(dict, fields)(None, ROW) == dict(zip(fields, ROW))
+
+
+@pytest.mark.parametrize(
+    "row_cls, fields",
+    [
+        (CityDataclass, ("id", "name")),
+        (CityDataclass, ("id", "name", "country_name", "latitude")),
+        (CityDataclass, ("id", "name", "country_name", "unknown")),
+        (CityDataclass, ("*",)),
+        (int, ("id",)),
+    ]
+)
+def test_compile_row_factory_invalid(row_cls, fields):
+    with pytest.raises(ValueError):
+        model.compile_row_factory(row_cls, fields)
+
+
+def test_city_model(data_dir):
+    fields = tuple(field for field in config.CITY_ALL_FIELDS if field != "*")
+    assert model.model_fields(model.City) == fields
+
+    cities = database.CityDatabase[model.City](fetch_fields=config.CITY_MIN_FIELDS).connect(data_dir / "data.db")
+    expected = database.CityDatabase[model.CityInfo](fetch_fields=config.CITY_MIN_FIELDS).connect(data_dir / "data.db")
+    city, city_info = cities.get_city(3081368), expected.get_city(3081368)
+    assert (city.id, city.name, city.administrative_name, city.country_name) == (
+        city_info.id, city_info.name, city_info.administrative_name, city_info.country_name
+    )
+    assert city.population is None
+    assert city == model.City(**{field: getattr(city, field) for field in fields})
+    assert city == model.City(*(getattr(city, field) for field in fields))
+    with pytest.raises(TypeError):
+        hash(city)
+    assert not hasattr(city, "__dict__")
+    with pytest.raises(TypeError):
+        model.City(unknown_field=1)
+    cities.close()
+    expected.close()
+
+
+def test_connect_validates_fields(data_dir):
+    cities = database.CityDatabase[CityTuple](fetch_fields=("id", "name"))
+    with pytest.raises(ValueError):
+        cities.connect(data_dir / "data.db")
+
+
+def test_slots_fields_in_constructor_order(data_dir):
+    assert model.model_fields(CityReorderedSlots) == ("id", "name")
+    city = model.compile_row_factory(CityReorderedSlots, ("name", "id"))(None, ("Wroclaw", 3081368))
+    assert (city.id, city.name) == (3081368, "Wroclaw")
+
+    cities = database.CityDatabase[CityReorderedSlots](fetch_fields=("name", "id")).connect(data_dir / "data.db")
+    city = cities.get_city(3081368, lang="en")
+    assert (city.id, city.name) == (3081368, "Wroclaw")
+    cities.close()
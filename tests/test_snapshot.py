@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import pytest
+
+from pycities import config
+from pycities import database
+from pycities import model
+from pycities import snapshot
+from pycities import stats
+
+
+@pytest.fixture(scope="module")
+def snapshot_path(data_dir, temp_data_path):
+    path = temp_data_path / f"data.db{config.SNAPSHOT_FILE_SUFFIX}"
+    conn = sqlite3.connect(data_dir / "data.db")
+    snapshot.write_snapshot(conn, path, ["uk", "en"])
+    conn.close()
+    return path
+
+
+@pytest.fixture(scope="module")
+def city_dbs(data_dir, snapshot_path):
+    snapshot_db = snapshot.SnapshotCityDatabase[tuple](fetch_fields=config.SNAPSHOT_FIELDS).connect(snapshot_path)
+    sqlite_db = database.CityDatabase[tuple](fetch_fields=config.SNAPSHOT_FIELDS).connect(data_dir / "data.db")
+    yield snapshot_db, sqlite_db
+    snapshot_db.close()
+    sqlite_db.close()
+
+
+@pytest.mark.parametrize("lang", ["", "en", "uk"])
+def test_snapshot_get_city(city_dbs, lang):
+    snapshot_db, sqlite_db = city_dbs
+    assert snapshot_db.supported_languages == ("uk", "en")
+    for geonames_id in (3081368, 5128581, 703448):
+        assert snapshot_db.get_city(geonames_id, lang=lang) == sqlite_db.get_city(geonames_id, lang=lang)
+    assert snapshot_db.get_city(-1) is None
+    ids = [3081368, -1, 703448, 3081368]
+    assert snapshot_db.get_cities(ids, lang=lang) == sqlite_db.get_cities(ids, lang=lang)
+
+
+@pytest.mark.parametrize("query", ["Bre", "Wro", "New York", "Kyi", "Київ", "sao", "kargāh", "x"])
+def test_snapshot_search(city_dbs, query):
+    snapshot_db, sqlite_db = city_dbs
+    assert set(snapshot_db.search(query)) == set(sqlite_db.search(query))
+    assert list(snapshot_db.iter_search(query, batch_size=2)) == snapshot_db.search(query)
+
+    ranked = snapshot_db.search(query, ranked=True, limit=5)
+    populations = [city[config.SNAPSHOT_FIELDS.index("population")] for city in ranked]
+    assert populations == sorted(populations, reverse=True)
+
+
+def test_snapshot_search_words(city_dbs):
+    snapshot_db, _ = city_dbs
+    assert snapshot_db.search("Kyiv", ranked=True, limit=1, lang="en")[0][:3] == (703448, 703448, "Kyiv")
+    assert snapshot_db.search("") == []
+    with pytest.raises(ValueError):
+        snapshot_db.search("Kyiv", fuzzy=True)
+
+
+@pytest.mark.parametrize("latitude, longitude", [(51.1, 17.03), (40.71, -74.0), (-16.5, 179.9), (89.0, 0.0)])
+def test_snapshot_spatial(city_dbs, latitude, longitude):
+    snapshot_db, sqlite_db = city_dbs
+    assert snapshot_db.get_nearest(latitude, longitude, limit=5) == sqlite_db.get_nearest(latitude, longitude, limit=5)
+    assert snapshot_db.get_nearest_many([(latitude, longitude)], limit=3) == [
+        sqlite_db.get_nearest(latitude, longitude, limit=3)
+    ]
+    assert snapshot_db.get_within_radius(latitude, longitude, 300, min_population=50000) == (
+        sqlite_db.get_within_radius(latitude, longitude, 300, min_population=50000)
+    )
+    box = (latitude - 5, longitude - 5, latitude + 5, longitude + 5)
+    assert snapshot_db.get_in_bbox(*box, limit=10) == sqlite_db.get_in_bbox(*box, limit=10)
+
+
+def test_snapshot_filters(city_dbs):
+    snapshot_db, sqlite_db = city_dbs
+    params = {"country_code": "PL", "admin1_code": "72", "lang": "en"}
+    assert snapshot_db.get_within_radius(51.1, 17.03, 100, **params) == (
+        sqlite_db.get_within_radius(51.1, 17.03, 100, **params)
+    )
+    # The box crosses the antimeridian
+    assert snapshot_db.get_in_bbox(-20, 170, 10, -170) == sqlite_db.get_in_bbox(-20, 170, 10, -170)
+
+
+def test_snapshot_stats(snapshot_path):
+    cities = snapshot.SnapshotCityDatabase[tuple](query_stats=stats.QueryStats()).connect(snapshot_path)
+    result = cities.get_nearest_many([(51.1, 17.03), (40.71, -74.0)], limit=2)
+    method_stats = cities.stats()
+    assert set(method_stats) == {"get_nearest_many"}
+    assert (method_stats["get_nearest_many"].calls, method_stats["get_nearest_many"].rows) == (1, 4)
+    assert len(result) == 2
+    cities.close()
+
+
+def test_snapshot_models(snapshot_path):
+    cities = snapshot.SnapshotCityDatabase[model.City]().connect(snapshot_path)
+    city = cities.get_city(3081368, lang="en")
+    assert (city.id, city.name, city.country_name, city.alternate_names) == (3081368, "Wroclaw", "Poland", None)
+    cities.close()
+
+    cities = snapshot.SnapshotCityDatabase[dict](fetch_fields=config.CITY_MIN_FIELDS).connect(snapshot_path)
+    assert cities.get_city(3081368, lang="en")["name"] == "Wroclaw"
+    with pytest.raises(ValueError):
+        cities.get_city(3081368, lang="pl")
+    cities.close()
+
+
+def test_snapshot_invalid(snapshot_path, tmp_path):
+    with pytest.raises(ValueError):
+        snapshot.SnapshotCityDatabase[tuple](fetch_fields=("id", "alternate_names")).connect(snapshot_path)
+    with pytest.raises(ValueError):
+        snapshot.SnapshotCityDatabase[sqlite3.Row]().connect(snapshot_path)
+
+    invalid_path = tmp_path / "invalid.snapshot"
+    invalid_path.write_bytes(b"not a snapshot file")
+    with pytest.raises(ValueError):
+        snapshot.SnapshotCityDatabase[tuple]().connect(invalid_path)
+    invalid_path.write_bytes(snapshot_path.read_bytes()[:4096])
+    with pytest.raises(ValueError):
+        snapshot.SnapshotCityDatabase[tuple]().connect(invalid_path)
+    with pytest.raises(RuntimeError):
+        snapshot.SnapshotCityDatabase[tuple]().get_city(3081368)
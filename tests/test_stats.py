@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from pycities import config
+from pycities import database
+from pycities import model
+from pycities import stats
+
+
+@pytest.fixture()
+def events():
+    return []
+
+
+@pytest.fixture()
+def stats_city_db(data_dir, events):
+    query_stats = stats.QueryStats(callback=events.append)
+    cities = database.CityDatabase[model.CityInfo](fetch_fields=config.CITY_MIN_FIELDS, query_stats=query_stats)
+    cities.connect(data_dir / "data.db")
+    yield cities
+    cities.close()
+
+
+@pytest.fixture()
+def city_db_without_stats(data_dir):
+    cities = database.CityDatabase[model.CityInfo](fetch_fields=config.CITY_MIN_FIELDS)
+    cities.connect(data_dir / "data.db")
+    yield cities
+    cities.close()
+
+
+def test_stats_disabled(city_db_without_stats):
+    assert city_db_without_stats.stats() == {}
+
+
+def test_stats_records_calls(stats_city_db, city_db_without_stats, events):
+    assert stats_city_db.search("Kyiv", limit=5) == city_db_without_stats.search("Kyiv", limit=5)
+    stats_city_db.search("Wro", limit=5)
+    assert stats_city_db.get_city(3081368) == city_db_without_stats.get_city(3081368)
+    assert stats_city_db.get_city(-1) is None
+    stats_city_db.get_cities([3081368, -1, 703448])
+
+    snapshot = stats_city_db.stats()
+    assert snapshot["search"].calls == 2
+    assert snapshot["get_city"].calls == 2 and snapshot["get_city"].rows == 1
+    assert snapshot["get_cities"].rows == 2
+    for method_stats in snapshot.values():
+        assert sum(method_stats.histogram) == method_stats.calls
+        assert len(method_stats.histogram) == len(config.STATS_LATENCY_BUCKETS_MS) + 1
+        assert 0 < method_stats.sqlite_ms <= method_stats.total_ms
+        assert method_stats.row_factory_ms > 0
+
+    assert [event.method for event in events] == ["search", "search", "get_city", "get_city", "get_cities"]
+    assert events[0].rows == len(city_db_without_stats.search("Kyiv", limit=5))
+
+    stats_city_db.query_stats.reset()
+    assert stats_city_db.stats() == {}
+
+
+def test_stats_records_iterators(stats_city_db, city_db_without_stats):
+    expected = city_db_without_stats.search("Bre")
+    iterator = stats_city_db.iter_search("Bre", batch_size=10)
+    assert next(iterator) == expected[0]
+    assert stats_city_db.stats() == {}
+    assert [expected[0], *iterator] == expected
+
+    method_stats = stats_city_db.stats()["iter_search"]
+    assert method_stats.calls == 1 and method_stats.rows == len(expected)
+
+
+def test_stats_with_pool(data_dir, city_db_without_stats):
+    cities = database.CityDatabase[model.CityInfo](
+        fetch_fields=config.CITY_MIN_FIELDS, query_stats=stats.QueryStats()
+    ).connect(data_dir / "data.db", pool_size=2)
+    assert cities.get_nearest(51.1, 17.03, limit=3) == city_db_without_stats.get_nearest(51.1, 17.03, limit=3)
+    assert cities.stats()["get_nearest"].rows == 3
+    cities.close()
+
+
+def test_stats_callback_errors_are_ignored(stats_city_db, events):
+    def failing_callback(_event):
+        raise RuntimeError
+
+    stats_city_db.query_stats.callback = failing_callback
+    assert stats_city_db.get_city(3081368) is not None
+    assert stats_city_db.stats()["get_city"].calls == 1
+
+
+def test_explain(city_db_without_stats):
+    plans = city_db_without_stats.explain("search", "Kyiv", limit=5)
+    assert len(plans) == 1
+    assert plans[0].params == ("Kyiv", 5)
+    assert any(config.CITY_FTS_TABLE_NAME in line for line in plans[0].plan)
+
+    plans = city_db_without_stats.explain("get_city", 3081368)
+    assert any("PRIMARY KEY" in line or "INTEGER PRIMARY KEY" in line for line in plans[0].plan)
+
+    plans = city_db_without_stats.explain("iter_nearest", 51.1, 17.03, limit=3)
+    assert plans and all(plan.plan for plan in plans)
+
+    with pytest.raises(ValueError):
+        city_db_without_stats.explain("close")
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+import datetime
+import shutil
+import sqlite3
+import zipfile
+
+import pytest
+
+from pycities import build
+from pycities import config
+from pycities import datadump
+from pycities import update
+
+
+KYIV_ID, TULCHYN_ID, VILNYANSK_ID, NEW_CITY_ID = 703448, 691016, 689584, 99999901
+KYIV_UK_ALTERNATE_NAME_ID = 1894926
+UPDATE_DATE = datetime.date(2024, 1, 31)
+
+
+def _geonames_line(geonames_id, name, alternate_names, latitude, longitude, feature_code, population) -> str:
+    values = [
+        geonames_id, name, name, alternate_names, latitude, longitude, "P", feature_code, "UA", "", "12", "", "", "",
+        population, "", 150, "Europe/Kyiv", "2024-01-31",
+    ]
+    return "\t".join(str(value) for value in values) + "\n"
+
+
+@pytest.fixture()
+def update_conn(data_dir, tmp_path):
+    datasource = tmp_path / "data_update.db"
+    shutil.copy(data_dir / "data.db", datasource)
+    conn = sqlite3.connect(datasource)
+    datadump.create_city_spatial_index(conn)
+    datadump.write_build_info(conn, min_population=config.CITY_MIN_POPULATION)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture()
+def update_dir(tmp_path):
+    directory = tmp_path / "updates"
+    directory.mkdir()
+    date = UPDATE_DATE.isoformat()
+    (directory / config.MODIFICATIONS_FILENAME.format(date=date)).write_text(
+        _geonames_line(KYIV_ID, "Kyiv", "Kyiv,Zzyzxgrad", 50.45466, 30.5238, "PPLC", 3000000)
+        + _geonames_line(NEW_CITY_ID, "Novomisto", "Novomisto", 50.1, 30.1, "PPL", 20000)
+        + _geonames_line(TULCHYN_ID, "Tulchyn", "", 48.67448, 28.84641, "PPL", 100),
+        encoding="utf-8",
+    )
+    (directory / config.DELETES_FILENAME.format(date=date)).write_text(
+        f"{VILNYANSK_ID}\tVilnyansk\tduplicate\n", encoding="utf-8"
+    )
+    (directory / config.ALTERNATE_NAMES_MODIFICATIONS_FILENAME.format(date=date)).write_text(
+        f"99999999\t{KYIV_ID}\tuk\tКиїв-місто\t1\t\t\t\t\t\n"
+        f"99999998\t{KYIV_ID}\tzz\tKyivzz\t\t\t\t\t\t\n",
+        encoding="utf-8",
+    )
+    return directory
+
+
+def _fts_ids(conn: sqlite3.Connection, query: str):
+    return [
+        row[0] for row in conn.execute(
+            f"SELECT geonames_id FROM {config.CITY_FTS_TABLE_NAME} WHERE name MATCH ?", (query,)
+        )
+    ]
+
+
+def _count(conn: sqlite3.Connection, table_name: str) -> int:
+    return conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+
+
+def test_apply_daily_updates(update_conn, update_dir):
+    city_count = _count(update_conn, config.CITY_TABLE_NAME)
+    result = update.apply_daily_updates(update_conn, update_dir, UPDATE_DATE)
+    assert result == update.UpdateResult(
+        updated_cities=2, deleted_cities=2, updated_alternate_names=1, deleted_alternate_names=0
+    )
+
+    city_ids = {row[0] for row in update_conn.execute(f"SELECT geonames_id FROM {config.CITY_TABLE_NAME}")}
+    assert NEW_CITY_ID in city_ids and KYIV_ID in city_ids
+    assert TULCHYN_ID not in city_ids and VILNYANSK_ID not in city_ids
+    assert len(city_ids) == city_count - 1
+
+    population, name_uk = update_conn.execute(
+        f"SELECT population, name_uk FROM {config.CITY_TABLE_NAME} WHERE geonames_id = ?", (KYIV_ID,)
+    ).fetchone()
+    assert population == 3000000
+    assert name_uk == "Київ-місто"
+    assert update_conn.execute(
+        f"SELECT COUNT(*) FROM {config.ALTERNATE_NAME_TABLE_NAME} WHERE lang = 'zz'"
+    ).fetchone()[0] == 0
+
+    assert _fts_ids(update_conn, "Zzyzxgrad") == [KYIV_ID]
+    assert _fts_ids(update_conn, "Novomisto") == [NEW_CITY_ID]
+    assert _fts_ids(update_conn, "Vilnyansk") == []
+    assert _count(update_conn, config.CITY_FTS_TABLE_NAME) == len(city_ids)
+    assert _count(update_conn, config.CITY_RTREE_TABLE_NAME) == len(city_ids)
+    box = (50.09, 50.11, 30.09, 30.11)
+    assert update_conn.execute(config.CITY_RTREE_BOX_SELECT, box).fetchall() == [(NEW_CITY_ID,)]
+
+
+def test_apply_alternate_name_deletes(update_conn, tmp_path):
+    deletes_path = tmp_path / config.ALTERNATE_NAMES_DELETES_FILENAME.format(date=UPDATE_DATE.isoformat())
+    deletes_path.write_text(f"{KYIV_UK_ALTERNATE_NAME_ID}\t{KYIV_ID}\tКиїв\n", encoding="utf-8")
+
+    result = update.apply_updates(update_conn, alternate_name_deletes=deletes_path)
+    assert result.deleted_alternate_names == 1
+    expected_name = update_conn.execute(
+        f"SELECT name FROM {config.ALTERNATE_NAME_TABLE_NAME} "
+        f"WHERE geonames_id = ? AND lang = 'uk' AND is_historic IS NULL ORDER BY is_preferred DESC, id LIMIT 1",
+        (KYIV_ID,)
+    ).fetchone()
+    name_uk = update_conn.execute(
+        f"SELECT name_uk FROM {config.CITY_TABLE_NAME} WHERE geonames_id = ?", (KYIV_ID,)
+    ).fetchone()[0]
+    assert name_uk == (expected_name[0] if expected_name else None)
+    assert name_uk != "Київ"
+
+
+def _trigram_ids(conn: sqlite3.Connection, query: str):
+    return [
+        row[0] for row in conn.execute(
+            f"SELECT {config.CITY_NAME_TABLE_NAME}.geonames_id FROM {config.CITY_TRIGRAM_TABLE_NAME} "
+            f"INNER JOIN {config.CITY_NAME_TABLE_NAME} "
+            f"ON {config.CITY_NAME_TABLE_NAME}.id = {config.CITY_TRIGRAM_TABLE_NAME}.rowid "
+            f"WHERE {config.CITY_TRIGRAM_TABLE_NAME} MATCH ?", (query,)
+        )
+    ]
+
+
+def test_apply_daily_updates_trigram_index(update_conn, update_dir):
+    datadump.create_city_trigram_index(update_conn)
+    update.apply_daily_updates(update_conn, update_dir, UPDATE_DATE)
+
+    assert set(_trigram_ids(update_conn, '"zzyzxgrad"')) == {KYIV_ID}
+    assert set(_trigram_ids(update_conn, '"novomisto"')) == {NEW_CITY_ID}
+    assert _trigram_ids(update_conn, '"vilnyansk"') == []
+    update_conn.execute(
+        f"INSERT INTO {config.CITY_TRIGRAM_TABLE_NAME}({config.CITY_TRIGRAM_TABLE_NAME}) VALUES ('integrity-check')"
+    )
+
+
+def test_apply_daily_updates_lookup_tables(update_conn, update_dir):
+    datadump.create_city_lookup_tables(update_conn, ["uk"])
+    update.apply_daily_updates(update_conn, update_dir, UPDATE_DATE)
+
+    for lang in ("", "uk"):
+        table_name = datadump.city_lookup_table_name(lang)
+        assert _count(update_conn, table_name) == _count(update_conn, config.CITY_TABLE_NAME)
+        assert update_conn.execute(
+            f"SELECT COUNT(*) FROM {table_name} WHERE geonames_id IN (?, ?)", (TULCHYN_ID, VILNYANSK_ID)
+        ).fetchone()[0] == 0
+    assert update_conn.execute(
+        f"SELECT name, population FROM {config.CITY_LOOKUP_TABLE_NAME}_uk WHERE geonames_id = ?", (KYIV_ID,)
+    ).fetchone() == ("Київ-місто", 3000000)
+    assert update_conn.execute(
+        f"SELECT name FROM {config.CITY_LOOKUP_TABLE_NAME} WHERE geonames_id = ?", (NEW_CITY_ID,)
+    ).fetchone() == ("Novomisto",)
+
+
+def test_apply_updates_without_build_info(data_dir, tmp_path, update_dir):
+    datasource = tmp_path / "data_update.db"
+    shutil.copy(data_dir / "data.db", datasource)
+    conn = sqlite3.connect(datasource)
+    with pytest.raises(ValueError):
+        update.apply_daily_updates(conn, update_dir, UPDATE_DATE)
+    assert update.apply_daily_updates(conn, update_dir, UPDATE_DATE, min_population=15000).updated_cities == 2
+    conn.close()
+
+
+def test_apply_updates_built_from_cities500(data_dir, tmp_path):
+    geonames_dir = tmp_path / "geonames"
+    geonames_dir.mkdir()
+    for filename in (config.COUNTRIES_FILENAME, config.ADMINISTRATIVE_FILENAME):
+        shutil.copy(data_dir / filename, geonames_dir / filename)
+    with zipfile.ZipFile(data_dir / config.CITIES_ARCHIVE_FILENAME) as source:
+        cities = source.read(config.CITIES_FILENAME)
+    with zipfile.ZipFile(geonames_dir / "cities500.zip", "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr("cities500.txt", cities)
+    with zipfile.ZipFile(geonames_dir / config.ALTERNATE_NAMES_ARCHIVE_FILENAME, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.write(data_dir / config.ALTERNATE_NAMES_FILENAME, config.ALTERNATE_NAMES_FILENAME)
+    output = tmp_path / "built.db"
+    build.build_database(output, geonames_dir, languages=["uk"], min_population=500, download=False)
+
+    modifications_path = tmp_path / config.MODIFICATIONS_FILENAME.format(date=UPDATE_DATE.isoformat())
+    modifications_path.write_text(
+        _geonames_line(NEW_CITY_ID, "Novomisto", "Novomisto", 50.1, 30.1, "PPL", 1000)
+        + _geonames_line(TULCHYN_ID, "Tulchyn", "", 48.67448, 28.84641, "PPL", 100),
+        encoding="utf-8",
+    )
+    conn = sqlite3.connect(output)
+    result = update.apply_updates(conn, modifications=modifications_path)
+    assert (result.updated_cities, result.deleted_cities) == (1, 1)
+    city_ids = {row[0] for row in conn.execute(f"SELECT geonames_id FROM {config.CITY_TABLE_NAME}")}
+    assert NEW_CITY_ID in city_ids and TULCHYN_ID not in city_ids
+    conn.close()
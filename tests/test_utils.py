@@ -14,3 +14,64 @@ from pycities import utils
 def test_calculate_distance(point_1, point_2, expected_distance):
     distance = utils.calculate_distance(*point_1, *point_2)
     assert int(distance) == expected_distance
+
+
+@pytest.mark.parametrize(
+    "point, distance_km, expected_boxes_count",
+    [
+        ((51.1, 17.03333), 50, 1),
+        ((-17.7, 179.99), 50, 2),
+        ((65.5, -179.9), 50, 2),
+        ((89.9, 0.0), 50, 1),
+    ]
+)
+def test_calculate_bounding_boxes(point, distance_km, expected_boxes_count):
+    boxes = utils.calculate_bounding_boxes(*point, distance_km)
+    assert len(boxes) == expected_boxes_count
+    assert all(-90 <= min_lat <= max_lat <= 90 and -180 <= min_long <= max_long <= 180
+               for min_lat, max_lat, min_long, max_long in boxes)
+
+
+@pytest.mark.parametrize(
+    "name, expected_name",
+    [
+        ("Wrocław", "wrocław"),
+        ("  Kraków ", "krakow"),
+        ("São  Paulo", "sao paulo"),
+        ("Київ", "киів"),
+    ]
+)
+def test_normalize_name(name, expected_name):
+    assert utils.normalize_name(name) == expected_name
+
+
+@pytest.mark.parametrize(
+    "name, expected_tokens",
+    [
+        ("Wrocław", ["wrocław"]),
+        ("Ivano-Frankivs'k,Івано-Франківськ", ["ivano", "frankivs", "k", "івано", "франківськ"]),
+        ("São_Paulo", ["sao", "paulo"]),
+        ("Fu̍t-sân-sṳ", ["fu", "t", "san", "su"]),
+        ("Київ,Πάφος", ["київ", "πάφοσ"]),
+        (" ,", []),
+    ]
+)
+def test_name_tokens(name, expected_tokens):
+    assert utils.name_tokens(name) == expected_tokens
+
+
+@pytest.mark.parametrize(
+    "source, target, prefix, expected_distance",
+    [
+        ("kyiv", "kyiv", False, 0),
+        ("wroclw", "wroclaw", False, 1),
+        ("francsico", "francisco", False, 1),
+        ("kiev", "kyiv", False, 2),
+        ("wroc", "wroclaw", False, 3),
+        ("wroc", "wroclaw", True, 0),
+        ("wrcl", "wroclaw", True, 1),
+        ("london", "paris", False, 3),
+    ]
+)
+def test_edit_distance(source, target, prefix, expected_distance):
+    assert utils.edit_distance(source, target, 2, prefix) == min(expected_distance, 3)